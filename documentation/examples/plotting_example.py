@@ -5,8 +5,8 @@ import matplotlib.pyplot as plt
 import astropy.units as u
 from sqlalchemy import func, and_, Integer, cast
 from scripts.ingests.utils import load_simpledb, logger
-from scripts.utils.simple_utils import convert_spt_code_to_string_to_code
-from astrodbkit2.spectra import load_spectrum
+from simple.utils.spectral_types import convert_spt_codes_to_strings
+from simple.utils.spectrum_previews import build_previews
 
 plt.interactive(False)
 logger.setLevel(logging.INFO)
@@ -40,7 +40,7 @@ t = (
     .astropy()
 )
 # Making strings out of the numeric codes
-t["spectral_type"] = convert_spt_code_to_string_to_code(t["spectral_type"], decimals=0)
+t["spectral_type"] = convert_spt_codes_to_strings(t["spectral_type"], decimals=0)
 
 # Bar chart of counts vs spectral types
 fig, ax = plt.subplots(figsize=(8, 6))
@@ -70,6 +70,9 @@ t = (
         db.SpectralTypes.c.spectral_type_code,
         db.Spectra.c.instrument,
         db.Spectra.c.spectrum,
+        db.Spectra.c.regime,
+        db.Spectra.c.observation_date,
+        db.Spectra.c.reference,
     )
     .join(db.Spectra, db.Spectra.c.source == db.SpectralTypes.c.source)
     .filter(db.Spectra.c.instrument == "SpeX")
@@ -78,18 +81,25 @@ t = (
     .astropy()
 )
 
+t["spt"] = convert_spt_codes_to_strings(t["spectral_type_code"], decimals=1)
+
+# Downsampled previews of the spectra: only new spectra are downloaded and read
+previews = build_previews(db)
+
 spectra_dict = {}
 spectra_dict["spt"] = []
 for row in t:
     # Only consider those from spectral types that haven't been fetched yet
-    spt = convert_spt_code_to_string_to_code(row["spectral_type_code"], decimals=1)[0]
+    spt = row["spt"]
     if spt in spectra_dict.get("spt") or not spt.endswith(".0"):
         continue
 
-    spec = load_spectrum(row["spectrum"], spectra_format="Spex Prism")
-    if isinstance(spec, str):
+    try:
+        wave, flux_min, flux_max = previews.preview(row, resolution=1024)
+    except KeyError:
         # Failed to get spectrum
         continue
+    spec = (wave, (flux_min + flux_max) / 2)
 
     # Store results
     spectra_dict["spt"].append(spt)
@@ -108,7 +118,7 @@ for k, v in spectra_dict.items():
     print(v[0], v[1])
 
     # Normalize spectra and offset
-    wave, flux = v[2].wavelength.to(u.micron).value, v[2].flux.value
+    wave, flux = v[2]
     fluxreg = flux[(wave >= minwave) & (wave <= maxwave)]  # cut flux to region
     if len(fluxreg):
         fluxmed = np.nanmedian(fluxreg)
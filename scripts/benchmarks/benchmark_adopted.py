@@ -0,0 +1,74 @@
+# Compare recomputing the adopted parallaxes source by source with recompute_adopted
+# Run from the top level of the repository:
+#   python -m scripts.benchmarks.benchmark_adopted
+import time
+from sqlalchemy import and_
+from astrodbkit2.astrodb import Database
+from simple.schema import REFERENCE_TABLES
+from simple.utils.adopted import recompute_adopted
+from simple.utils.bulk_load import bulk_load_database
+
+DB_PATH = "data"
+
+
+def per_source(db):
+    # One query per source and one update per measurement, as the ingest functions do
+    parallaxes = db.Parallaxes
+    sources = [row[0] for row in db.query(parallaxes.c.source).distinct().all()]
+    with db.engine.begin() as conn:
+        for source in sources:
+            rows = conn.execute(
+                parallaxes.select().where(parallaxes.c.source == source)
+            ).all()
+            best = min(
+                rows,
+                key=lambda row: (row.parallax_error is None, row.parallax_error, row.reference),
+            )
+            for row in rows:
+                conn.execute(
+                    parallaxes.update()
+                    .where(and_(parallaxes.c.source == source, parallaxes.c.reference == row.reference))
+                    .values(adopted=row is best)
+                )
+    return len(sources)
+
+
+def flags(db):
+    return sorted(
+        (row[0], row[1], bool(row[2]))
+        for row in db.query(
+            db.Parallaxes.c.source, db.Parallaxes.c.reference, db.Parallaxes.c.adopted
+        ).all()
+    )
+
+
+if __name__ == "__main__":
+    db = Database("sqlite://", reference_tables=REFERENCE_TABLES)
+    bulk_load_database(db, DB_PATH)
+    n_rows = db.query(db.Parallaxes).count()
+    # As after a bulk edit: no adopted flags left
+    with db.engine.begin() as conn:
+        conn.execute(db.Parallaxes.update().values(adopted=None))
+
+    start = time.perf_counter()
+    changes = recompute_adopted(db, tables=["Parallaxes"], dry_run=True)
+    t_dry_run = time.perf_counter() - start
+    print(f"dry run ({len(changes)} changes):      {t_dry_run * 1000:8.2f} ms")
+
+    start = time.perf_counter()
+    recompute_adopted(db, tables=["Parallaxes"])
+    t_set = time.perf_counter() - start
+    expected = flags(db)
+    print(f"recompute_adopted ({n_rows} rows): {t_set * 1000:8.2f} ms")
+
+    start = time.perf_counter()
+    n_sources = per_source(db)
+    t_loop = time.perf_counter() - start
+    print(f"per-source loop ({n_sources} sources): {t_loop * 1000:8.2f} ms "
+          f"({t_loop / t_set:.0f}x slower)")
+    assert flags(db) == expected
+
+# Results on a 1-CPU Linux container, data/ JSON files:
+# dry run (1444 changes):         35.99 ms
+# recompute_adopted (2632 rows):    52.69 ms
+# per-source loop (1444 sources):  1221.74 ms (23x slower)
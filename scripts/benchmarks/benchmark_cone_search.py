@@ -0,0 +1,80 @@
+# Compare cone searches over Sources by a full scan with the SourceIndex k-d tree
+# Run from the top level of the repository:
+#   python -m scripts.benchmarks.benchmark_cone_search
+import time
+import numpy as np
+import astropy.units as u
+from astropy.coordinates import SkyCoord
+from astrodbkit2.astrodb import Database
+from simple.schema import REFERENCE_TABLES
+from simple.utils.bulk_load import bulk_load_database
+from simple.utils.spatial import SourceIndex, cone_search, cone_search_many
+
+DB_PATH = "data"
+N_QUERIES = 1000
+RADIUS = 60 * u.arcsec
+
+
+def full_scan(db, ra, dec, radius):
+    # Every source is read from the database and compared to the position
+    t = (
+        db.query(db.Sources.c.source, db.Sources.c.ra, db.Sources.c.dec)
+        .filter(db.Sources.c.ra.is_not(None), db.Sources.c.dec.is_not(None))
+        .astropy()
+    )
+    separation = SkyCoord(t["ra"], t["dec"], unit="deg").separation(
+        SkyCoord(ra, dec, unit="deg")
+    )
+    return sorted(t["source"][separation <= radius])
+
+
+if __name__ == "__main__":
+    db = Database("sqlite://", reference_tables=REFERENCE_TABLES)
+    bulk_load_database(db, DB_PATH)
+    rows = db.query(db.Sources.c.ra, db.Sources.c.dec).all()
+    rows = [row for row in rows if row[0] is not None and row[1] is not None]
+
+    # Positions near known sources, so every search finds something
+    rng = np.random.default_rng(0)
+    picks = rng.choice(len(rows), N_QUERIES)
+    ra = np.array([rows[i][0] for i in picks]) + rng.normal(0, 0.005, N_QUERIES)
+    dec = np.array([rows[i][1] for i in picks]) + rng.normal(0, 0.005, N_QUERIES)
+    ra, dec = ra % 360, np.clip(dec, -90, 90)
+
+    start = time.perf_counter()
+    index = SourceIndex(db)
+    t_build = time.perf_counter() - start
+    print(f"SourceIndex build ({len(index)} sources): {t_build * 1000:7.2f} ms")
+
+    n_scan = 20
+    start = time.perf_counter()
+    scanned = [full_scan(db, ra[i], dec[i], RADIUS) for i in range(n_scan)]
+    t_scan = (time.perf_counter() - start) / n_scan
+    print(f"full scan:           {t_scan * 1000:8.3f} ms per search")
+
+    start = time.perf_counter()
+    for i in range(N_QUERIES):
+        index.query(ra[i], dec[i], RADIUS)
+    t_query = (time.perf_counter() - start) / N_QUERIES
+    print(f"SourceIndex.query:   {t_query * 1000:8.3f} ms per search ({t_scan / t_query:.0f}x)")
+
+    start = time.perf_counter()
+    for i in range(N_QUERIES):
+        cone_search(db, ra[i], dec[i], RADIUS, index=index)
+    t_cone = (time.perf_counter() - start) / N_QUERIES
+    print(f"cone_search:         {t_cone * 1000:8.3f} ms per search ({t_scan / t_cone:.0f}x)")
+
+    start = time.perf_counter()
+    results = cone_search_many(db, ra, dec, RADIUS, index=index)
+    t_many = (time.perf_counter() - start) / N_QUERIES
+    print(f"cone_search_many:    {t_many * 1000:8.3f} ms per search ({t_scan / t_many:.0f}x)")
+
+    for i in range(n_scan):
+        assert sorted(results["source"][results["index"] == i]) == scanned[i]
+
+# Results on a 1-CPU Linux container, 3437 sources, 60 arcsec radius:
+# SourceIndex build (3437 sources):   17.44 ms
+# full scan:             28.284 ms per search
+# SourceIndex.query:      0.162 ms per search (175x)
+# cone_search:            0.686 ms per search (41x)
+# cone_search_many:       0.036 ms per search (782x)
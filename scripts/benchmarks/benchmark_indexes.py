@@ -0,0 +1,107 @@
+# Query plans and timings of typical queries with and without the secondary indexes
+# declared in simple/schema.py
+# Run from the top level of the repository:
+#   python -m scripts.benchmarks.benchmark_indexes
+import time
+from sqlalchemy import and_, func, select
+from astrodbkit2.astrodb import Database
+from simple.schema import REFERENCE_TABLES
+from simple.utils.bulk_load import bulk_load_database
+
+DB_PATH = "data"
+REPEAT = 50
+
+
+def typical_queries(db):
+    # The filters used by the tests and the ingest scripts
+    return {
+        "photometry by band": select(db.Photometry).where(
+            db.Photometry.c.band == "2MASS.J"
+        ),
+        "photometry in a rare band": select(db.Photometry).where(
+            db.Photometry.c.band == "GPI.Y"
+        ),
+        "spectra by instrument": select(db.Spectra).where(
+            db.Spectra.c.instrument == "SpeX"
+        ),
+        "spectra by instrument and mode": select(db.Spectra).where(
+            and_(db.Spectra.c.instrument == "SpeX", db.Spectra.c.mode == "Prism")
+        ),
+        "sources by reference": select(db.Sources).where(
+            db.Sources.c.reference == "Schm10.1808"
+        ),
+        "photometry by reference": select(db.Photometry).where(
+            db.Photometry.c.reference == "Cutr03"
+        ),
+        "adopted parallaxes by reference": select(db.Parallaxes).where(
+            and_(db.Parallaxes.c.reference == "GaiaDR2", db.Parallaxes.c.adopted == 1)
+        ),
+        "adopted parallaxes": select(db.Parallaxes).where(db.Parallaxes.c.adopted == 1),
+        "L dwarfs by spectral type code": select(db.SpectralTypes).where(
+            and_(
+                db.SpectralTypes.c.spectral_type_code >= 70,
+                db.SpectralTypes.c.spectral_type_code < 80,
+            )
+        ),
+        "distinct references of Spectra": select(db.Spectra.c.reference).distinct(),
+        "publications without sources": select(db.Publications.c.reference).where(
+            ~select(db.Sources.c.source)
+            .where(db.Sources.c.reference == db.Publications.c.reference)
+            .exists()
+        ),
+        "adopted spectral types of sources": select(
+            db.Sources.c.source, db.SpectralTypes.c.spectral_type_string
+        )
+        .join(db.SpectralTypes, db.SpectralTypes.c.source == db.Sources.c.source)
+        .where(db.SpectralTypes.c.adopted == 1),
+        "sources with several adopted proper motions": select(db.ProperMotions.c.source)
+        .group_by(db.ProperMotions.c.source)
+        .having(func.sum(db.ProperMotions.c.adopted) > 1),
+    }
+
+
+def measure(db):
+    results = {}
+    with db.engine.connect() as conn:
+        for name, query in typical_queries(db).items():
+            sql = str(query.compile(db.engine, compile_kwargs={"literal_binds": True}))
+            plan = [row[-1] for row in conn.exec_driver_sql("EXPLAIN QUERY PLAN " + sql)]
+            start = time.perf_counter()
+            for _ in range(REPEAT):
+                n_rows = len(conn.exec_driver_sql(sql).fetchall())
+            elapsed = (time.perf_counter() - start) / REPEAT
+            results[name] = (plan, elapsed, n_rows)
+    return results
+
+
+def new_database(indexes=True):
+    db = Database("sqlite://", reference_tables=REFERENCE_TABLES)
+    bulk_load_database(db, DB_PATH)
+    if not indexes:
+        with db.engine.begin() as conn:
+            for table in db.metadata.sorted_tables:
+                for index in table.indexes:
+                    conn.exec_driver_sql(f'DROP INDEX "{index.name}"')
+    return db
+
+
+if __name__ == "__main__":
+    # Separate databases: sqlite3 caches statements, including their query plans
+    before = measure(new_database(indexes=False))
+    after = measure(new_database())
+
+    for name in after:
+        plan_before, t_before, n_rows = before[name]
+        plan_after, t_after, _ = after[name]
+        print(f"{name} ({n_rows} rows)")
+        print(f"  without indexes: {t_before * 1000:7.3f} ms  {'; '.join(plan_before)}")
+        print(f"  with indexes:    {t_after * 1000:7.3f} ms  {'; '.join(plan_after)}")
+
+# Results on the data/ JSON files (ms per query, without -> with indexes):
+#   photometry in a rare band                   1.8  -> 0.07
+#   sources by reference                        1.3  -> 0.64
+#   distinct references of Spectra              0.65 -> 0.35
+#   publications without sources              422    -> 2.1
+# Queries that return a large part of a table (a common band, a large reference)
+# are as fast as a full scan. Indexes on the adopted flags and on the spectral
+# type codes were tried and left out: they are not selective and were slower.
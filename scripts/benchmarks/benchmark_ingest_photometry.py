@@ -0,0 +1,65 @@
+# Compare ingesting photometry one row at a time with ingest_photometry_table
+# Run from the top level of the repository:
+#   python -m scripts.benchmarks.benchmark_ingest_photometry
+import time
+from astropy.table import Table
+from astrodbkit2.astrodb import Database
+from simple.schema import REFERENCE_TABLES
+from simple.utils.bulk_load import bulk_load_database
+from simple.utils.photometry import ingest_photometry, ingest_photometry_table
+
+DB_PATH = "data"
+N_PER_ROW = 200  # the per-row path is timed on a subset
+BAND = "Benchmark.X"
+REFERENCE = "Cutr03"
+
+
+def new_database():
+    db = Database("sqlite://", reference_tables=REFERENCE_TABLES)
+    bulk_load_database(db, DB_PATH)
+    with db.engine.begin() as conn:
+        conn.execute(
+            db.PhotometryFilters.insert().values(
+                {"band": BAND, "effective_wavelength": 10000.0}
+            )
+        )
+    return db
+
+
+if __name__ == "__main__":
+    db = new_database()
+    names = [row[0] for row in db.query(db.Sources.c.source).all()]
+    t = Table(
+        {
+            "source": names,
+            "band": [BAND] * len(names),
+            "magnitude": [15.0 + i / len(names) for i in range(len(names))],
+            "magnitude_error": [0.05] * len(names),
+        }
+    )
+
+    start = time.perf_counter()
+    for row in t[:N_PER_ROW]:
+        ingest_photometry(
+            db,
+            source=row["source"],
+            band=row["band"],
+            magnitude=row["magnitude"],
+            magnitude_error=row["magnitude_error"],
+            reference=REFERENCE,
+        )
+    t_row = (time.perf_counter() - start) / N_PER_ROW
+    print(f"ingest_photometry:       {1 / t_row:10.0f} rows/s")
+
+    db = new_database()
+    start = time.perf_counter()
+    results = ingest_photometry_table(db, t, reference=REFERENCE)
+    t_table = (time.perf_counter() - start) / len(t)
+    assert all(results["status"] == "added")
+    print(f"ingest_photometry_table: {1 / t_table:10.0f} rows/s ({t_row / t_table:.0f}x)")
+
+# Results on a 1-CPU Linux container, 3437 sources.
+# find_source_in_db was replaced by an exact-name search_object lookup
+# (astrodb_scripts is not installed there), which underestimates the per-row cost:
+# ingest_photometry:               76 rows/s
+# ingest_photometry_table:      18894 rows/s (250x)
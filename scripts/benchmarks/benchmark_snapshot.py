@@ -0,0 +1,37 @@
+# Build a columnar snapshot of data/ and time read-only startup from it
+# Run from the top level of the repository:
+#   python -m scripts.benchmarks.benchmark_snapshot
+import time
+from simple.utils.snapshot import (
+    build_snapshot,
+    load_snapshot,
+    read_snapshot_tables,
+    check_snapshot,
+)
+
+DB_PATH = "data"
+SNAPSHOT_DIR = "snapshot"
+
+if __name__ == "__main__":
+    start = time.perf_counter()
+    info = build_snapshot(SNAPSHOT_DIR, DB_PATH)
+    print(f"build_snapshot:          {time.perf_counter() - start:6.2f} s")
+    print(f"Snapshot version: {info['version']['version']}")
+
+    start = time.perf_counter()
+    db = load_snapshot(SNAPSHOT_DIR)
+    print(f"load_snapshot (sqlite):  {time.perf_counter() - start:6.2f} s")
+
+    start = time.perf_counter()
+    tables = read_snapshot_tables(SNAPSHOT_DIR)
+    print(f"read_snapshot_tables:    {time.perf_counter() - start:6.2f} s")
+
+    start = time.perf_counter()
+    assert check_snapshot(SNAPSHOT_DIR, DB_PATH)
+    print(f"check_snapshot:          {time.perf_counter() - start:6.2f} s")
+
+# Results on a 1-CPU Linux container, 3444 JSON files (4.5 MB snapshot):
+# build_snapshot:            2.16 s
+# load_snapshot (sqlite):    0.61 s
+# read_snapshot_tables:      0.38 s
+# For comparison, load_database from the JSON files takes 14.56 s
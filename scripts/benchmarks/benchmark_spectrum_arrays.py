@@ -0,0 +1,72 @@
+# Compare reading spectra with Spectrum1D and with load_spectrum_arrays,
+# for a batch job that only needs the median flux of a slice of each spectrum
+# Run from the top level of the repository:
+#   python -m scripts.benchmarks.benchmark_spectrum_arrays
+import os
+import time
+import tempfile
+import warnings
+import numpy as np
+from astropy.io import fits
+from specutils import Spectrum1D
+from simple.utils.spectra_convert import convert_to_fits, load_spectrum_arrays
+
+N_SPECTRA = 100
+N_POINTS = 200_000
+SLICE = slice(100_000, 101_000)
+
+
+def write_spectra(directory, memmap):
+    rng = np.random.default_rng(0)
+    filenames = []
+    for i in range(N_SPECTRA):
+        header = fits.Header()
+        header["OBJECT"] = f"Fake {i}"
+        header["DATE-OBS"] = "2020-01-01"
+        spectrum_table = {
+            "wavelength": np.linspace(0.6, 5.3, N_POINTS),
+            "flux": rng.normal(1, 0.1, N_POINTS),
+            "flux_uncertainty": np.full(N_POINTS, 0.1),
+        }
+        convert_to_fits({"fits_data_dir": directory + "/"}, spectrum_table, header, memmap=memmap)
+        filenames.append(os.path.join(directory, f"Fake {i}_2020-01-01.fits"))
+    return filenames
+
+
+def with_spectrum1d(filenames):
+    return [
+        np.median(Spectrum1D.read(filename, format="tabular-fits").flux.value[SLICE])
+        for filename in filenames
+    ]
+
+
+def with_arrays(filenames):
+    return [np.median(load_spectrum_arrays(filename)[0]["flux"][SLICE]) for filename in filenames]
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, (time.perf_counter() - start) / N_SPECTRA
+
+
+if __name__ == "__main__":
+    warnings.simplefilter("ignore")
+    with tempfile.TemporaryDirectory() as directory:
+        for memmap in (False, True):
+            os.makedirs(os.path.join(directory, str(memmap)))
+            filenames = write_spectra(os.path.join(directory, str(memmap)), memmap)
+            expected, t_spectrum = timed(with_spectrum1d, filenames)
+            medians, t_arrays = timed(with_arrays, filenames)
+            assert np.allclose(expected, medians)
+            print(f"memmap={memmap}: Spectrum1D.read {t_spectrum * 1000:7.3f} ms, "
+                  f"load_spectrum_arrays {t_arrays * 1000:7.3f} ms per spectrum "
+                  f"({t_spectrum / t_arrays:.0f}x)")
+
+# Results on a 1-CPU Linux container:
+# memmap=False: Spectrum1D.read  31.963 ms, load_spectrum_arrays   4.300 ms per spectrum (7x)
+# memmap=True: Spectrum1D.read  32.711 ms, load_spectrum_arrays   4.318 ms per spectrum (8x)
+# Float columns written through astropy Tables are already unscaled doubles;
+# memmap=True guarantees it for integer, float32 or masked inputs, and adds an image
+# extension per column, so the arrays are contiguous instead of strided views of the
+# table rows: a slice of one column only reads the pages of that column.
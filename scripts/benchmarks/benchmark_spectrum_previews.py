@@ -0,0 +1,69 @@
+# Compare reading full spectrum files to draw them with reading their previews
+# Run from the top level of the repository:
+#   python -m scripts.benchmarks.benchmark_spectrum_previews
+import os
+import time
+import tempfile
+import warnings
+import numpy as np
+import astropy.units as u
+from specutils import Spectrum1D
+from simple.utils.spectrum_formats import SpectrumFormats
+from simple.utils.spectrum_previews import SpectrumPreviews
+
+N_SPECTRA = 50
+N_POINTS = 200_000  # about the size of a JWST NIRSpec x1d spectrum
+RESOLUTION = 1024
+
+
+def write_spectra(directory):
+    rng = np.random.default_rng(0)
+    paths = []
+    for i in range(N_SPECTRA):
+        wavelength = np.linspace(0.6, 5.3, N_POINTS) * u.micron
+        flux = rng.normal(1, 0.1, N_POINTS) * u.mJy
+        paths.append(os.path.join(directory, f"spectrum_{i}.fits"))
+        Spectrum1D(spectral_axis=wavelength, flux=flux).write(paths[i], format="tabular-fits")
+    return paths
+
+
+if __name__ == "__main__":
+    warnings.simplefilter("ignore")
+    with tempfile.TemporaryDirectory() as directory:
+        paths = write_spectra(directory)
+        formats = SpectrumFormats(os.path.join(directory, "formats.json"))
+        previews = SpectrumPreviews(os.path.join(directory, "previews.npz"))
+
+        # Reading the full files, as needed to draw them without previews
+        start = time.perf_counter()
+        for path in paths:
+            spectrum = formats.read(path, spectrum=path)
+            wavelength = spectrum.spectral_axis.to(u.micron).value
+            flux = spectrum.flux.value
+        t_full = (time.perf_counter() - start) / N_SPECTRA
+
+        for path in paths:
+            spectrum = formats.read(path, spectrum=path)
+            previews.add(path, path, spectrum.spectral_axis, spectrum.flux)
+        previews.save()
+
+        start = time.perf_counter()
+        reloaded = SpectrumPreviews(previews.file)
+        t_load = time.perf_counter() - start
+        start = time.perf_counter()
+        for path in paths:
+            reloaded.preview(path, resolution=RESOLUTION)
+        t_preview = (time.perf_counter() - start) / N_SPECTRA
+
+        file_size = np.mean([os.path.getsize(path) for path in paths])
+        print(f"Full file read:                {t_full * 1000:8.3f} ms per spectrum "
+              f"({file_size / 1024**2:.1f} MB files)")
+        print(f"Previews file loaded:          {t_load * 1000:8.3f} ms for {N_SPECTRA} spectra "
+              f"({os.path.getsize(previews.file) / 1024:.0f} kB)")
+        print(f"Preview lookup:                {t_preview * 1000:8.3f} ms per spectrum "
+              f"({t_full / (t_preview + t_load / N_SPECTRA):.0f}x with the load)")
+
+# Results on a 1-CPU Linux container, local files (downloads not included):
+# Full file read:                  26.924 ms per spectrum (3.1 MB files)
+# Previews file loaded:            27.833 ms for 50 spectra (437 kB)
+# Preview lookup:                   0.002 ms per spectrum (48x with the load)
@@ -0,0 +1,88 @@
+# Compare the PhotometryView query with the WidePhotometry table
+# Run from the top level of the repository:
+#   python -m scripts.benchmarks.benchmark_wide_photometry
+import time
+import numpy as np
+import sqlalchemy as sa
+from astrodbkit2.astrodb import Database
+from simple.schema import REFERENCE_TABLES
+from simple.utils.bulk_load import bulk_load_database
+from simple.utils.wide_photometry import WidePhotometry
+
+DB_PATH = "data"
+REPEAT = 20
+VIEW_BANDS = ["2MASS.J", "2MASS.H", "2MASS.Ks", "WISE.W1", "WISE.W2", "WISE.W3",
+              "WISE.W4", "IRAC.I1", "IRAC.I2", "IRAC.I3", "IRAC.I4"]
+
+
+def photometry_view(db):
+    # The query of PhotometryView: the whole Photometry table grouped by source
+    photometry = db.Photometry
+    query = sa.select(
+        photometry.c.source,
+        *[
+            sa.func.avg(sa.case((photometry.c.band == band, photometry.c.magnitude))).label(band)
+            for band in VIEW_BANDS
+        ],
+    ).group_by(photometry.c.source)
+    with db.engine.connect() as conn:
+        return conn.execute(query).all()
+
+
+def view_color(db, band_1, band_2):
+    # J-Ks color from the view, as plotting scripts did
+    columns = ["source"] + VIEW_BANDS
+    rows = [dict(zip(columns, row)) for row in photometry_view(db)]
+    return {
+        row["source"]: row[band_1] - row[band_2]
+        for row in rows
+        if row[band_1] is not None and row[band_2] is not None
+    }
+
+
+def timed(function, repeat=REPEAT):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = function()
+    return result, (time.perf_counter() - start) / repeat
+
+
+if __name__ == "__main__":
+    db = Database("sqlite://", reference_tables=REFERENCE_TABLES)
+    bulk_load_database(db, DB_PATH)
+
+    photometry, t_build = timed(lambda: WidePhotometry(db), repeat=1)
+    print(f"WidePhotometry build ({len(photometry)} sources, {len(photometry.bands)} bands): "
+          f"{t_build * 1000:7.2f} ms")
+
+    _, t_view = timed(lambda: photometry_view(db))
+    print(f"PhotometryView query (11 bands):    {t_view * 1000:8.3f} ms")
+    _, t_table = timed(lambda: photometry.table(VIEW_BANDS))
+    print(f"WidePhotometry.table (11 bands):    {t_table * 1000:8.3f} ms ({t_view / t_table:.0f}x)")
+
+    expected, t_view_color = timed(lambda: view_color(db, "2MASS.J", "2MASS.Ks"))
+    print(f"J-Ks from PhotometryView:           {t_view_color * 1000:8.3f} ms")
+    colors, t_color = timed(lambda: photometry.color("2MASS.J", "2MASS.Ks"))
+    print(f"WidePhotometry.color:               {t_color * 1000:8.3f} ms "
+          f"({t_view_color / t_color:.0f}x)")
+    assert sorted(expected) == sorted(colors["source"])
+    assert np.allclose([expected[name] for name in colors["source"]], colors["color"])
+
+    # Updated measurements of one source: only that source is recomputed
+    source = photometry.sources[0]
+    with db.engine.begin() as conn:
+        conn.execute(
+            db.Photometry.update()
+            .where(db.Photometry.c.source == source)
+            .values(magnitude=db.Photometry.c.magnitude + 0.01)
+        )
+    _, t_refresh = timed(photometry.refresh, repeat=1)
+    print(f"refresh after an update:            {t_refresh * 1000:8.3f} ms")
+
+# Results on a 1-CPU Linux container, data/ JSON files:
+# WidePhotometry build (2725 sources, 73 bands):   76.78 ms
+# PhotometryView query (11 bands):      51.831 ms
+# WidePhotometry.table (11 bands):       5.085 ms (10x)
+# J-Ks from PhotometryView:             50.815 ms
+# WidePhotometry.color:                  1.553 ms (33x)
+# refresh after an update:               1.769 ms
@@ -2,6 +2,7 @@ from astrodb_scripts import load_astrodb, ingest_instrument, ingest_publication
 from schema.schema import *
 from scripts.utils.ingest_spectra_utils import ingest_spectrum
 from scripts.utils.photometry import ingest_photometry_filter, ingest_photometry
+from simple.utils.changes import track_changes, save_changes
 import logging
 
 SAVE_DB = False  # save the data files in addition to modifying the .db file
@@ -11,6 +12,7 @@ logger = logging.getLogger("AstroDB")
 logger.setLevel(logging.INFO)
 
 db = load_astrodb("SIMPLE.sqlite", recreatedb=RECREATE_DB)
+tracker = track_changes(db)
 
 file = (
     "https://bdnyc.s3.amazonaws.com/JWST/NIRSpec/jw02124-o051_s00001_nirspec_f290lp-"
@@ -89,4 +91,4 @@ ingest_photometry(
 
 # WRITE THE JSON FILES
 if SAVE_DB:
-    db.save_database(directory="data/")
+    save_changes(tracker, "data/")
@@ -1,4 +1,7 @@
-from scripts.ingests.utils import load_simpledb, find_source_in_db, logger, SimpleError
+from scripts.ingests.utils import load_simpledb, logger, SimpleError
+from simple.utils.crossmatch import crossmatch
+import numpy as np
+import astropy.units as u
 from astropy.io import ascii
 from urllib.parse import quote
 import requests
@@ -42,52 +45,39 @@ uc_sheet_table = ascii.read(
     delimiter=",",
 )
 
-# Match sources in Ultracool sheet to sources in SIMPLE
+# Match sources in Ultracool sheet to sources in SIMPLE, all rows at once
+matches = crossmatch(
+    db,
+    uc_sheet_table,
+    ra_col="ra_j2000_formula",
+    dec_col="dec_j2000_formula",
+    radius=60 * u.arcsec,
+    name_col="name",
+)
 uc_names = []
 simple_urls = []
 simple_sources = []
-no_match = []
-multiple_matches = []
-for source in uc_sheet_table:
-    uc_sheet_name = source["name"]
-    match = find_source_in_db(
-        db,
-        uc_sheet_name,
-        ra=source["ra_j2000_formula"],
-        dec=source["dec_j2000_formula"],
-    )
-
-    # convert SIMPLE source name to URL
-    if len(match) == 0:
-        msg = f"No match found for {uc_sheet_name}"
-        logger.error(msg)
-        no_match.append(uc_sheet_name)
-        # raise SimpleError(msg)
-        continue
-    elif len(match) > 1:
-        msg = f"Multiple matches found for {uc_sheet_name}"
-        logger.error(msg)
-        multiple_matches.append(uc_sheet_name)
-        # raise SimpleError(msg)
-        continue
-    elif len(match) == 1:
-        simple_source = match[0]
-        logger.info(f"Match found for {uc_sheet_name}: {simple_source}")
-        uc_names.append(uc_sheet_name)
-        simple_sources.append(simple_source)
+no_match = list(matches["name"][matches["match"] == "no match"])
+multiple_matches = list(matches["name"][matches["match"] == "ambiguous"])
+for uc_sheet_name in no_match:
+    logger.error(f"No match found for {uc_sheet_name}")
+for uc_sheet_name in multiple_matches:
+    logger.error(f"Multiple matches found for {uc_sheet_name}")
 
-        # URLify source name
-        source_url = quote(simple_source)
-        url = "https://simple-bd-archive.org/solo_result/" + source_url
+for source in matches[np.isin(matches["match"], ["name", "position"])]:
+    uc_sheet_name = source["name"]
+    simple_source = source["db_source"]
+    logger.info(f"Match found for {uc_sheet_name}: {simple_source}")
+    uc_names.append(uc_sheet_name)
+    simple_sources.append(simple_source)
 
-        # check the URL
-        good_url = check_simple_url(url, uc_sheet_name, simple_source)
-        simple_urls.append(good_url)
+    # URLify source name
+    source_url = quote(simple_source)
+    url = "https://simple-bd-archive.org/solo_result/" + source_url
 
-    else:
-        msg = f"Unexpected state for {uc_sheet_name}"
-        logger.error(msg)
-        raise SimpleError(msg)
+    # check the URL
+    good_url = check_simple_url(url, uc_sheet_name, simple_source)
+    simple_urls.append(good_url)
 
 
 # write the results to a file
@@ -1,6 +1,9 @@
+# See also scan_spectra.py, which checks the spectra in parallel and only
+# checks again the spectra that changed or failed.
 from astropy.io import ascii
 from scripts.ingests.utils import *
 from specutils import Spectrum1D
+from simple.utils.spectrum_cache import cached_spectrum_path
 import astropy.units as u
 from datetime import date
 
@@ -46,8 +49,17 @@ for n ,spectrum in enumerate(table):
     file_root = os.path.splitext(file)[1]
     length = len(table)
     #print(n,spectrum[0])
+    # Downloaded once for all the formats tried, and kept for the next runs
     try:
-        spec = Spectrum1D.read(spectrum['spectrum'], format = 'wcs1d-fits')
+        path = cached_spectrum_path(spectrum['spectrum'], spectrum['local_spectrum'])
+    except Exception as e_download:
+        not_working_errors.append(f'download err: {e_download} \n')
+        not_working_spectra.append(spectrum['spectrum'])
+        not_working_names.append(spectrum['source'])
+        not_working_tally += 1
+        continue
+    try:
+        spec = Spectrum1D.read(path, format = 'wcs1d-fits')
         wcs1d_fits_tally +=1
         wcs1d_fits_spectra.append(spectrum['spectrum'])
         wcs1d_fits_names.append(spectrum['source'])
@@ -60,7 +72,7 @@ for n ,spectrum in enumerate(table):
     except Exception as e_wcs1d:
         not_working_errors.append(f'wcs1d err: {e_wcs1d} \n') # this does not work -
         try:
-            spec = Spectrum1D.read(spectrum['spectrum'], format = 'Spex Prism')
+            spec = Spectrum1D.read(path, format = 'Spex Prism')
             spex_prism_tally += 1
             spex_prism_spectra.append(spectrum['spectrum'])
             spex_prism_names.append(spectrum['source'])
@@ -71,15 +83,15 @@ for n ,spectrum in enumerate(table):
         except Exception as e_spex:
             not_working_errors.append(f'spex prism err: {e_spex} \n')
             try:
-                spec = Spectrum1D.read(spectrum['spectrum'], format = 'iraf')
+                spec = Spectrum1D.read(path, format = 'iraf')
                 iraf_tally += 1
             except Exception as e_iraf:
                 try:
-                    spec = Spectrum1D.read(spectrum['spectrum'], format = 'tabular-fits')
+                    spec = Spectrum1D.read(path, format = 'tabular-fits')
                     tabularfits_tally += 1
                 except Exception as e_tabular:
                     try:
-                        spec = Spectrum1D.read(spectrum['spectrum'], format = 'ASCII')
+                        spec = Spectrum1D.read(path, format = 'ASCII')
                         ascii_tally += 1
                     except Exception as e_ascii:
                         not_working_errors.append(f'ascii err: {e_ascii} \n')
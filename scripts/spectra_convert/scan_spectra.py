@@ -0,0 +1,23 @@
+# Check that every spectrum of the database can be read, with a pool of processes.
+# The report is kept in the spectrum cache directory: the next runs only check
+# the spectra that are new, changed or were not ok. Use --rescan to check all of them.
+import argparse
+from scripts.ingests.utils import *
+from simple.utils.spectra_scan import scan_spectra
+
+parser = argparse.ArgumentParser(description="Check that the spectra of SIMPLE can be read")
+parser.add_argument("--workers", type=int, default=os.cpu_count())
+parser.add_argument("--report", help="ECSV report file")
+parser.add_argument("--rescan", action="store_true", help="check all the spectra again")
+parser.add_argument(
+    "--revalidate", action="store_true", help="check again the spectra whose URL serves a new file"
+)
+args = parser.parse_args()
+
+logger.setLevel(logging.INFO)
+
+db = load_simpledb('SIMPLE.db', recreatedb=False)
+report = scan_spectra(
+    db, workers=args.workers, report=args.report, rescan=args.rescan, revalidate=args.revalidate
+)
+report[report['status'] != 'ok']['source', 'spectrum', 'status', 'error'].pprint_all()
@@ -13,6 +13,7 @@ from sqlalchemy import (
     Enum,
     DateTime,
     ForeignKeyConstraint,
+    Index,
 )
 from astrodbkit2.astrodb import Base
 from astrodbkit2.views import view
@@ -131,6 +132,8 @@ class Gravity(enum.Enum):
 
 # -------------------------------------------------------------------------------------------------------------------
 # Main tables
+# Besides the primary keys, columns used to filter the tables
+# (references, bands, instruments) have secondary indexes.
 class Sources(Base):
     """ORM for the sources table. This stores the main identifiers
     for our objects along with ra and dec"""
@@ -145,6 +148,7 @@ class Sources(Base):
         String(30),
         ForeignKey("Publications.reference", onupdate="cascade"),
         nullable=False,
+        index=True,
     )
     other_references = Column(String(100))
     comments = Column(String(1000))
@@ -170,7 +174,9 @@ class Photometry(Base):
         nullable=False,
         primary_key=True,
     )
-    band = Column(String(30), ForeignKey("PhotometryFilters.band"), primary_key=True)
+    band = Column(
+        String(30), ForeignKey("PhotometryFilters.band"), primary_key=True, index=True
+    )
     magnitude = Column(Float, nullable=False)
     magnitude_error = Column(Float)
     telescope = Column(String(30), ForeignKey('Telescopes.telescope'))
@@ -180,6 +186,7 @@ class Photometry(Base):
         String(30),
         ForeignKey("Publications.reference", onupdate="cascade"),
         primary_key=True,
+        index=True,
     )
 
 
@@ -200,6 +207,7 @@ class Parallaxes(Base):
         String(30),
         ForeignKey("Publications.reference", onupdate="cascade"),
         primary_key=True,
+        index=True,
     )
 
 
@@ -222,6 +230,7 @@ class ProperMotions(Base):
         String(30),
         ForeignKey("Publications.reference", onupdate="cascade"),
         primary_key=True,
+        index=True,
     )
 
 
@@ -242,6 +251,7 @@ class RadialVelocities(Base):
         String(30),
         ForeignKey("Publications.reference", onupdate="cascade"),
         primary_key=True,
+        index=True,
     )
 
 
@@ -269,6 +279,7 @@ class SpectralTypes(Base):
         String(30),
         ForeignKey("Publications.reference", onupdate="cascade"),
         primary_key=True,
+        index=True,
     )
 
 
@@ -293,6 +304,7 @@ class Gravities(Base):
         String(30),
         ForeignKey("Publications.reference", onupdate="cascade"),
         primary_key=True,
+        index=True,
     )
 
 
@@ -329,6 +341,7 @@ class Spectra(Base):
         String(30),
         ForeignKey("Publications.reference", onupdate="cascade"),
         primary_key=True,
+        index=True,
     )
     other_references = Column(String(100))
 
@@ -339,6 +352,8 @@ class Spectra(Base):
             [Instruments.telescope, Instruments.instrument, Instruments.mode],
             onupdate="cascade",
         ),
+        # Spectra are often selected by instrument, or instrument and mode
+        Index("ix_Spectra_instrument_mode", instrument, mode),
         {},
     )
 
@@ -366,6 +381,7 @@ class ModeledParameters(Base):
         String(30),
         ForeignKey("Publications.reference", onupdate="cascade"),
         primary_key=True,
+        index=True,
     )
 
 
@@ -386,7 +402,9 @@ class CompanionRelationships(Base):
     # Options: Child, Sibling, Parent, Unresolved Parent
     comments = Column(String(1000))
     reference = Column(
-        String(30), ForeignKey("Publications.reference", onupdate="cascade")
+        String(30),
+        ForeignKey("Publications.reference", onupdate="cascade"),
+        index=True,
     )
     other_companion_names = Column(String(10000))  # other names of the companions
 
@@ -406,7 +424,7 @@ ParallaxView = view(
         Parallaxes.reference.label("reference"),
     )
     .select_from(Parallaxes)
-    .where(sa.and_(Parallaxes.adopted is True, Parallaxes.parallax > 0)),
+    .where(sa.and_(Parallaxes.adopted.is_(True), Parallaxes.parallax > 0)),
 )
 
 PhotometryView = view(
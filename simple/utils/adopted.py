@@ -0,0 +1,192 @@
+import logging
+import numpy as np
+import sqlalchemy as sa
+from astropy.table import Table
+
+__all__ = [
+    "ADOPTION_PARTITIONS",
+    "ADOPTION_RULES",
+    "recompute_adopted",
+]
+
+logger = logging.getLogger("SIMPLE")
+
+# Number of sources per statement when recomputing a subset of sources
+CHUNK_SIZE = 500
+
+
+def _total_proper_motion_error(table):
+    return (
+        table.c.mu_ra_error * table.c.mu_ra_error
+        + table.c.mu_dec_error * table.c.mu_dec_error
+    )
+
+
+# Order of the measurements of a source; the first one is adopted.
+# Items are column names, with a leading "-" for descending order, or functions
+# of the table returning a SQL expression. Null values come last, and the primary
+# key columns break the remaining ties.
+# The rules replace the adopted flags in the data, including choices curated by hand:
+# on data/, the defaults flip 19 ProperMotions flags from True to False, and set 25 False
+# and 3729 null SpectralTypes flags to True, one per source and regime.
+# Review a dry_run of recompute_adopted before applying it.
+ADOPTION_RULES = {
+    "Parallaxes": ["parallax_error"],
+    "ProperMotions": [_total_proper_motion_error],
+    "RadialVelocities": ["radial_velocity_error"],
+    "SpectralTypes": ["spectral_type_error"],
+}
+
+# Columns within which one measurement is adopted; default ["source"].
+# A source has an adopted spectral type in each regime.
+ADOPTION_PARTITIONS = {
+    "SpectralTypes": ["source", "regime"],
+}
+
+
+def _order_by(table, rule):
+    """ORDER BY clauses of a rule, with the primary key as the last tie-breaks"""
+    clauses = []
+    for item in rule:
+        if callable(item):
+            clauses.append(sa.nulls_last(item(table).asc()))
+        elif item.startswith("-"):
+            clauses.append(sa.nulls_last(table.c[item[1:]].desc()))
+        else:
+            clauses.append(sa.nulls_last(table.c[item].asc()))
+    clauses.extend(column.asc() for column in table.primary_key.columns)
+    return clauses
+
+
+def _ranked(table, rule, sources):
+    """Primary key, current and recomputed adopted flag of the rows of the sources"""
+    keys = list(table.primary_key.columns)
+    partition = ADOPTION_PARTITIONS.get(table.name, ["source"])
+    rank = sa.func.row_number().over(
+        partition_by=[table.c[column] for column in partition],
+        order_by=_order_by(table, rule),
+    )
+    query = sa.select(*keys, table.c.adopted, (rank == 1).label("new_adopted"))
+    if sources is not None:
+        query = query.where(table.c.source.in_(sources))
+    return query.subquery("ranked")
+
+
+def _changed(ranked):
+    """Condition of the rows whose adopted flag changes; null counts as not adopted"""
+    return sa.func.coalesce(ranked.c.adopted, False) != ranked.c.new_adopted
+
+
+def _changes(conn, table, ranked):
+    """Rows whose adopted flag changes"""
+    keys = [ranked.c[column.key] for column in table.primary_key.columns]
+    query = (
+        sa.select(*keys, ranked.c.adopted, ranked.c.new_adopted)
+        .where(_changed(ranked))
+        .order_by(*keys)
+    )
+    return conn.execute(query).all()
+
+
+def recompute_adopted(db, tables=None, sources=None, rules=None, dry_run=False):
+    """
+    Recompute the adopted flags of measurement tables with one UPDATE per table.
+
+    For each source, the first measurement in the order of the table's rule is
+    adopted and the others are not: by default the smallest error, see ADOPTION_RULES.
+    Spectral types are adopted per source and regime, see ADOPTION_PARTITIONS.
+    Null flags count as not adopted: they become True on the first measurement
+    of a source and are left as they are on the others.
+    Flags set by hand that disagree with the rule are overwritten, so check the
+    changes with dry_run first.
+    The measurements are ranked with a window function in the database, so no
+    source is loaded in Python. Use it to fix the flags after bulk edits or deletes,
+    instead of looping over the sources.
+
+    Parameters
+    ----------
+    db: astrodbkit2.astrodb.Database
+        Database object created by astrodbkit2
+    tables: list[str], optional
+        Tables to recompute. Default: all tables of the rules
+    sources: list[str], optional
+        Sources.source values to recompute. Default: all sources
+    rules: dict, optional
+        {table: order} replacing some of ADOPTION_RULES, eg
+        {"Parallaxes": ["parallax_error", "-reference"]}
+    dry_run: bool
+        If True, only return the changes, without updating the database
+
+    Returns
+    -------
+    changes: astropy.table.Table
+        One row for each measurement whose adopted flag changes, with the columns
+        table, source, reference, key (the other primary key values, comma-separated),
+        old_adopted and new_adopted
+
+    Examples
+    ----------
+    > changes = recompute_adopted(db, tables=["SpectralTypes"], dry_run=True)
+    > changes.pprint_all()
+    > recompute_adopted(db, tables=["SpectralTypes"])
+    """
+    rules = {**ADOPTION_RULES, **(rules or {})}
+    if tables is None:
+        tables = list(rules)
+    chunks = [None]
+    if sources is not None:
+        sources = list(sources)
+        chunks = [
+            sources[start : start + CHUNK_SIZE]
+            for start in range(0, len(sources), CHUNK_SIZE)
+        ]
+
+    changes = []
+    with db.engine.begin() as conn:
+        for table_name in tables:
+            table = db.metadata.tables[table_name]
+            other_keys = [
+                column.key
+                for column in table.primary_key.columns
+                if column.key not in ("source", "reference")
+            ]
+            for chunk in chunks:
+                ranked = _ranked(table, rules[table_name], chunk)
+                rows = _changes(conn, table, ranked)
+                for row in rows:
+                    row = row._mapping
+                    changes.append(
+                        (
+                            table_name,
+                            row["source"],
+                            row["reference"],
+                            ", ".join(str(row[key]) for key in other_keys),
+                            row["adopted"],
+                            bool(row["new_adopted"]),
+                        )
+                    )
+                if dry_run or not rows:
+                    continue
+                conn.execute(
+                    table.update()
+                    .values(adopted=ranked.c.new_adopted)
+                    .where(
+                        sa.and_(
+                            *[
+                                column.is_not_distinct_from(ranked.c[column.key])
+                                for column in table.primary_key.columns
+                            ],
+                            _changed(ranked),
+                        )
+                    )
+                )
+
+    n_sources = len({(change[0], change[1]) for change in changes})
+    action = "Would change" if dry_run else "Changed"
+    logger.info(f"{action} {len(changes)} adopted flags of {n_sources} sources")
+    columns = ["table", "source", "reference", "key", "old_adopted", "new_adopted"]
+    if not changes:
+        return Table(names=columns, dtype=[str, str, str, str, object, bool])
+    results = Table(rows=changes, names=columns)
+    results["old_adopted"] = np.array([change[4] for change in changes], dtype=object)
+    return results
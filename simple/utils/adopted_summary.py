@@ -0,0 +1,351 @@
+import logging
+import weakref
+import numpy as np
+import astropy.units as u
+import sqlalchemy as sa
+from astropy.table import MaskedColumn, Table
+from sqlalchemy import event, func, null, select
+from sqlalchemy.sql.dml import Insert, Update, Delete
+from sqlalchemy.sql.elements import TextClause
+from simple.utils.changes import (
+    _affected_sources,
+    _PendingChanges,
+    _statement_values,
+    READ_ONLY_SQL,
+)
+
+__all__ = [
+    "AdoptedSummary",
+    "adopted_summary",
+]
+
+logger = logging.getLogger("SIMPLE")
+
+# Number of sources per query when refreshing changed sources
+CHUNK_SIZE = 500
+
+# Summary columns taken from each table: {summary column: table column}
+MEASUREMENTS = {
+    "Parallaxes": {
+        "parallax": "parallax",
+        "parallax_error": "parallax_error",
+        "parallax_reference": "reference",
+    },
+    "ProperMotions": {
+        "mu_ra": "mu_ra",
+        "mu_ra_error": "mu_ra_error",
+        "mu_dec": "mu_dec",
+        "mu_dec_error": "mu_dec_error",
+        "proper_motion_reference": "reference",
+    },
+    "RadialVelocities": {
+        "radial_velocity": "radial_velocity",
+        "radial_velocity_error": "radial_velocity_error",
+        "radial_velocity_reference": "reference",
+    },
+    "SpectralTypes": {
+        "spectral_type_string": "spectral_type_string",
+        "spectral_type_code": "spectral_type_code",
+        "spectral_type_error": "spectral_type_error",
+        "spectral_type_reference": "reference",
+    },
+    "Gravities": {
+        "gravity": "gravity",
+        "gravity_reference": "reference",
+    },
+}
+
+# Columns of the summary tables, in order
+COLUMNS = [
+    "source",
+    "ra",
+    "dec",
+    "parallax",
+    "parallax_error",
+    "distance",
+    "distance_error",
+    "parallax_reference",
+    *MEASUREMENTS["ProperMotions"],
+    *MEASUREMENTS["RadialVelocities"],
+    *MEASUREMENTS["SpectralTypes"],
+    *MEASUREMENTS["Gravities"],
+]
+
+UNITS = {
+    "ra": u.deg,
+    "dec": u.deg,
+    "parallax": u.mas,
+    "parallax_error": u.mas,
+    "distance": u.pc,
+    "distance_error": u.pc,
+    "mu_ra": u.mas / u.yr,
+    "mu_ra_error": u.mas / u.yr,
+    "mu_dec": u.mas / u.yr,
+    "mu_dec_error": u.mas / u.yr,
+    "radial_velocity": u.km / u.s,
+    "radial_velocity_error": u.km / u.s,
+}
+
+TEXT_COLUMNS = {
+    "spectral_type_string",
+    "gravity",
+    "parallax_reference",
+    "proper_motion_reference",
+    "radial_velocity_reference",
+    "spectral_type_reference",
+    "gravity_reference",
+}
+
+# AdoptedSummary of each database, see adopted_summary
+_summaries = weakref.WeakKeyDictionary()
+
+
+def _adopted_rows(db, table_name, sources=None):
+    """
+    Subquery of the adopted row of each source in a table, or its only row
+    if it has a single one
+    """
+    table = db.metadata.tables[table_name]
+    adopted = table.c.adopted if "adopted" in table.c else null()
+    ranked = select(
+        table.c.source,
+        adopted.label("adopted"),
+        *[table.c[column].label(name) for name, column in MEASUREMENTS[table_name].items()],
+        func.row_number()
+        .over(partition_by=table.c.source, order_by=[adopted.desc(), table.c.reference])
+        .label("rank"),
+        func.count().over(partition_by=table.c.source).label("n_rows"),
+    )
+    if sources is not None:
+        ranked = ranked.where(table.c.source.in_(sources))
+    ranked = ranked.subquery()
+    return (
+        select(ranked.c.source, *[ranked.c[name] for name in MEASUREMENTS[table_name]])
+        .where(ranked.c.rank == 1, sa.or_(ranked.c.adopted.is_(True), ranked.c.n_rows == 1))
+        .subquery(table_name)
+    )
+
+
+def _summary_query(db, sources=None):
+    """
+    Select of the summary rows of some or all Sources, in the order of COLUMNS.
+    sources is a list of names or an expanding bind parameter.
+    """
+    joined = db.Sources
+    adopted = {}
+    for table_name in MEASUREMENTS:
+        adopted[table_name] = _adopted_rows(db, table_name, sources)
+        joined = joined.outerjoin(
+            adopted[table_name], adopted[table_name].c.source == db.Sources.c.source
+        )
+    columns = {
+        "source": db.Sources.c.source,
+        "ra": db.Sources.c.ra,
+        "dec": db.Sources.c.dec,
+    }
+    for table_name in MEASUREMENTS:
+        for name in MEASUREMENTS[table_name]:
+            columns[name] = adopted[table_name].c[name]
+    parallax = columns["parallax"]
+    columns["distance"] = sa.case((parallax > 0, 1000.0 / parallax))
+    columns["distance_error"] = sa.case(
+        (parallax > 0, 1000.0 * columns["parallax_error"] / (parallax * parallax))
+    )
+    query = select(*[columns[name].label(name) for name in COLUMNS]).select_from(joined)
+    if sources is not None:
+        query = query.where(db.Sources.c.source.in_(sources))
+    return query
+
+
+class AdoptedSummary:
+    """
+    Summary of the database with one row per source, with its position and
+    adopted parallax, distance, proper motion, radial velocity, spectral type
+    and gravity.
+
+    The adopted row of each table is used, or the only row of a source
+    with a single measurement. Gravities has no adopted flag: a source
+    has a gravity only if it has a single one. Distances are 1000 / parallax,
+    for positive parallaxes.
+
+    The rows are computed with a single SELECT over Sources and the measurement
+    tables and kept in memory, so nothing is written to the database.
+    The summary listens to the database engine: when the ingest functions,
+    or other statements, insert, update or delete rows of some sources,
+    the rows of those sources are selected again on the next access,
+    once their transaction has committed. Text SQL that writes to the database
+    rebuilds the whole summary.
+    The summary holds the database through a weak reference.
+
+    Parameters
+    ----------
+    db: astrodbkit2.astrodb.Database
+        Database object created by astrodbkit2
+
+    Examples
+    ----------
+    > summary = AdoptedSummary(db)
+    > summary.row("2MASS J00192626+4614078")
+    > nearby = summary.table()
+    > nearby[nearby["distance"] < 20]
+    """
+
+    def __init__(self, db):
+        self._db = weakref.ref(db)
+        # Statements built once, so that they are compiled once
+        self._query_all = _summary_query(db)
+        self._query_sources = _summary_query(db, sa.bindparam("sources", expanding=True))
+        # {source: summary row}
+        self._rows = {}
+        self._stale = True
+        self._changed = set()
+        self._build()
+        self._engine = db.engine
+        self._pending = _PendingChanges(db.engine, self._apply_changes)
+        event.listen(db.engine, "before_execute", self._before_execute)
+
+    @property
+    def db(self):
+        """The summarized database"""
+        db = self._db()
+        if db is None:
+            raise ReferenceError("The database of the summary no longer exists")
+        return db
+
+    def stop(self):
+        """Stop listening to the database engine"""
+        if event.contains(self._engine, "before_execute", self._before_execute):
+            event.remove(self._engine, "before_execute", self._before_execute)
+            self._pending.stop()
+
+    def _build(self):
+        with self.db.engine.connect() as conn:
+            self._rows = {row[0]: row for row in conn.execute(self._query_all)}
+        self._stale = False
+        self._changed = set()
+        logger.debug(f"Built adopted summary: {len(self)} sources")
+
+    def _update_changed(self):
+        """Recompute the rows of the sources whose data changed"""
+        changed = sorted(self._changed)
+        self._changed = set()
+        with self.db.engine.connect() as conn:
+            for start in range(0, len(changed), CHUNK_SIZE):
+                chunk = changed[start : start + CHUNK_SIZE]
+                for source in chunk:
+                    self._rows.pop(source, None)
+                for row in conn.execute(self._query_sources, {"sources": chunk}):
+                    self._rows[row[0]] = row
+        logger.debug(f"Refreshed adopted summary of {len(changed)} sources")
+
+    def refresh(self):
+        """Apply the committed changes of the database now, instead of on the next access"""
+        if self._stale:
+            self._build()
+        elif self._changed:
+            self._update_changed()
+
+    def _before_execute(self, conn, clauseelement, multiparams, params, execution_options):
+        if isinstance(clauseelement, TextClause):
+            if not clauseelement.text.lstrip().upper().startswith(READ_ONLY_SQL):
+                self._pending.add(conn, None)
+            return
+        if not isinstance(clauseelement, (Insert, Update, Delete)):
+            return
+        if clauseelement.table.name not in ("Sources", *MEASUREMENTS):
+            return
+
+        if isinstance(clauseelement, Insert):
+            rows = _statement_values(clauseelement, multiparams, params)
+            sources = {row.get("source") for row in rows}
+            if None in sources:
+                sources = None
+        else:
+            sources = _affected_sources(conn, clauseelement, multiparams, params)
+        self._pending.add(conn, sources)
+
+    def _apply_changes(self, changes):
+        """Changed sources of a committed transaction, or None to rebuild"""
+        if self._stale:
+            return
+        if None in changes:
+            self._stale = True
+            return
+        for sources in changes:
+            self._changed.update(sources)
+
+    def __len__(self):
+        self.refresh()
+        return len(self._rows)
+
+    def table(self, sources=None):
+        """
+        Summary of all or some sources.
+
+        Parameters
+        ----------
+        sources: list[str], optional
+            Sources.source values. Default: all Sources, sorted by name
+
+        Returns
+        -------
+        table: astropy.table.Table
+            Columns source, ra, dec, parallax, parallax_error, distance, distance_error,
+            mu_ra, mu_ra_error, mu_dec, mu_dec_error, radial_velocity,
+            radial_velocity_error, spectral_type_string, spectral_type_code,
+            spectral_type_error, gravity and the references of the adopted values,
+            masked where a source has no adopted value
+        """
+        self.refresh()
+        if sources is None:
+            sources = sorted(self._rows)
+        rows = [self._rows[name] for name in sources if name in self._rows]
+
+        columns = []
+        for name, values in zip(COLUMNS, zip(*rows) if rows else [()] * len(COLUMNS)):
+            if name == "source" or name in TEXT_COLUMNS:
+                mask = np.equal(np.array(values, dtype=object), None)
+                values = np.array(["" if value is None else value for value in values], dtype=str)
+            else:
+                # None becomes nan
+                values = np.array(values, dtype=float)
+                mask = np.isnan(values)
+            columns.append(MaskedColumn(values, name=name, mask=mask, unit=UNITS.get(name)))
+        return Table(columns, copy=False)
+
+    def row(self, source):
+        """
+        Summary of one source.
+
+        Parameters
+        ----------
+        source: str
+            Sources.source value
+
+        Returns
+        -------
+        row: dict or None
+            {column: value}, with None where the source has no adopted value,
+            or None if the source is not in the database
+        """
+        self.refresh()
+        if source not in self._rows:
+            return None
+        return dict(self._rows[source]._mapping)
+
+
+def adopted_summary(db):
+    """
+    The AdoptedSummary of a database, built on the first call and shared afterwards.
+
+    Parameters
+    ----------
+    db: astrodbkit2.astrodb.Database
+
+    Returns
+    -------
+    summary: AdoptedSummary
+    """
+    if db not in _summaries:
+        _summaries[db] = AdoptedSummary(db)
+    return _summaries[db]
@@ -1,11 +1,11 @@
 from astropy.table import Table
 import logging
-from sqlalchemy import and_
+import numpy as np
+from sqlalchemy import and_, bindparam
 import sqlalchemy.exc
-from astrodb_scripts import (
-    AstroDBError,
-    find_source_in_db,
-)
+from astrodb_scripts import AstroDBError
+from simple.utils.resolver import SourceResolver, find_source
+from simple.utils.tables import table_values
 
 
 __all__ = [
@@ -17,7 +17,9 @@ logger = logging.getLogger("SIMPLE")
 
 
 # PARALLAXES
-def ingest_parallaxes(db, sources, plxs, plx_errs, plx_refs, comments=None):
+def ingest_parallaxes(
+    db, sources, plxs, plx_errs, plx_refs, comments=None, resolver=None, bulk=False
+):
     """
 
     Parameters
@@ -33,10 +35,19 @@ def ingest_parallaxes(db, sources, plxs, plx_errs, plx_refs, comments=None):
     plx_refs: str or list[str]
         list of references for the parallax data
     comments: Optional[Union[List[str], str]]
+    resolver: SourceResolver, optional
+        Resolver used to match the source names, instead of find_source_in_db
+    bulk: bool, optional
+        True: match all names with a SourceResolver, load the existing parallaxes
+        of all sources in one query, decide duplicates and adopted flags in memory
+        and write everything in one transaction. Nothing is written if any name
+        does not match a unique source. The adopted flags are the same as when
+        adding the measurements one at a time.
 
     Examples
     ----------
     > ingest_parallaxes(db, my_sources, my_plx, my_plx_unc, my_plx_refs)
+    > ingest_parallaxes(db, gaia_sources, gaia_plx, gaia_plx_unc, "GaiaDR3", bulk=True)
 
     """
 
@@ -62,11 +73,16 @@ def ingest_parallaxes(db, sources, plxs, plx_errs, plx_refs, comments=None):
             input_float_values[i] = input_value
     plxs, plx_errs = input_float_values
 
+    if bulk:
+        return _ingest_parallaxes_bulk(
+            db, sources, plxs, plx_errs, plx_refs, comments, resolver
+        )
+
     n_added = 0
 
     # loop through sources with parallax data to ingest
     for i, source in enumerate(sources):
-        db_name = find_source_in_db(db, source)
+        db_name = find_source(db, source, resolver=resolver)
 
         if len(db_name) != 1:
             msg = f"No unique source match for {source} in the database"
@@ -77,8 +93,12 @@ def ingest_parallaxes(db, sources, plxs, plx_errs, plx_refs, comments=None):
         # Search for existing parallax data and determine if this is the best
         # If no previous measurement exists, set the new one to the Adopted measurement
         adopted = None
+        # In primary key order, so the first adopted row is the one unset below
         source_plx_data: Table = (
-            db.query(db.Parallaxes).filter(db.Parallaxes.c.source == db_name).table()
+            db.query(db.Parallaxes)
+            .filter(db.Parallaxes.c.source == db_name)
+            .order_by(db.Parallaxes.c.reference)
+            .table()
         )
 
         if source_plx_data is None or len(source_plx_data) == 0:
@@ -181,9 +201,170 @@ def ingest_parallaxes(db, sources, plxs, plx_errs, plx_refs, comments=None):
     return
 
 
+def _ingest_parallaxes_bulk(db, sources, plxs, plx_errs, plx_refs, comments, resolver):
+    """
+    Set-based version of ingest_parallaxes, used with bulk=True.
+
+    New measurements are processed in rounds: round k handles the k-th new measurement
+    of every source at once, against per-source arrays of the number of measurements,
+    the smallest error and the adopted measurement. This gives the same adopted flags
+    as adding the measurements one at a time, in input order.
+    """
+    names = ["source", "parallax", "parallax_error", "reference", "comments"]
+    inputs = Table([sources, plxs, plx_errs, plx_refs, comments], names=names)
+    sources, plxs, plx_errs, plx_refs, comments = [
+        table_values(inputs, name) for name in names
+    ]
+    n_rows = len(sources)
+
+    if resolver is None:
+        resolver = SourceResolver(db)
+        resolver.stop()
+    db_names = []
+    for source in sources:
+        db_name = resolver.resolve(source)
+        if len(db_name) != 1:
+            msg = f"No unique source match for {source} in the database"
+            raise AstroDBError(msg)
+        db_names.append(db_name[0])
+
+    # Existing measurements of all the sources, in one query
+    unique_names, source_index = np.unique(db_names, return_inverse=True)
+    n_sources = len(unique_names)
+    position = {name: i for i, name in enumerate(unique_names)}
+    existing = []
+    for start in range(0, n_sources, 500):
+        existing += (
+            db.query(
+                db.Parallaxes.c.source,
+                db.Parallaxes.c.reference,
+                db.Parallaxes.c.parallax_error,
+                db.Parallaxes.c.adopted,
+            )
+            .filter(db.Parallaxes.c.source.in_(unique_names[start : start + 500].tolist()))
+            .all()
+        )
+
+    # Per-source state. Measurements are labelled by (source, reference).
+    count = np.zeros(n_sources, dtype=int)
+    min_error = np.full(n_sources, np.inf)
+    adopted_keys = [set() for _ in range(n_sources)]
+    keys = set()
+    for source, reference, error, adopted in existing:
+        i = position[source]
+        count[i] += 1
+        if error is not None:
+            min_error[i] = min(min_error[i], error)
+        if adopted:
+            adopted_keys[i].add((source, reference))
+        keys.add((source, reference))
+
+    errors = np.array([np.nan if e is None else e for e in plx_errs], dtype=float)
+    new_adopted = {}  # adopted flag of each new measurement
+    unset = set()  # measurements whose adopted flag is removed
+
+    # Round k holds the k-th new measurement of each source
+    order = np.argsort(source_index, kind="stable")
+    first = np.searchsorted(source_index[order], source_index[order], side="left")
+    occurrence = np.empty(n_rows, dtype=int)
+    occurrence[order] = np.arange(n_rows) - first
+    for k in range(occurrence.max() + 1 if n_rows else 0):
+        rows = np.flatnonzero(occurrence == k)
+        row_keys = [(db_names[r], plx_refs[r]) for r in rows]
+        duplicate = np.array([key in keys for key in row_keys], dtype=bool)
+        if duplicate.any():
+            logger.debug(f"Duplicate measurements: {np.array(row_keys)[duplicate]}")
+        rows, row_keys = rows[~duplicate], [
+            key for key, dupe in zip(row_keys, duplicate) if not dupe
+        ]
+        s = source_index[rows]
+
+        first_measurement = count[s] == 0
+        has_adopted = np.array([len(adopted_keys[i]) > 0 for i in s], dtype=bool)
+        # NaN errors never compare as smaller, like missing errors today
+        better = errors[rows] < min_error[s]
+
+        for r, key, is_first, is_adopted, is_better, i in zip(
+            rows, row_keys, first_measurement, has_adopted, better, s
+        ):
+            if is_first:
+                flag = True
+            elif is_adopted:
+                flag = bool(is_better)
+                if flag:
+                    # The first adopted row in primary key order is unset, as in
+                    # the one at a time path, which reads the rows in that order
+                    old_key = min(adopted_keys[i])
+                    adopted_keys[i].remove(old_key)
+                    unset.add(old_key)
+            else:
+                flag = None
+            new_adopted[key] = (r, flag)
+            if flag:
+                adopted_keys[i].add(key)
+            keys.add(key)
+
+        count[s] += 1
+        min_error[s] = np.fmin(min_error[s], errors[rows])
+
+    # Previously adopted measurements in this batch are updated before the insert
+    updates = []
+    for key in unset:
+        if key in new_adopted:
+            r, _ = new_adopted[key]
+            new_adopted[key] = (r, False)
+        else:
+            updates.append({"b_source": key[0], "b_reference": key[1]})
+
+    parallax_data = [
+        {
+            "source": db_names[r],
+            "parallax": plxs[r],
+            "parallax_error": plx_errs[r],
+            "reference": plx_refs[r],
+            "adopted": flag,
+            "comments": comments[r],
+        }
+        for r, flag in sorted(new_adopted.values(), key=lambda item: item[0])
+    ]
+
+    try:
+        with db.engine.begin() as conn:
+            if updates:
+                conn.execute(
+                    db.Parallaxes.update()
+                    .where(
+                        and_(
+                            db.Parallaxes.c.source == bindparam("b_source"),
+                            db.Parallaxes.c.reference == bindparam("b_reference"),
+                        )
+                    )
+                    .values(adopted=False),
+                    updates,
+                )
+            if parallax_data:
+                conn.execute(db.Parallaxes.insert(), parallax_data)
+    except sqlalchemy.exc.IntegrityError as e:
+        msg = (
+            "The parallax reference may not exist in Publications table. "
+            "Add it with add_publication function. No parallaxes were added.\n"
+            f"{e}"
+        )
+        logger.error(msg)
+        raise AstroDBError(msg)
+
+    logger.info(
+        f"Total Parallaxes added to database: {len(parallax_data)} "
+        f"({n_rows - len(parallax_data)} duplicates skipped, "
+        f"{len(updates)} previously adopted measurements unset)\n"
+    )
+
+    return
+
+
 # PROPER MOTIONS
 def ingest_proper_motions(
-    db, sources, pm_ras, pm_ra_errs, pm_decs, pm_dec_errs, pm_references
+    db, sources, pm_ras, pm_ra_errs, pm_decs, pm_dec_errs, pm_references, resolver=None
 ):
     """
 
@@ -203,6 +384,8 @@ def ingest_proper_motions(
         list of uncertanties in proper motion dec
     pm_references: str or list[str]
         Reference or list of references for the proper motion measurements
+    resolver: SourceResolver, optional
+        Resolver used to match the source names, instead of find_source_in_db
 
     Examples
     ----------
@@ -228,7 +411,7 @@ def ingest_proper_motions(
     n_added = 0
 
     for i, source in enumerate(sources):
-        db_name = find_source_in_db(db, source)
+        db_name = find_source(db, source, resolver=resolver)
 
         if len(db_name) != 1:
             msg = f"No unique source match for {source} in the database"
@@ -0,0 +1,738 @@
+import os
+import json
+import hashlib
+import logging
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+import sqlalchemy.exc
+from sqlalchemy import and_
+from astrodbkit2.astrodb import create_database, Database
+from astrodbkit2.utils import datetime_json_parser
+from astrodb_scripts import AstroDBError
+from simple.schema import REFERENCE_TABLES
+
+__all__ = [
+    "bulk_load_database",
+    "read_source_files",
+    "list_source_files",
+    "load_simpledb",
+    "load_cached_database",
+    "update_database",
+    "build_manifest",
+    "read_manifest",
+    "write_manifest",
+    "manifest_path",
+    "hash_data_directory",
+]
+
+logger = logging.getLogger("SIMPLE")
+
+
+def list_source_files(directory, reference_tables=REFERENCE_TABLES):
+    """
+    List the per-source JSON files in a data directory,
+    skipping reference tables and hidden files.
+    Files are returned in the same order load_database would visit them.
+
+    Parameters
+    ----------
+    directory: str
+        Directory containing the JSON files
+    reference_tables: list[str]
+        Names of the reference tables to skip
+
+    Returns
+    -------
+    files: list[str]
+        File names (not full paths) of the source JSON files
+    """
+    files = []
+    for file in os.listdir(directory):
+        core_name = file.replace(".json", "")
+        if core_name in reference_tables:
+            continue
+        if not file.endswith(".json") or file.startswith("."):
+            continue
+        files.append(file)
+
+    return files
+
+
+def _parse_source_files(paths, primary_table="Sources", primary_key="source",
+                        foreign_key="source"):
+    """
+    Parse a chunk of source JSON files into rows grouped by table.
+    Runs inside the worker processes of read_source_files.
+    Also returns the primary key found in each file.
+    """
+    rows = defaultdict(list)
+    sources = []
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f, object_hook=datetime_json_parser)
+
+        try:
+            source = data[primary_table][0][primary_key]
+        except (KeyError, IndexError, TypeError):
+            msg = f"{path} does not have a {primary_table} entry"
+            raise AstroDBError(msg)
+        sources.append(source)
+
+        rows[primary_table].extend(data[primary_table])
+        for table, values in data.items():
+            if table == primary_table:
+                continue
+            for value in values:
+                value[foreign_key] = source
+                rows[table].append(value)
+
+    return dict(rows), sources
+
+
+def read_source_files(
+    directory,
+    files=None,
+    *,
+    workers=None,
+    files_per_task=100,
+    primary_table="Sources",
+    primary_key="source",
+    foreign_key="source",
+    return_sources=False,
+):
+    """
+    Parse source JSON files with a process pool and group the rows by table.
+
+    Parameters
+    ----------
+    directory: str
+        Directory containing the JSON files
+    files: list[str], optional
+        File names to read. Defaults to every source file in the directory.
+    workers: int, optional
+        Number of worker processes. None uses os.cpu_count(); 1 parses in this process.
+    files_per_task: int, optional
+        Number of files handed to a worker at a time
+    primary_table: str, optional
+    primary_key: str, optional
+    foreign_key: str, optional
+    return_sources: bool, optional
+        True: also return the primary key found in each file
+
+    Returns
+    -------
+    rows: dict
+        Dictionary of table name to list of row dictionaries,
+        in the same order as the files.
+    sources: list[str]
+        Primary key of each file, only returned if return_sources is True
+    """
+    if files is None:
+        files = list_source_files(directory)
+
+    paths = [os.path.join(directory, file) for file in files]
+    chunks = [
+        paths[i : i + files_per_task] for i in range(0, len(paths), files_per_task)
+    ]
+    kwargs = {
+        "primary_table": primary_table,
+        "primary_key": primary_key,
+        "foreign_key": foreign_key,
+    }
+
+    rows = defaultdict(list)
+    sources = []
+    if workers == 1 or len(chunks) <= 1:
+        for chunk in chunks:
+            chunk_rows, chunk_sources = _parse_source_files(chunk, **kwargs)
+            for table, values in chunk_rows.items():
+                rows[table].extend(values)
+            sources.extend(chunk_sources)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(_parse_source_files, chunk, **kwargs)
+                for chunk in chunks
+            ]
+            # Collect in submission order so row order matches the file order
+            for future in futures:
+                chunk_rows, chunk_sources = future.result()
+                for table, values in chunk_rows.items():
+                    rows[table].extend(values)
+                sources.extend(chunk_sources)
+
+    logger.debug(
+        f"Parsed {len(paths)} source files: "
+        + ", ".join(f"{table}={len(values)}" for table, values in rows.items())
+    )
+
+    if return_sources:
+        return dict(rows), sources
+    return dict(rows)
+
+
+def _insert_rows(conn, table, rows, chunk_size):
+    """
+    Insert rows into a table with one executemany per chunk.
+    Rows are padded to a common set of columns so each chunk compiles to one statement.
+    """
+    column_names = table.columns.keys()
+    for row in rows:
+        unknown = set(row) - set(column_names)
+        if unknown:
+            msg = f"Unknown columns for {table.name}: {sorted(unknown)}"
+            raise AstroDBError(msg)
+
+    for i in range(0, len(rows), chunk_size):
+        chunk = rows[i : i + chunk_size]
+        keys = [c for c in column_names if any(c in row for row in chunk)]
+        params = [{key: row.get(key) for key in keys} for row in chunk]
+        conn.execute(table.insert(), params)
+
+
+def bulk_load_database(
+    db, directory="data", *, workers=None, chunk_size=5000, manifest_file=None
+):
+    """
+    Reload the entire database from a directory of JSON files.
+    Produces the same contents as db.load_database(directory), but parses the source
+    files in a process pool and inserts each table with executemany in one transaction.
+    Existing table contents are cleared first.
+
+    Parameters
+    ----------
+    db: astrodbkit2.astrodb.Database
+        Database object created by astrodbkit2
+    directory: str
+        Directory containing the JSON files
+    workers: int, optional
+        Number of worker processes used to parse the source files.
+        None uses os.cpu_count(); 1 parses serially.
+    chunk_size: int, optional
+        Number of rows per executemany call
+    manifest_file: str, optional
+        If given, write a manifest of the loaded files here for update_database
+
+    Returns
+    -------
+    counts: dict
+        Number of rows inserted per table
+
+    Examples
+    ----------
+    > db = Database("sqlite://", reference_tables=REFERENCE_TABLES)
+    > bulk_load_database(db, "data")
+    """
+    reference_tables = db._reference_tables
+    files = list_source_files(directory, reference_tables=reference_tables)
+    source_rows, sources = read_source_files(
+        directory,
+        files,
+        workers=workers,
+        primary_table=db._primary_table,
+        primary_key=db._primary_table_key,
+        foreign_key=db._foreign_key,
+        return_sources=True,
+    )
+
+    for table in source_rows:
+        if table not in db.metadata.tables:
+            msg = f"Table {table} found in the JSON files is not in the database"
+            raise AstroDBError(msg)
+
+    counts = {}
+    with db.engine.begin() as conn:
+        # Clear existing contents; reversed sorted_tables respects foreign keys
+        for table in reversed(db.metadata.sorted_tables):
+            conn.execute(table.delete())
+
+        # Reference tables first, in the order load_database uses
+        for table in reference_tables:
+            filename = os.path.join(directory, table + ".json")
+            if table not in db.metadata.tables or not os.path.exists(filename):
+                logger.debug(f"{table}.json not found.")
+                continue
+            with open(filename, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            _insert_rows(conn, db.metadata.tables[table], data, chunk_size)
+            counts[table] = len(data)
+
+        # Object tables in dependency order so foreign keys are satisfied
+        for table in db.metadata.sorted_tables:
+            if table.name in reference_tables or table.name not in source_rows:
+                continue
+            _insert_rows(conn, table, source_rows[table.name], chunk_size)
+            counts[table.name] = len(source_rows[table.name])
+
+    logger.info(f"Loaded {len(files)} sources from {directory}")
+
+    if manifest_file is not None:
+        manifest = build_manifest(db, directory, dict(zip(files, sources)))
+        write_manifest(manifest, manifest_file)
+
+    return counts
+
+
+# -------------------------------------------------------------------------------------------------------------------
+# Manifest of loaded files, used for incremental rebuilds
+def manifest_path(db_file):
+    """Name of the manifest file stored next to a database file, eg SIMPLE_manifest.json"""
+    return os.path.splitext(db_file)[0] + "_manifest.json"
+
+
+def _schema_hash(db):
+    """Hash of the table and column definitions, so schema changes force a full rebuild"""
+    schema = [
+        (table.name, [(c.name, str(c.type), c.primary_key) for c in table.columns])
+        for table in db.metadata.sorted_tables
+    ]
+    return hashlib.sha256(json.dumps(schema).encode("utf-8")).hexdigest()
+
+
+def _file_state(path, previous=None):
+    """
+    Size, modification time and content hash of a file.
+    The hash is reused from the previous manifest entry when size and mtime are unchanged.
+    """
+    stat = os.stat(path)
+    if (
+        previous is not None
+        and previous["size"] == stat.st_size
+        and previous["mtime_ns"] == stat.st_mtime_ns
+    ):
+        content_hash = previous["hash"]
+    else:
+        with open(path, "rb") as f:
+            content_hash = hashlib.sha256(f.read()).hexdigest()
+    return {"hash": content_hash, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def build_manifest(db, directory, sources, previous=None):
+    """
+    Build the manifest of a data directory: file -> content hash -> primary key loaded.
+
+    Parameters
+    ----------
+    db: astrodbkit2.astrodb.Database
+    directory: str
+        Directory containing the JSON files
+    sources: dict
+        Source file name -> primary key loaded from that file
+    previous: dict, optional
+        Earlier manifest, used to skip hashing files whose size and mtime are unchanged
+
+    Returns
+    -------
+    manifest: dict
+    """
+    previous = previous or {"reference_tables": {}, "sources": {}}
+
+    manifest = {
+        "directory": os.path.abspath(directory),
+        "schema": _schema_hash(db),
+        "reference_tables": {},
+        "sources": {},
+    }
+    for table in db._reference_tables:
+        filename = os.path.join(directory, table + ".json")
+        if os.path.exists(filename):
+            manifest["reference_tables"][table] = _file_state(
+                filename, previous["reference_tables"].get(table)
+            )
+    for file, source in sources.items():
+        state = _file_state(
+            os.path.join(directory, file), previous["sources"].get(file)
+        )
+        state["source"] = source
+        manifest["sources"][file] = state
+
+    return manifest
+
+
+def _database_state(db_file):
+    stat = os.stat(db_file)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def _record_database_state(manifest_file, db_file):
+    """Store the size and mtime of the database file the manifest describes"""
+    manifest = read_manifest(manifest_file)
+    manifest["database"] = _database_state(db_file)
+    write_manifest(manifest, manifest_file)
+
+
+def hash_data_directory(directory, extra_files=()):
+    """
+    Single content hash for every JSON file in a data directory,
+    plus any extra files (eg, simple/schema.py).
+
+    Parameters
+    ----------
+    directory: str
+        Directory containing the JSON files
+    extra_files: list[str], optional
+        Additional files to include in the hash
+
+    Returns
+    -------
+    tree_hash: str
+        Hex digest that changes when any file is added, removed or edited
+    """
+    files = sorted(
+        os.path.join(directory, file)
+        for file in os.listdir(directory)
+        if file.endswith(".json") and not file.startswith(".")
+    )
+    tree_hash = hashlib.sha256()
+    for path in files + list(extra_files):
+        with open(path, "rb") as f:
+            file_hash = hashlib.sha256(f.read()).hexdigest()
+        tree_hash.update(f"{os.path.basename(path)}:{file_hash}\n".encode("utf-8"))
+
+    return tree_hash.hexdigest()
+
+
+def read_manifest(manifest_file):
+    """Read a manifest written by write_manifest"""
+    with open(manifest_file, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def write_manifest(manifest, manifest_file):
+    """Write a manifest as JSON"""
+    with open(manifest_file, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+
+
+def _primary_key_clause(table, row):
+    return and_(*[column == row[column.name] for column in table.primary_key.columns])
+
+
+def _sync_reference_table(conn, table, rows):
+    """
+    Bring a reference table in line with the rows from its JSON file.
+    Inserts and updates are applied now; stale primary keys are returned
+    so they can be deleted once no source data points to them.
+    """
+    column_names = table.columns.keys()
+    key_names = [column.name for column in table.primary_key.columns]
+
+    new_rows = {}
+    for row in rows:
+        row = {name: row.get(name) for name in column_names}
+        new_rows[tuple(row[name] for name in key_names)] = row
+    old_rows = {
+        tuple(row[name] for name in key_names): row
+        for row in (r._asdict() for r in conn.execute(table.select()))
+    }
+
+    inserts = [row for key, row in new_rows.items() if key not in old_rows]
+    if inserts:
+        conn.execute(table.insert(), inserts)
+    for key, row in new_rows.items():
+        if key in old_rows and old_rows[key] != row:
+            conn.execute(
+                table.update().where(_primary_key_clause(table, row)).values(row)
+            )
+
+    return [row for key, row in old_rows.items() if key not in new_rows]
+
+
+def _delete_sources(conn, db, sources, chunk_size=500):
+    """Delete all rows for the given primary keys from every object table"""
+    sources = list(sources)
+    primary_table = db.metadata.tables[db._primary_table]
+    for i in range(0, len(sources), chunk_size):
+        chunk = sources[i : i + chunk_size]
+        for table in reversed(db.metadata.sorted_tables):
+            if table is primary_table or table.name in db._reference_tables:
+                continue
+            if db._foreign_key in table.columns:
+                conn.execute(
+                    table.delete().where(table.columns[db._foreign_key].in_(chunk))
+                )
+        conn.execute(
+            primary_table.delete().where(
+                primary_table.columns[db._primary_table_key].in_(chunk)
+            )
+        )
+
+
+def update_database(db, directory, manifest_file, *, workers=None, chunk_size=5000):
+    """
+    Incrementally bring a database up to date with a directory of JSON files.
+    Only sources whose JSON file changed, was added or vanished since the manifest
+    was written are deleted and reloaded. Reference tables are re-synced only
+    when their JSON file changed. All changes are applied in one transaction
+    and the manifest is rewritten afterwards.
+
+    Parameters
+    ----------
+    db: astrodbkit2.astrodb.Database
+        Database previously loaded with bulk_load_database(..., manifest_file=...)
+    directory: str
+        Directory containing the JSON files
+    manifest_file: str
+        Manifest describing what the database was loaded from
+    workers: int, optional
+        Number of worker processes used to parse changed source files
+    chunk_size: int, optional
+        Number of rows per executemany call
+
+    Returns
+    -------
+    changes: dict
+        Lists of changed reference tables and added, changed and removed source files
+
+    Raises
+    ------
+    AstroDBError
+        If the manifest does not describe this directory or schema,
+        or the changes cannot be applied
+    """
+    previous = read_manifest(manifest_file)
+    if previous["directory"] != os.path.abspath(directory):
+        msg = f"Manifest {manifest_file} was built from {previous['directory']}"
+        raise AstroDBError(msg)
+    if previous["schema"] != _schema_hash(db):
+        msg = f"Schema has changed since {manifest_file} was written"
+        raise AstroDBError(msg)
+
+    files = list_source_files(directory, reference_tables=db._reference_tables)
+    manifest = build_manifest(
+        db,
+        directory,
+        {file: previous["sources"].get(file, {}).get("source") for file in files},
+        previous=previous,
+    )
+
+    changes = {
+        "reference_tables": [
+            table
+            for table in db._reference_tables
+            if manifest["reference_tables"].get(table, {}).get("hash")
+            != previous["reference_tables"].get(table, {}).get("hash")
+        ],
+        "added": [file for file in files if file not in previous["sources"]],
+        "changed": [
+            file
+            for file in files
+            if file in previous["sources"]
+            and manifest["sources"][file]["hash"] != previous["sources"][file]["hash"]
+        ],
+        "removed": [file for file in previous["sources"] if file not in manifest["sources"]],
+    }
+
+    reload_files = changes["added"] + changes["changed"]
+    source_rows, sources = read_source_files(
+        directory,
+        reload_files,
+        workers=workers,
+        primary_table=db._primary_table,
+        primary_key=db._primary_table_key,
+        foreign_key=db._foreign_key,
+        return_sources=True,
+    )
+    for file, source in zip(reload_files, sources):
+        manifest["sources"][file]["source"] = source
+
+    stale_sources = [
+        previous["sources"][file]["source"]
+        for file in changes["changed"] + changes["removed"]
+    ]
+
+    try:
+        with db.engine.begin() as conn:
+            # Reference rows are added first and removed last,
+            # so source data can move from old to new values in between
+            stale_reference_rows = {}
+            for table in db._reference_tables:
+                if table not in changes["reference_tables"]:
+                    continue
+                filename = os.path.join(directory, table + ".json")
+                if os.path.exists(filename):
+                    with open(filename, "r", encoding="utf-8") as f:
+                        data = json.load(f)
+                else:
+                    data = []
+                stale_reference_rows[table] = _sync_reference_table(
+                    conn, db.metadata.tables[table], data
+                )
+
+            _delete_sources(conn, db, stale_sources)
+            for table in db.metadata.sorted_tables:
+                if table.name in db._reference_tables or table.name not in source_rows:
+                    continue
+                _insert_rows(conn, table, source_rows[table.name], chunk_size)
+
+            for table in reversed(db._reference_tables):
+                ref_table = db.metadata.tables.get(table)
+                for row in stale_reference_rows.get(table, []):
+                    conn.execute(
+                        ref_table.delete().where(_primary_key_clause(ref_table, row))
+                    )
+    except sqlalchemy.exc.IntegrityError as e:
+        msg = f"Unable to apply incremental changes from {directory}: {e}"
+        raise AstroDBError(msg)
+
+    write_manifest(manifest, manifest_file)
+
+    logger.info(
+        f"Updated database from {directory}: "
+        f"{len(changes['added'])} added, {len(changes['changed'])} changed, "
+        f"{len(changes['removed'])} removed sources; "
+        f"reference tables reloaded: {changes['reference_tables']}"
+    )
+
+    return changes
+
+
+def load_simpledb(
+    db_file="SIMPLE.sqlite",
+    data_path="data/",
+    recreatedb=True,
+    reference_tables=REFERENCE_TABLES,
+    workers=None,
+    incremental=True,
+):
+    """
+    Connect to a SQLite database file, rebuilding it with bulk_load_database
+    when requested or when the file does not exist.
+    Drop-in replacement for astrodb_scripts.load_astrodb.
+
+    A manifest of the loaded JSON files is kept next to the database file
+    (eg, SIMPLE_manifest.json). When recreatedb is True and the manifest exists,
+    only the JSON files changed since the last build are reloaded.
+
+    Parameters
+    ----------
+    db_file: str
+        Name of the SQLite database file
+    data_path: str
+        Directory containing the JSON files
+    recreatedb: bool
+        True (default): remove the existing file and rebuild it from the JSON files
+    reference_tables: list[str]
+    workers: int, optional
+        Number of worker processes used to parse the source files
+    incremental: bool
+        True (default): use the manifest to only reload changed JSON files
+        False: always rebuild the whole database when recreatedb is True
+
+    Returns
+    -------
+    db: astrodbkit2.astrodb.Database
+    """
+    connection_string = "sqlite:///" + db_file
+    manifest_file = manifest_path(db_file)
+
+    if (
+        recreatedb
+        and incremental
+        and os.path.exists(db_file)
+        and os.path.exists(manifest_file)
+    ):
+        # Changes made directly to the database file (eg, an unsaved ingest)
+        # are not described by the manifest, so those need a full rebuild
+        if read_manifest(manifest_file).get("database") == _database_state(db_file):
+            db = Database(connection_string, reference_tables=reference_tables)
+            try:
+                update_database(db, data_path, manifest_file, workers=workers)
+                _record_database_state(manifest_file, db_file)
+                return db
+            except (AstroDBError, KeyError, ValueError) as e:
+                logger.warning(f"Incremental update failed, rebuilding database: {e}")
+                db.session.close()
+                db.engine.dispose()
+        else:
+            logger.info(f"{db_file} was modified since it was built, rebuilding")
+
+    if recreatedb and os.path.exists(db_file):
+        os.remove(db_file)
+
+    if os.path.exists(db_file):
+        return Database(connection_string, reference_tables=reference_tables)
+
+    if os.path.exists(manifest_file):
+        os.remove(manifest_file)
+
+    create_database(connection_string)
+    # Load into an in-memory database first, for performance
+    temp_db = Database("sqlite://", reference_tables=reference_tables)
+    bulk_load_database(
+        temp_db,
+        data_path,
+        workers=workers,
+        manifest_file=manifest_file if incremental else None,
+    )
+    temp_db.dump_sqlite(db_file)
+    if incremental:
+        _record_database_state(manifest_file, db_file)
+
+    return Database(connection_string, reference_tables=reference_tables)
+
+
+def load_cached_database(
+    db_file,
+    data_path="data",
+    extra_files=(),
+    reference_tables=REFERENCE_TABLES,
+    workers=None,
+):
+    """
+    Connect to a SQLite database file built from the JSON files, reusing it when
+    neither the JSON files nor the extra files (eg, simple/schema.py) have changed.
+    The hash of the inputs is stored next to the database file (eg, SIMPLE_cache.json),
+    together with the size and mtime of the database file so that a modified
+    database is rebuilt too.
+
+    The database is built in parallel with bulk_load_database, into a temporary file
+    which replaces db_file when complete, so concurrent callers never see a partial file.
+
+    Parameters
+    ----------
+    db_file: str
+        Name of the SQLite database file
+    data_path: str
+        Directory containing the JSON files
+    extra_files: list[str], optional
+        Additional files which invalidate the cached database when changed
+    reference_tables: list[str]
+    workers: int, optional
+        Number of worker processes used to parse the source files
+
+    Returns
+    -------
+    db: astrodbkit2.astrodb.Database
+    """
+    connection_string = "sqlite:///" + db_file
+    cache_file = os.path.splitext(db_file)[0] + "_cache.json"
+    data_hash = hash_data_directory(data_path, extra_files)
+
+    if os.path.exists(db_file) and os.path.exists(cache_file):
+        try:
+            cache = read_manifest(cache_file)
+        except ValueError:
+            cache = {}
+        if cache == {"hash": data_hash, "database": _database_state(db_file)}:
+            logger.info(f"Reusing {db_file}, the JSON files have not changed")
+            return Database(connection_string, reference_tables=reference_tables)
+
+    logger.info(f"Building {db_file} from {data_path}")
+    temp_file = f"{db_file}.{os.getpid()}.tmp"
+    if os.path.exists(temp_file):
+        os.remove(temp_file)
+    temp_db = Database("sqlite://", reference_tables=reference_tables)
+    bulk_load_database(temp_db, data_path, workers=workers)
+    temp_db.dump_sqlite(temp_file)
+    temp_db.session.close()
+    temp_db.engine.dispose()
+    os.replace(temp_file, db_file)
+
+    temp_cache_file = f"{cache_file}.{os.getpid()}.tmp"
+    write_manifest(
+        {"hash": data_hash, "database": _database_state(db_file)}, temp_cache_file
+    )
+    os.replace(temp_cache_file, cache_file)
+
+    return Database(connection_string, reference_tables=reference_tables)
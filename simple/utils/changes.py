@@ -0,0 +1,367 @@
+import os
+import json
+import filecmp
+import logging
+import tempfile
+import weakref
+from sqlalchemy import event, select
+from sqlalchemy.sql.dml import Insert, Update, Delete
+from sqlalchemy.sql.elements import BindParameter, TextClause
+from astrodbkit2.utils import json_serializer
+from astrodb_scripts import AstroDBError
+
+__all__ = [
+    "ChangeTracker",
+    "track_changes",
+    "save_changes",
+    "verify_save",
+]
+
+logger = logging.getLogger("SIMPLE")
+
+READ_ONLY_SQL = ("SELECT", "PRAGMA", "WITH", "EXPLAIN")
+
+
+def _param_value(value):
+    if isinstance(value, BindParameter):
+        return value.value
+    return value
+
+
+def _statement_values(statement, multiparams, params):
+    """List of {column name: value} dictionaries a DML statement will write"""
+    rows = []
+    values = getattr(statement, "_values", None)
+    if values:
+        rows.append(
+            {getattr(k, "key", k): _param_value(v) for k, v in values.items()}
+        )
+    for multi_values in getattr(statement, "_multi_values", ()):
+        for row in multi_values:
+            if isinstance(row, dict):
+                rows.append(
+                    {getattr(k, "key", k): _param_value(v) for k, v in row.items()}
+                )
+            else:
+                # Positional values, in table column order
+                rows.append(
+                    {
+                        column.key: _param_value(v)
+                        for column, v in zip(statement.table.columns, row)
+                    }
+                )
+    rows.extend(dict(p) for p in multiparams)
+    if params:
+        rows.append(dict(params))
+    return rows
+
+
+def _affected_sources(conn, statement, multiparams, params, column=None):
+    """
+    Sources of the rows an update or delete will change, and new source names
+    an update sets, or None if they cannot be found.
+    Runs a select with the where clause of the statement, before it is executed,
+    once for each parameter set of an executemany.
+    column: the source column of the table, default: its source column
+    """
+    if column is None:
+        column = statement.table.c.source
+    query = select(column).distinct()
+    if statement.whereclause is not None:
+        query = query.where(statement.whereclause)
+    try:
+        sources = set()
+        for parameters in multiparams or [params or {}]:
+            sources.update(row[0] for row in conn.execute(query, parameters))
+    except Exception:
+        return None
+    if isinstance(statement, Update):
+        for row in _statement_values(statement, multiparams, params):
+            if column.key in row:
+                sources.add(row[column.key])
+    return sources
+
+
+class _PendingChanges:
+    """
+    Changes recorded by an engine listener while statements execute, applied when
+    their transaction commits and dropped when it rolls back, so that indexes kept
+    in memory never see rows of failed ingests.
+
+    apply is called with the list of changes of the committed transaction.
+    A None change means the changes are not known and everything must be rebuilt:
+    it replaces the changes of a transaction when one of its savepoints rolls back.
+    """
+
+    def __init__(self, engine, apply):
+        self.engine = engine
+        self._apply = apply
+        self._pending = weakref.WeakKeyDictionary()
+        event.listen(engine, "commit", self._commit)
+        event.listen(engine, "rollback", self._rollback)
+        event.listen(engine, "rollback_savepoint", self._rollback_savepoint)
+
+    def stop(self):
+        """Stop listening to the transactions of the engine"""
+        event.remove(self.engine, "commit", self._commit)
+        event.remove(self.engine, "rollback", self._rollback)
+        event.remove(self.engine, "rollback_savepoint", self._rollback_savepoint)
+
+    def add(self, conn, change):
+        self._pending.setdefault(conn, []).append(change)
+
+    def _commit(self, conn):
+        changes = self._pending.pop(conn, None)
+        if changes:
+            self._apply(changes)
+
+    def _rollback(self, conn):
+        self._pending.pop(conn, None)
+
+    def _rollback_savepoint(self, conn, name, context):
+        if conn in self._pending:
+            self._pending[conn] = [None]
+
+
+class ChangeTracker:
+    """
+    Record which sources and reference tables are modified through a database,
+    by listening to the statements executed on its engine.
+
+    Inserts record the source keys they write. Updates and deletes first select
+    the keys matched by their WHERE clause. Statements that cannot be attributed
+    to individual sources (raw SQL, renames of reference table keys that cascade
+    into source data) set full_save so the next save writes everything.
+
+    Parameters
+    ----------
+    db: astrodbkit2.astrodb.Database
+        Database object created by astrodbkit2
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.sources = set()
+        self.reference_tables = set()
+        self.full_save = False
+        event.listen(db.engine, "before_execute", self._before_execute)
+        event.listen(db.engine, "before_cursor_execute", self._before_cursor_execute)
+
+    def stop(self):
+        """Stop listening to the database engine"""
+        event.remove(self.db.engine, "before_execute", self._before_execute)
+        event.remove(
+            self.db.engine, "before_cursor_execute", self._before_cursor_execute
+        )
+
+    def clear(self):
+        """Forget recorded changes, eg after they have been saved"""
+        self.sources = set()
+        self.reference_tables = set()
+        self.full_save = False
+
+    @property
+    def changed(self):
+        return bool(self.sources or self.reference_tables or self.full_save)
+
+    def _check_sql(self, statement):
+        if not statement.lstrip().upper().startswith(READ_ONLY_SQL):
+            logger.debug(f"Untracked statement, next save is a full save: {statement}")
+            self.full_save = True
+
+    def _before_cursor_execute(
+        self, conn, cursor, statement, parameters, context, executemany
+    ):
+        # Only SQL strings run with exec_driver_sql have no compiled statement
+        if context is not None and context.compiled is None:
+            self._check_sql(statement)
+
+    def _before_execute(self, conn, clauseelement, multiparams, params, execution_options):
+        if isinstance(clauseelement, TextClause):
+            self._check_sql(clauseelement.text)
+            return
+        if not isinstance(clauseelement, (Insert, Update, Delete)):
+            return
+
+        table = clauseelement.table
+        db = self.db
+
+        if table.name in db._reference_tables:
+            self.reference_tables.add(table.name)
+            # Renaming a reference key cascades into the source data
+            if isinstance(clauseelement, Update):
+                values = _statement_values(clauseelement, multiparams, params)
+                key_names = {column.name for column in table.primary_key.columns}
+                if any(key_names & set(row) for row in values):
+                    self.full_save = True
+            return
+
+        if table.name == db._primary_table:
+            key = table.columns[db._primary_table_key]
+        elif db._foreign_key in table.columns:
+            key = table.columns[db._foreign_key]
+        else:
+            self.full_save = True
+            return
+
+        values = _statement_values(clauseelement, multiparams, params)
+        self.sources.update(row[key.key] for row in values if key.key in row)
+
+        if isinstance(clauseelement, Insert):
+            if not values or any(key.key not in row for row in values):
+                self.full_save = True
+            return
+
+        # Updates and deletes: look up which sources the WHERE clause matches
+        matched = _affected_sources(conn, clauseelement, multiparams, params, column=key)
+        if matched is None:
+            self.full_save = True
+        else:
+            self.sources.update(matched)
+
+
+def track_changes(db):
+    """
+    Start recording which sources and reference tables are modified.
+    Call right after loading the database; use save_changes to write the JSON files.
+
+    Parameters
+    ----------
+    db: astrodbkit2.astrodb.Database
+        Database object created by astrodbkit2
+
+    Returns
+    -------
+    tracker: ChangeTracker
+
+    Examples
+    ----------
+    > db = load_simpledb("SIMPLE.sqlite", recreatedb=True)
+    > tracker = track_changes(db)
+    > ingest_photometry(db, ...)
+    > save_changes(tracker, "data/")
+    """
+    return ChangeTracker(db)
+
+
+def _source_filename(name):
+    """JSON file name astrodbkit2 uses for a source"""
+    return name.lower().replace(" ", "_").replace("*", "").strip() + ".json"
+
+
+def _save_reference_table(db, table, directory):
+    """Write a reference table to [directory]/[table].json, as save_database does"""
+    results = db.session.query(db.metadata.tables[table]).all()
+    data = [row._asdict() for row in results]
+    if len(data) > 0:
+        filename = os.path.join(directory, table + ".json")
+        with open(filename, "w", encoding="utf-8") as f:
+            f.write(json.dumps(data, indent=4, default=json_serializer))
+
+
+def _save_all(db, directory):
+    """Write every reference table and source to a flat directory of JSON files"""
+    for table in db._reference_tables:
+        if table in db.metadata.tables:
+            _save_reference_table(db, table, directory)
+    primary_table = db.metadata.tables[db._primary_table]
+    for (name,) in db.query(primary_table.columns[db._primary_table_key]).all():
+        db.save_json(name, directory)
+
+
+def save_changes(tracker, directory, verify=False):
+    """
+    Write only the JSON files for sources and reference tables modified since
+    tracking started, then clear the tracker.
+    Files of deleted or renamed sources are removed.
+
+    Parameters
+    ----------
+    tracker: ChangeTracker
+        Tracker returned by track_changes
+    directory: str
+        Directory containing the JSON files
+    verify: bool
+        True: afterwards, check the directory is byte-identical to a full save
+
+    Returns
+    -------
+    results: dict
+        Lists of written and removed file names
+    """
+    db = tracker.db
+    results = {"written": [], "removed": []}
+
+    if tracker.full_save:
+        logger.info("Changes could not be attributed to sources, saving everything")
+        for file in os.listdir(directory):
+            if file.endswith(".json"):
+                os.remove(os.path.join(directory, file))
+        _save_all(db, directory)
+        results["written"] = sorted(os.listdir(directory))
+    else:
+        for table in sorted(tracker.reference_tables):
+            _save_reference_table(db, table, directory)
+            results["written"].append(table + ".json")
+
+        primary_table = db.metadata.tables[db._primary_table]
+        key = primary_table.columns[db._primary_table_key]
+        existing = {
+            name
+            for (name,) in db.query(key).filter(key.in_(list(tracker.sources))).all()
+        }
+        for name in sorted(tracker.sources):
+            filename = _source_filename(name)
+            if name in existing:
+                db.save_json(name, directory)
+                results["written"].append(filename)
+            elif os.path.exists(os.path.join(directory, filename)):
+                os.remove(os.path.join(directory, filename))
+                results["removed"].append(filename)
+
+    logger.info(
+        f"Saved {len(results['written'])} and removed {len(results['removed'])} "
+        f"JSON files in {directory}"
+    )
+    tracker.clear()
+
+    if verify:
+        verify_save(db, directory)
+
+    return results
+
+
+def verify_save(db, directory):
+    """
+    Check that a directory of JSON files is byte-identical to a full save of the database.
+
+    Parameters
+    ----------
+    db: astrodbkit2.astrodb.Database
+        Database object created by astrodbkit2
+    directory: str
+        Directory containing the JSON files
+
+    Raises
+    ------
+    AstroDBError
+        If any file is missing, extra or different
+    """
+    with tempfile.TemporaryDirectory() as full_directory:
+        _save_all(db, full_directory)
+        expected = {f for f in os.listdir(full_directory) if f.endswith(".json")}
+        found = {f for f in os.listdir(directory) if f.endswith(".json")}
+        _, mismatch, errors = filecmp.cmpfiles(
+            directory, full_directory, sorted(expected & found), shallow=False
+        )
+
+    problems = {
+        "missing": sorted(expected - found),
+        "extra": sorted(found - expected),
+        "different": sorted(mismatch + errors),
+    }
+    if any(problems.values()):
+        msg = f"JSON files in {directory} do not match a full save: {problems}"
+        logger.error(msg)
+        raise AstroDBError(msg)
+    logger.info(f"JSON files in {directory} match a full save")
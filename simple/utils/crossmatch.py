@@ -0,0 +1,145 @@
+import logging
+import numpy as np
+import astropy.units as u
+from astropy.table import Table
+from simple.utils.resolver import SourceResolver
+from simple.utils.spatial import source_index, _angle, _unit_vectors
+
+__all__ = ["crossmatch"]
+
+logger = logging.getLogger("SIMPLE")
+
+
+def _column_values(table, name, fill_value):
+    """Column of an astropy Table as a numpy array, with masked values filled"""
+    return np.ma.filled(np.ma.asarray(table[name]), fill_value)
+
+
+def crossmatch(
+    db,
+    table,
+    ra_col="ra",
+    dec_col="dec",
+    radius=60 * u.arcsec,
+    name_col=None,
+    resolver=None,
+    index=None,
+    epoch=None,
+):
+    """
+    Match every row of a catalog to the Sources table in one pass,
+    instead of calling find_source_in_db for each row.
+
+    All positions are searched at once in the spatial index of the Sources
+    (see simple.utils.spatial). If name_col is given, names are matched with
+    a SourceResolver and are used first: a unique name match is the match,
+    and when several sources are within the radius, a name match among them
+    breaks the tie.
+
+    Parameters
+    ----------
+    db: astrodbkit2.astrodb.Database
+        Database object created by astrodbkit2
+    table: astropy.table.Table
+        Catalog to match
+    ra_col, dec_col: str
+        Columns with the coordinates in degrees. Masked or nan values are not searched.
+    radius: astropy.units.Quantity or float
+        Search radius, in degrees if a number. Default: 60 arcsec, as find_source_in_db
+    name_col: str, optional
+        Column with the names of the catalog sources
+    resolver: SourceResolver, optional
+        Resolver used to match the names. Default: build one from the database
+    index: SourceIndex, optional
+        Default: the shared index of the database, see simple.utils.spatial.source_index
+    epoch: float, optional
+        Epoch of the catalog positions in decimal years. The Sources are moved to it
+        by their proper motions (see simple.utils.spatial.propagate_positions),
+        so fast-moving sources are matched. Not used if an index is given.
+
+    Returns
+    -------
+    results: astropy.table.Table
+        Copy of the input table with the columns
+        db_source: best matching Sources.source, empty if there is none,
+        separation: separation of the best match in arcsec (nan without a position),
+        n_candidates: number of sources within the radius and
+        match: "name" or "position" for a unique match, "ambiguous" if several
+        sources match and the best one is only the nearest, or "no match".
+
+    Examples
+    ----------
+    > results = crossmatch(db, uc_sheet, "ra_j2000_formula", "dec_j2000_formula", name_col="name")
+    > results[results["match"] == "ambiguous"]
+    """
+    if index is None:
+        index = source_index(db, epoch)
+    ra = _column_values(table, ra_col, np.nan).astype(float)
+    dec = _column_values(table, dec_col, np.nan).astype(float)
+    candidates = index.query_many(ra, dec, radius)
+    names = index.names
+
+    names_found = [[] for _ in range(len(table))]
+    if name_col is not None:
+        if resolver is None:
+            resolver = SourceResolver(db)
+            resolver.stop()
+        mask = np.ma.getmaskarray(table[name_col])
+        names_found = resolver.resolve_many(
+            [
+                None if masked else str(value)
+                for value, masked in zip(np.ma.getdata(table[name_col]).tolist(), mask)
+            ]
+        )
+
+    # Positions of the matches by name, for their separation
+    position_of = {name: i for i, name in enumerate(names)}
+    vectors = _unit_vectors(ra, dec)
+
+    db_sources = []
+    separations = []
+    n_candidates = []
+    matches = []
+    for i, (indices, candidate_separations) in enumerate(candidates):
+        nearby = names[indices].tolist()
+        by_name = names_found[i]
+        in_radius = [name for name in nearby if name in by_name]
+
+        separation = np.nan
+        if len(by_name) == 1:
+            best, match = by_name[0], "name"
+        elif len(in_radius) == 1:
+            best, match = in_radius[0], "name"
+        elif len(in_radius) > 1:
+            best, match = in_radius[0], "ambiguous"
+        elif len(by_name) > 1:
+            best, match = "", "ambiguous"
+        elif len(nearby) == 1:
+            best, match = nearby[0], "position"
+        elif len(nearby) > 1:
+            best, match = nearby[0], "ambiguous"
+        else:
+            best, match = "", "no match"
+
+        if best in nearby:
+            separation = candidate_separations[nearby.index(best)] * 3600
+        elif best in position_of and np.isfinite(vectors[i]).all():
+            j = position_of[best]
+            chord = np.linalg.norm(_unit_vectors(index.ra[j], index.dec[j])[0] - vectors[i])
+            separation = np.degrees(_angle(chord)) * 3600
+
+        db_sources.append(best)
+        separations.append(separation)
+        n_candidates.append(len(nearby))
+        matches.append(match)
+
+    results = Table(table, copy=True)
+    results["db_source"] = np.array(db_sources, dtype=str)
+    results["separation"] = np.array(separations, dtype=float)
+    results["separation"].unit = u.arcsec
+    results["n_candidates"] = np.array(n_candidates, dtype=int)
+    results["match"] = np.array(matches, dtype=str)
+
+    counts = {match: matches.count(match) for match in sorted(set(matches))}
+    logger.info(f"Crossmatched {len(table)} rows: {counts}")
+    return results
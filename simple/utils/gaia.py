@@ -118,7 +118,12 @@ def ingest_gaia_parallaxes(db, sources, gaia_data, ref):
     gaia_parallaxes = gaia_data[unmasked_pi]["parallax", "parallax_error"]
 
     ingest_parallaxes(
-        db, sources, gaia_parallaxes["parallax"], gaia_parallaxes["parallax_error"], ref
+        db,
+        sources,
+        gaia_parallaxes["parallax"],
+        gaia_parallaxes["parallax_error"],
+        ref,
+        bulk=True,
     )
 
 
@@ -6,12 +6,21 @@ import sqlalchemy.exc
 from typing import Optional
 import astropy.units as u
 from astropy.io.votable import parse
+from astropy.table import Table
 
-from astrodb_scripts import AstroDBError, find_source_in_db
+from astrodb_scripts import AstroDBError
+from simple.utils.resolver import SourceResolver, find_source
+from simple.utils.tables import table_values
 
 logger = logging.getLogger("AstroDB")
 
-__all__ = ["ingest_photometry", "ingest_photometry_filter", "fetch_svo", "assign_ucd"]
+__all__ = [
+    "ingest_photometry",
+    "ingest_photometry_table",
+    "ingest_photometry_filter",
+    "fetch_svo",
+    "assign_ucd",
+]
 
 
 def ingest_photometry(
@@ -26,6 +35,7 @@ def ingest_photometry(
     epoch: Optional[float] = None,
     comments: Optional[str] = None,
     raise_error: bool = True,
+    resolver=None,
 ):
     """
     TODO: Write Docstring
@@ -44,6 +54,8 @@ def ingest_photometry(
     raise_error: bool, optional
         True (default): Raise an error if a source cannot be ingested
         False: Log a warning but skip sources which cannot be ingested
+    resolver: SourceResolver, optional
+        Resolver used to match the source name, instead of find_source_in_db
 
     Returns
     -------
@@ -51,7 +63,7 @@ def ingest_photometry(
     """
     flags = {"added": False}
 
-    db_name = find_source_in_db(db, source)
+    db_name = find_source(db, source, resolver=resolver)
 
     if len(db_name) != 1:
         msg = f"No unique source match for {source} in the database"
@@ -112,6 +124,163 @@ def ingest_photometry(
     return flags
 
 
+def ingest_photometry_table(
+    db,
+    table,
+    *,
+    reference: str = None,
+    telescope: Optional[str] = None,
+    raise_error: bool = True,
+    chunk_size: int = 5000,
+    resolver=None,
+):
+    """
+    Add many photometry measurements at once.
+    All names are matched with a SourceResolver, bands, telescopes and references are checked
+    with one query each, and the valid rows are inserted in a single transaction.
+
+    Parameters
+    ----------
+    db: astrodbkit2.astrodb.Database
+    table: astropy.table.Table or dict
+        Columns source, band, magnitude and optionally magnitude_error, reference,
+        telescope, epoch and comments. Masked values are ingested as NULL.
+    reference: str, optional
+        Reference for rows without one (or if there is no reference column)
+    telescope: str, optional
+        Telescope for rows without one (or if there is no telescope column)
+    raise_error: bool, optional
+        True (default): Raise an error, without adding anything, if any row cannot be ingested
+        False: Log a warning, skip the rows which cannot be ingested and add the rest
+    chunk_size: int, optional
+        Number of rows per executemany batch
+    resolver: SourceResolver, optional
+        Resolver used to match the source names. Default: build one from the database
+
+    Returns
+    -------
+    results: astropy.table.Table
+        Copy of the input table with a status column: "added" or the reason
+        the row was not added (eg, "source not found", "unknown band", "duplicate")
+
+    Examples
+    ----------
+    > t = Table({"source": names, "band": bands, "magnitude": mags, "magnitude_error": errs})
+    > results = ingest_photometry_table(db, t, reference="Cutr03", telescope="2MASS")
+    > results[results["status"] != "added"]
+    """
+    table = Table(table, masked=True, copy=True)
+    for column in ["source", "band", "magnitude"]:
+        if column not in table.colnames:
+            msg = f"Photometry table has no {column} column"
+            raise AstroDBError(msg)
+
+    n_rows = len(table)
+    sources = table_values(table, "source")
+    bands = table_values(table, "band")
+    magnitudes = table_values(table, "magnitude")
+    magnitude_errors = table_values(table, "magnitude_error")
+    references = [r or reference for r in table_values(table, "reference")]
+    telescopes = [t or telescope for t in table_values(table, "telescope")]
+    epochs = table_values(table, "epoch")
+    comments = table_values(table, "comments")
+
+    if resolver is None:
+        resolver = SourceResolver(db)
+        resolver.stop()
+    matches = {
+        source: resolver.resolve(source) for source in set(sources) if source is not None
+    }
+    known_bands = {row[0] for row in db.query(db.PhotometryFilters.c.band).all()}
+    known_references = {row[0] for row in db.query(db.Publications.c.reference).all()}
+    known_telescopes = {row[0] for row in db.query(db.Telescopes.c.telescope).all()}
+
+    status = []
+    db_names = []
+    for i in range(n_rows):
+        source_match = matches.get(sources[i], [])
+        db_names.append(source_match[0] if len(source_match) == 1 else None)
+        if len(source_match) == 0:
+            status.append("source not found")
+        elif len(source_match) > 1:
+            status.append("multiple sources")
+        elif bands[i] not in known_bands:
+            status.append("unknown band")
+        elif magnitudes[i] is None or not np.isfinite(magnitudes[i]):
+            status.append("invalid magnitude")
+        elif references[i] not in known_references:
+            status.append("unknown reference")
+        elif telescopes[i] is not None and telescopes[i] not in known_telescopes:
+            status.append("unknown telescope")
+        else:
+            status.append("ok")
+
+    # Duplicates of existing measurements, or within the table
+    existing = set()
+    to_check = sorted({db_names[i] for i in range(n_rows) if status[i] == "ok"})
+    for start in range(0, len(to_check), 500):
+        existing.update(
+            tuple(row)
+            for row in db.query(
+                db.Photometry.c.source, db.Photometry.c.band, db.Photometry.c.reference
+            )
+            .filter(db.Photometry.c.source.in_(to_check[start : start + 500]))
+            .all()
+        )
+    photometry_data = []
+    for i in range(n_rows):
+        if status[i] != "ok":
+            continue
+        key = (db_names[i], bands[i], references[i])
+        if key in existing:
+            status[i] = "duplicate"
+            continue
+        existing.add(key)
+        status[i] = "added"
+        photometry_data.append(
+            {
+                "source": db_names[i],
+                "band": bands[i],
+                "magnitude": magnitudes[i],
+                "magnitude_error": magnitude_errors[i],
+                "telescope": telescopes[i],
+                "epoch": epochs[i],
+                "comments": comments[i],
+                "reference": references[i],
+            }
+        )
+
+    failed = [i for i in range(n_rows) if status[i] != "added"]
+    for i in failed:
+        logger.warning(
+            f"Photometry for {sources[i]} in {bands[i]} not added: {status[i]}"
+        )
+    if failed and raise_error:
+        msg = (
+            f"{len(failed)} of {n_rows} photometry measurements cannot be ingested. "
+            "Use raise_error=False to add the others."
+        )
+        logger.error(msg)
+        raise AstroDBError(msg)
+
+    try:
+        with db.engine.begin() as conn:
+            for start in range(0, len(photometry_data), chunk_size):
+                conn.execute(
+                    db.Photometry.insert(),
+                    photometry_data[start : start + chunk_size],
+                )
+    except sqlalchemy.exc.IntegrityError as e:
+        msg = f"Photometry could not be added, no rows were ingested: {e}"
+        logger.error(msg)
+        raise AstroDBError(msg)
+
+    logger.info(f"Added {len(photometry_data)} of {n_rows} photometry measurements")
+
+    table["status"] = status
+    return table
+
+
 def ingest_photometry_filter(
     db, *, telescope=None, instrument=None, filter_name=None, ucd=None
 ):
@@ -0,0 +1,339 @@
+import re
+import logging
+import numpy as np
+import astropy.units as u
+from sqlalchemy import event
+from sqlalchemy.sql.dml import Insert, Update, Delete
+from sqlalchemy.sql.elements import TextClause
+from astrodb_scripts import find_source_in_db
+from simple.utils.changes import _PendingChanges, _statement_values, READ_ONLY_SQL
+from simple.utils.spatial import source_index
+
+__all__ = ["SourceResolver", "normalize_name", "normalize_designation", "find_source"]
+
+logger = logging.getLogger("SIMPLE")
+
+# Survey prefixes written in several ways for the same designation,
+# eg 2MASSW J, 2MASSI J and 2MASS J; WISEA J and WISE J; SDSSp J and SDSS J
+_PREFIX_PATTERN = re.compile(r"^(2MASS|CWISE|WISE|SDSS|DENIS)(?:[A-Z]{1,2}|-P)?J(?=\d)")
+
+# Position part of a designation, eg J00001354+2554180 or J0000+2554,
+# with at least hhmm and ddmm
+_DESIGNATION_PATTERN = re.compile(r"J(\d{4}[\d.]*)([+-])(\d{4}[\d.]*)")
+
+
+def normalize_name(name):
+    """
+    Normalized form of a designation used to match names:
+    upper case, without spaces or underscores, unicode minus signs as "-",
+    and survey prefix variants reduced to the survey name.
+
+    Parameters
+    ----------
+    name: str
+
+    Returns
+    -------
+    normalized_name: str
+
+    Examples
+    ----------
+    > normalize_name("2MASSW J0036159+182110")
+    '2MASSJ0036159+182110'
+    """
+    name = str(name).upper().replace("−", "-").replace("_", "")
+    name = "".join(name.split())
+    return _PREFIX_PATTERN.sub(r"\1J", name)
+
+
+def _designation_parts(name):
+    """RA digits, sign and Dec digits of a designation, or None"""
+    match = _DESIGNATION_PATTERN.search(normalize_name(name))
+    if match is None:
+        return None
+    return match.group(1).replace(".", ""), match.group(2), match.group(3).replace(".", "")
+
+
+def normalize_designation(name):
+    """
+    Position part of a designation without the catalog prefix and decimal points,
+    used to match designations written by different catalogs or with different precision.
+
+    Parameters
+    ----------
+    name: str
+
+    Returns
+    -------
+    designation: str or None
+        None if the name is not a Jhhmm±ddmm designation
+
+    Examples
+    ----------
+    > normalize_designation("2MASS J00001354+2554180")
+    'J00001354+2554180'
+    > normalize_designation("WISEA J000013.54+255418.0")
+    'J00001354+2554180'
+    """
+    parts = _designation_parts(name)
+    if parts is None:
+        return None
+    return "J" + "".join(parts)
+
+
+class SourceResolver:
+    """
+    Match names to Sources.source values without querying the database for each name.
+    Built once from the Sources names and shortnames and the Names table,
+    with maps of exact and normalized names
+    (see normalize_name) and of designations (see normalize_designation), so that
+    "2MASS J0000+2554" matches "2MASS J00001354+2554180". The optional positional match
+    uses the spatial index of the database (see simple.utils.spatial.source_index).
+    search finds names containing a string, like the fuzzy search of
+    Database.search_object, with a trigram index built on its first use.
+
+    The resolver listens to the database engine: new Sources and Names rows are added
+    when their transaction commits, and committed updates or deletes rebuild the maps
+    on the next lookup. Rows of transactions that roll back are never added.
+
+    Parameters
+    ----------
+    db: astrodbkit2.astrodb.Database
+        Database object created by astrodbkit2
+    search_radius: astropy.units.Quantity
+        Radius for the positional match, used when a name is not found
+        and coordinates are given. Default: 60 arcsec, as find_source_in_db
+
+    Examples
+    ----------
+    > resolver = SourceResolver(db)
+    > resolver.resolve("2MASSW J0036159+182110")
+    ['2MASS J00361617+1821104']
+    > ingest_parallaxes(db, sources, plxs, plx_errs, refs, resolver=resolver)
+    """
+
+    def __init__(self, db, search_radius=60 * u.arcsec):
+        self.db = db
+        self.search_radius = search_radius
+        self._stale = True
+        self._build()
+        self._pending = _PendingChanges(db.engine, self._apply_changes)
+        event.listen(db.engine, "after_execute", self._after_execute)
+
+    def stop(self):
+        """Stop listening to the database engine"""
+        event.remove(self.db.engine, "after_execute", self._after_execute)
+        self._pending.stop()
+
+    def _build(self):
+        db = self.db
+        self._exact = {}
+        self._normalized = {}
+        self._designations = {}
+        self._trigrams = None
+        sources = db.query(db.Sources.c.source, db.Sources.c.shortname).all()
+        for source, shortname in sources:
+            self._add_name(source, source)
+            self._add_name(shortname, source)
+        for other_name, source in db.query(
+            db.Names.c.other_name, db.Names.c.source
+        ).all():
+            self._add_name(other_name, source)
+        self._stale = False
+        logger.debug(f"Built source resolver: {len(sources)} sources")
+
+    def _add_name(self, name, source):
+        if name is None or source is None:
+            return
+        new_name = name not in self._exact
+        self._exact.setdefault(name, set()).add(source)
+        self._normalized.setdefault(normalize_name(name), set()).add(source)
+
+        parts = _designation_parts(name)
+        if parts is not None:
+            # Grouped by hhmm±ddmm, the precision every designation has
+            key = (parts[0][:4], parts[1], parts[2][:4])
+            self._designations.setdefault(key, set()).add((parts, source))
+
+        if self._trigrams is not None and new_name:
+            self._add_trigrams(name)
+
+    def _add_trigrams(self, name):
+        lower_name = name.lower()
+        for i in range(len(lower_name) - 2):
+            self._trigrams.setdefault(lower_name[i : i + 3], set()).add(name)
+
+    def _match_designation(self, name):
+        """Sources with a designation equal to that of name, up to the shorter precision"""
+        parts = _designation_parts(name)
+        if parts is None:
+            return set()
+        ra, sign, dec = parts
+        found = set()
+        for (ra_i, _, dec_i), source in self._designations.get(
+            (ra[:4], sign, dec[:4]), ()
+        ):
+            if (ra_i.startswith(ra) or ra.startswith(ra_i)) and (
+                dec_i.startswith(dec) or dec.startswith(dec_i)
+            ):
+                found.add(source)
+        return found
+
+    def _after_execute(self, conn, clauseelement, multiparams, params, execution_options, result):
+        if isinstance(clauseelement, TextClause):
+            if not clauseelement.text.lstrip().upper().startswith(READ_ONLY_SQL):
+                self._pending.add(conn, None)
+            return
+        if not isinstance(clauseelement, (Insert, Update, Delete)):
+            return
+
+        table = clauseelement.table.name
+        if table not in ("Sources", "Names"):
+            return
+        if not isinstance(clauseelement, Insert):
+            self._pending.add(conn, None)
+            return
+
+        names = []
+        for row in _statement_values(clauseelement, multiparams, params):
+            if table == "Sources" and "source" in row:
+                names.append((row["source"], row["source"]))
+                names.append((row.get("shortname"), row["source"]))
+            elif table == "Names" and "other_name" in row:
+                names.append((row["other_name"], row.get("source")))
+            else:
+                self._pending.add(conn, None)
+                return
+        self._pending.add(conn, names)
+
+    def _apply_changes(self, changes):
+        """Names of committed inserts, or None for changes that need a rebuild"""
+        if self._stale:
+            return
+        if None in changes:
+            self._stale = True
+            return
+        for names in changes:
+            for name, source in names:
+                self._add_name(name, source)
+
+    def resolve(self, name, ra=None, dec=None, search_radius=None, epoch=None):
+        """
+        Sources matching a name, by exact name, then normalized name, then designation,
+        then by position if ra and dec are given.
+
+        Parameters
+        ----------
+        name: str
+        ra, dec: float, optional
+            Coordinates in degrees, used if the name is not found
+        search_radius: astropy.units.Quantity, optional
+            Default: the search_radius of the resolver
+        epoch: float, optional
+            Epoch of ra and dec in decimal years. The Sources are moved to it by their
+            proper motions (see simple.utils.spatial.propagate_positions).
+            Default: the Sources coordinates as they are
+
+        Returns
+        -------
+        db_names: list[str]
+            Matching Sources.source values. Empty if none are found.
+        """
+        if self._stale:
+            self._build()
+
+        if name is not None:
+            found = (
+                self._exact.get(str(name).strip())
+                or self._normalized.get(normalize_name(name))
+                or self._match_designation(name)
+            )
+            if found:
+                return sorted(found)
+
+        if ra is not None and dec is not None and np.isfinite([ra, dec]).all():
+            if search_radius is None:
+                search_radius = self.search_radius
+            sources, _ = source_index(self.db, epoch).query(ra, dec, search_radius)
+            return sources
+
+        return []
+
+    def resolve_many(self, names, ra=None, dec=None, search_radius=None, epoch=None):
+        """
+        Resolve a list of names. See resolve.
+
+        Parameters
+        ----------
+        names: list[str]
+        ra, dec: list[float], optional
+            Coordinates in degrees, used for names which are not found
+
+        Returns
+        -------
+        db_names: list[list[str]]
+            Matching Sources.source values for each name
+        """
+        if ra is None or dec is None:
+            ra = dec = [None] * len(names)
+        return [
+            self.resolve(name, ra_i, dec_i, search_radius, epoch)
+            for name, ra_i, dec_i in zip(names, ra, dec)
+        ]
+
+    def search(self, text):
+        """
+        Sources with a name, shortname or other name containing a string, ignoring case,
+        as Database.search_object(name, fuzzy_search=True) but without a table scan.
+
+        Parameters
+        ----------
+        text: str
+
+        Returns
+        -------
+        db_names: list[str]
+            Matching Sources.source values
+        """
+        if self._stale:
+            self._build()
+        if self._trigrams is None:
+            self._trigrams = {}
+            for name in self._exact:
+                self._add_trigrams(name)
+
+        text = str(text).strip().lower()
+        if len(text) < 3:
+            candidates = self._exact.keys()
+        else:
+            trigram_sets = sorted(
+                (self._trigrams.get(text[i : i + 3], set()) for i in range(len(text) - 2)),
+                key=len,
+            )
+            candidates = trigram_sets[0].intersection(*trigram_sets[1:])
+
+        found = set()
+        for name in candidates:
+            if text in name.lower():
+                found.update(self._exact[name])
+        return sorted(found)
+
+
+def find_source(db, source, resolver=None):
+    """
+    Sources matching a name: with the resolver if one is given,
+    otherwise with astrodb_scripts.find_source_in_db.
+
+    Parameters
+    ----------
+    db: astrodbkit2.astrodb.Database
+    source: str
+    resolver: SourceResolver, optional
+
+    Returns
+    -------
+    db_names: list[str]
+    """
+    if resolver is not None:
+        return resolver.resolve(source)
+    return find_source_in_db(db, source)
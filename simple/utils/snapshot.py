@@ -0,0 +1,329 @@
+import os
+import json
+import logging
+import numpy as np
+from astropy.table import Table, MaskedColumn
+from sqlalchemy import Boolean, Float
+from astrodbkit2.astrodb import Database
+from astrodb_scripts import AstroDBError
+from simple.schema import REFERENCE_TABLES
+from simple.utils.bulk_load import bulk_load_database, hash_data_directory
+
+__all__ = [
+    "build_snapshot",
+    "load_snapshot",
+    "read_snapshot_tables",
+    "check_snapshot",
+]
+
+logger = logging.getLogger("SIMPLE")
+
+SNAPSHOT_INFO = "snapshot.json"
+SNAPSHOT_FORMATS = ["npz", "parquet"]
+
+
+def _column_kind(column):
+    """Storage kind of a column in the snapshot: float, bool or str"""
+    if isinstance(column.type, Float):
+        return "float"
+    elif isinstance(column.type, Boolean):
+        return "bool"
+    else:
+        # Strings, enumerations and datetimes keep the text SQLite stores
+        return "str"
+
+
+def _encode_column(values, kind):
+    """
+    Convert raw SQLite values to numpy arrays, keyed by file suffix.
+    Strings are stored Arrow-style as one UTF-8 buffer plus offsets,
+    which keeps them compact and exact (including embedded NUL characters).
+    """
+    arrays = {".mask": np.array([value is None for value in values], dtype=bool)}
+    if kind == "float":
+        arrays[""] = np.array(
+            [np.nan if value is None else value for value in values], dtype=float
+        )
+    elif kind == "bool":
+        arrays[""] = np.array([bool(value) for value in values], dtype=bool)
+    else:
+        strings = ["" if value is None else str(value) for value in values]
+        arrays[""] = np.frombuffer("".join(strings).encode("utf-8"), dtype=np.uint8)
+        arrays[".offsets"] = np.cumsum([0] + [len(string) for string in strings])
+    return arrays
+
+
+def _decode_column(arrays, kind):
+    """Convert the arrays written by _encode_column back to a list of values"""
+    if kind == "str":
+        text = arrays[""].tobytes().decode("utf-8")
+        offsets = arrays[".offsets"].tolist()
+        values = [text[start:end] for start, end in zip(offsets[:-1], offsets[1:])]
+    else:
+        values = arrays[""].tolist()
+    for i in np.flatnonzero(arrays[".mask"]):
+        values[i] = None
+    return values
+
+
+def _latest_version(db):
+    """Most recent released entry of the Versions table, as a dictionary"""
+    versions = db.metadata.tables["Versions"]
+    row = (
+        db.query(versions)
+        .filter(versions.c.end_date.is_not(None))
+        .order_by(versions.c.end_date.desc())
+        .first()
+    )
+    if row is None:
+        return None
+    return row._asdict()
+
+
+def build_snapshot(snapshot_dir, data_path="data", *, db=None, fmt="npz", workers=None):
+    """
+    Compile the database into one columnar file per table, for fast read-only startup.
+    Each table in simple/schema.py is written as uncompressed numpy arrays (npz)
+    or Parquet, with a mask per column for NULL values.
+    A snapshot.json file records the columns, the latest Versions entry
+    and a hash of the JSON files the snapshot was built from.
+
+    Parameters
+    ----------
+    snapshot_dir: str
+        Directory in which to write the snapshot
+    data_path: str
+        Directory containing the JSON files
+    db: astrodbkit2.astrodb.Database, optional
+        Database already loaded from data_path. Default: load it with bulk_load_database.
+    fmt: str
+        "npz" (default) or "parquet" (requires pyarrow)
+    workers: int, optional
+        Number of worker processes used to parse the JSON files
+
+    Returns
+    -------
+    info: dict
+        Contents of snapshot.json
+
+    Examples
+    ----------
+    > build_snapshot("snapshot", "data")
+    > db = load_snapshot("snapshot")
+    """
+    if fmt not in SNAPSHOT_FORMATS:
+        msg = f"Snapshot format {fmt} is not one of {SNAPSHOT_FORMATS}"
+        raise AstroDBError(msg)
+
+    if db is None:
+        db = Database("sqlite://", reference_tables=REFERENCE_TABLES)
+        bulk_load_database(db, data_path, workers=workers)
+
+    os.makedirs(snapshot_dir, exist_ok=True)
+
+    info = {
+        "format": fmt,
+        "version": _latest_version(db),
+        "data_hash": hash_data_directory(data_path),
+        "tables": {},
+    }
+
+    with db.engine.connect() as conn:
+        for table in db.metadata.sorted_tables:
+            columns = [column.name for column in table.columns]
+            kinds = [_column_kind(column) for column in table.columns]
+            column_sql = ", ".join(f'"{name}"' for name in columns)
+            # Driver-level query keeps the values exactly as SQLite stores them
+            rows = conn.exec_driver_sql(
+                f'SELECT {column_sql} FROM "{table.name}"'
+            ).fetchall()
+
+            filename = os.path.join(snapshot_dir, f"{table.name}.{fmt}")
+            if fmt == "npz":
+                arrays = {}
+                for i, (name, kind) in enumerate(zip(columns, kinds)):
+                    column_arrays = _encode_column([row[i] for row in rows], kind)
+                    for suffix, array in column_arrays.items():
+                        arrays[name + suffix] = array
+                np.savez(filename, **arrays)
+            else:
+                t = Table(
+                    [
+                        MaskedColumn(
+                            [row[i] for row in rows],
+                            name=name,
+                            mask=[row[i] is None for row in rows],
+                        )
+                        for i, name in enumerate(columns)
+                    ]
+                )
+                t.write(filename, format="parquet", overwrite=True)
+
+            info["tables"][table.name] = {
+                "columns": columns,
+                "kinds": kinds,
+                "rows": len(rows),
+            }
+
+    with open(os.path.join(snapshot_dir, SNAPSHOT_INFO), "w", encoding="utf-8") as f:
+        json.dump(info, f, indent=4)
+
+    logger.info(f"Wrote snapshot of {len(info['tables'])} tables to {snapshot_dir}")
+
+    return info
+
+
+def _read_info(snapshot_dir):
+    filename = os.path.join(snapshot_dir, SNAPSHOT_INFO)
+    if not os.path.exists(filename):
+        msg = f"No {SNAPSHOT_INFO} found in {snapshot_dir}"
+        raise AstroDBError(msg)
+    with open(filename, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _read_columns(snapshot_dir, table_name, info):
+    """Read one table as a dictionary of column name to list of values"""
+    fmt = info["format"]
+    columns = info["tables"][table_name]["columns"]
+    kinds = info["tables"][table_name]["kinds"]
+    filename = os.path.join(snapshot_dir, f"{table_name}.{fmt}")
+
+    results = {}
+    if fmt == "npz":
+        with np.load(filename) as f:
+            for name, kind in zip(columns, kinds):
+                arrays = {
+                    suffix: f[name + suffix]
+                    for suffix in ("", ".mask", ".offsets")
+                    if name + suffix in f
+                }
+                results[name] = _decode_column(arrays, kind)
+    else:
+        t = Table.read(filename, format="parquet")
+        for name in columns:
+            values = t[name].tolist()
+            for i in np.flatnonzero(np.ma.getmaskarray(t[name])):
+                values[i] = None
+            results[name] = values
+    return results
+
+
+def read_snapshot_tables(snapshot_dir, tables=None):
+    """
+    Read snapshot tables as astropy Tables with masked columns for NULL values.
+
+    Parameters
+    ----------
+    snapshot_dir: str
+        Directory written by build_snapshot
+    tables: list[str], optional
+        Names of tables to read. Default: all tables
+
+    Returns
+    -------
+    results: dict
+        Dictionary of table name to astropy.table.Table
+    """
+    info = _read_info(snapshot_dir)
+    if tables is None:
+        tables = list(info["tables"])
+
+    results = {}
+    for table_name in tables:
+        columns = _read_columns(snapshot_dir, table_name, info)
+        results[table_name] = Table(
+            [
+                MaskedColumn(
+                    values, name=name, mask=[value is None for value in values]
+                )
+                for name, values in columns.items()
+            ]
+        )
+    return results
+
+
+def load_snapshot(snapshot_dir, fmt="sqlite"):
+    """
+    Load a snapshot into a ready in-memory database.
+
+    Parameters
+    ----------
+    snapshot_dir: str
+        Directory written by build_snapshot
+    fmt: str
+        "sqlite" (default): return an in-memory astrodbkit2 Database
+        "astropy": return a dictionary of astropy Tables (see read_snapshot_tables)
+
+    Returns
+    -------
+    db: astrodbkit2.astrodb.Database or dict
+    """
+    if fmt.lower() in ("astropy", "table"):
+        return read_snapshot_tables(snapshot_dir)
+    elif fmt.lower() != "sqlite":
+        msg = f"Unrecognized format {fmt}"
+        raise AstroDBError(msg)
+
+    info = _read_info(snapshot_dir)
+    db = Database("sqlite://", reference_tables=REFERENCE_TABLES)
+
+    with db.engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            if table.name not in info["tables"]:
+                logger.warning(f"{table.name} is not in the snapshot")
+                continue
+
+            if info["tables"][table.name]["rows"] == 0:
+                continue
+
+            columns = _read_columns(snapshot_dir, table.name, info)
+            values = list(columns.values())
+
+            column_sql = ", ".join(f'"{name}"' for name in columns)
+            placeholders = ", ".join("?" for _ in columns)
+            conn.exec_driver_sql(
+                f'INSERT INTO "{table.name}" ({column_sql}) VALUES ({placeholders})',
+                list(zip(*values)),
+            )
+
+    return db
+
+
+def check_snapshot(snapshot_dir, data_path="data"):
+    """
+    Check that a snapshot matches the JSON files in a data directory.
+
+    Parameters
+    ----------
+    snapshot_dir: str
+        Directory written by build_snapshot
+    data_path: str
+        Directory containing the JSON files
+
+    Returns
+    -------
+    match: bool
+        True if the snapshot was built from the current JSON files
+    """
+    info = _read_info(snapshot_dir)
+
+    with open(os.path.join(data_path, "Versions.json"), "r", encoding="utf-8") as f:
+        versions = [v for v in json.load(f) if v["end_date"] is not None]
+    data_version = max(versions, key=lambda v: v["end_date"]) if versions else None
+
+    if info["version"] != data_version:
+        logger.warning(
+            f"Snapshot version {info['version']} does not match "
+            f"the Versions table in {data_path}: {data_version}"
+        )
+        return False
+
+    if info["data_hash"] != hash_data_directory(data_path):
+        logger.warning(
+            f"Snapshot was built for version {info['version']}, "
+            f"but the JSON files in {data_path} have changed since"
+        )
+        return False
+
+    return True
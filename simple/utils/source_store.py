@@ -0,0 +1,207 @@
+import os
+import copy
+import json
+import logging
+from functools import lru_cache
+from astrodbkit2.utils import datetime_json_parser
+from astrodb_scripts import AstroDBError
+from simple.schema import REFERENCE_TABLES
+from simple.utils.bulk_load import list_source_files, read_source_files
+
+__all__ = ["SourceStore", "index_path"]
+
+logger = logging.getLogger("SIMPLE")
+
+INDEX_VERSION = 1
+
+
+def index_path(directory):
+    """Default name of the index file for a data directory, eg data_index.json"""
+    return os.path.normpath(directory) + "_index.json"
+
+
+def _file_state(path):
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+class SourceStore:
+    """
+    Read-only access to the source JSON files in a data directory,
+    without building a database.
+
+    Sources are found by their primary name or any of their Names.other_name values.
+    An index of names is kept in a file next to the data directory
+    (eg, data_index.json), so only new or edited files are read at startup.
+    A source's JSON file is parsed only when requested and kept in an LRU cache.
+
+    Parameters
+    ----------
+    directory: str
+        Directory containing the JSON files
+    index_file: str, optional
+        Name of the index file. Default: see index_path
+    cache_size: int
+        Number of parsed sources kept in memory
+    workers: int, optional
+        Number of worker processes used to read files when building the index
+
+    Examples
+    ----------
+    > store = SourceStore("data")
+    > store.inventory("CWISE J000021.45-481314.9")
+    """
+
+    def __init__(self, directory="data", index_file=None, cache_size=256, workers=None):
+        self.directory = directory
+        self.index_file = index_file or index_path(directory)
+        self.workers = workers
+        self._read = lru_cache(maxsize=cache_size)(self._read_file)
+
+        self._files = {}
+        if os.path.exists(self.index_file):
+            with open(self.index_file, "r", encoding="utf-8") as f:
+                index = json.load(f)
+            if index.get("version") == INDEX_VERSION:
+                self._files = index["files"]
+
+        # Compares the size and mtime of every file with the index, and only reads
+        # the files that changed
+        self.refresh()
+
+    def __len__(self):
+        return len(self._files)
+
+    def __contains__(self, name):
+        return self.find(name) is not None
+
+    @property
+    def sources(self):
+        """Primary names of all sources"""
+        return sorted(entry["source"] for entry in self._files.values())
+
+    def refresh(self):
+        """
+        Update the index for files added, removed or edited since it was written.
+        Only those files are read.
+        """
+        files = list_source_files(self.directory)
+        states = {}
+        names = set(files)
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if entry.name in names:
+                    stat = entry.stat()
+                    states[entry.name] = [stat.st_size, stat.st_mtime_ns]
+        stale = [
+            file
+            for file in files
+            if file not in self._files or self._files[file]["state"] != states[file]
+        ]
+        removed = set(self._files) - set(files)
+        for file in removed:
+            del self._files[file]
+
+        if stale:
+            logger.info(f"Indexing {len(stale)} source files in {self.directory}")
+            rows, sources = read_source_files(
+                self.directory, stale, workers=self.workers, return_sources=True
+            )
+            names = {source: [] for source in sources}
+            for row in rows.get("Names", []):
+                names[row["source"]].append(row["other_name"])
+            for file, source in zip(stale, sources):
+                self._files[file] = {
+                    "source": source,
+                    "names": names[source],
+                    "state": states[file],
+                }
+
+        if stale or removed or not os.path.exists(self.index_file):
+            index = {"version": INDEX_VERSION, "files": self._files}
+            with open(self.index_file, "w", encoding="utf-8") as f:
+                json.dump(index, f)
+
+        self._build_lookup()
+
+    def _build_lookup(self):
+        """Map exact and lower case names to file names"""
+        self._names = {}
+        self._lower_names = {}
+        for file, entry in self._files.items():
+            for name in [entry["source"]] + entry["names"]:
+                self._names.setdefault(name, file)
+                self._lower_names.setdefault(name.lower(), file)
+
+    def _read_file(self, file, state):
+        # The file state is part of the cache key, so edited files are read again
+        with open(os.path.join(self.directory, file), "r", encoding="utf-8") as f:
+            return json.load(f, object_hook=datetime_json_parser)
+
+    def _find_file(self, name):
+        name = name.strip()
+        return self._names.get(name) or self._lower_names.get(name.lower())
+
+    def find(self, name):
+        """
+        Primary name of a source, matched by any of its names (case insensitive)
+
+        Parameters
+        ----------
+        name: str
+
+        Returns
+        -------
+        source: str or None
+        """
+        file = self._find_file(name)
+        if file is None:
+            return None
+        return self._files[file]["source"]
+
+    def inventory(self, name):
+        """
+        All information for a source, in the same form as astrodbkit2's Database.inventory
+
+        Parameters
+        ----------
+        name: str
+            Any name of the source
+
+        Returns
+        -------
+        data_dict: dict
+            Dictionary of table name to list of rows. Empty if the source is not found.
+        """
+        file = self._find_file(name)
+        if file is None:
+            return {}
+
+        path = os.path.join(self.directory, file)
+        try:
+            state = tuple(_file_state(path))
+        except FileNotFoundError:
+            msg = f"{path} was removed, call refresh() to update the index"
+            raise AstroDBError(msg)
+        # Copy so callers can't modify the cached data
+        return copy.deepcopy(self._read(file, state))
+
+    def reference_table(self, table):
+        """
+        Rows of a reference table (eg, Publications)
+
+        Parameters
+        ----------
+        table: str
+
+        Returns
+        -------
+        rows: list[dict]
+        """
+        if table not in REFERENCE_TABLES:
+            msg = f"{table} is not a reference table"
+            raise AstroDBError(msg)
+        path = os.path.join(self.directory, table + ".json")
+        if not os.path.exists(path):
+            return []
+        return copy.deepcopy(self._read(table + ".json", tuple(_file_state(path))))
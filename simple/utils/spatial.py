@@ -0,0 +1,486 @@
+import logging
+import weakref
+from collections import OrderedDict, defaultdict
+import numpy as np
+import astropy.units as u
+from astropy.table import Column, Table
+from scipy.spatial import cKDTree
+from sqlalchemy import event
+from sqlalchemy.sql.dml import Insert, Update, Delete
+from sqlalchemy.sql.elements import TextClause
+from simple.utils.changes import _PendingChanges, _statement_values, READ_ONLY_SQL
+
+__all__ = [
+    "SourceIndex",
+    "source_index",
+    "cone_search",
+    "cone_search_many",
+    "propagate_positions",
+]
+
+logger = logging.getLogger("SIMPLE")
+
+# Sources inserted since the tree was built are searched directly
+# until there are this many of them
+MAX_PENDING = 256
+
+# Epoch of the Sources coordinates without an epoch, in decimal years.
+# Most of them come from 2MASS, observed around 2000.
+DEFAULT_EPOCH = 2000.0
+
+# Shared indexes, {db: {epoch: SourceIndex}} with the most recently used epoch last,
+# see source_index. Each database keeps at most MAX_EPOCHS indexes.
+_indexes = weakref.WeakKeyDictionary()
+MAX_EPOCHS = 4
+
+
+def _unit_vectors(ra, dec):
+    """Unit vectors of positions in degrees, shape (n, 3)"""
+    ra = np.radians(np.asarray(ra, dtype=float))
+    dec = np.radians(np.asarray(dec, dtype=float))
+    cos_dec = np.cos(dec)
+    return np.stack(
+        [cos_dec * np.cos(ra), cos_dec * np.sin(ra), np.sin(dec)], axis=-1
+    ).reshape(-1, 3)
+
+
+def _chord(angle):
+    """Straight-line distance between unit vectors separated by angle (radians)"""
+    return 2 * np.sin(np.minimum(angle, np.pi) / 2)
+
+
+def _angle(chord):
+    """Angle in radians between unit vectors a chord apart, accurate for small angles"""
+    return 2 * np.arcsin(np.clip(chord / 2, 0, 1))
+
+
+def _propagate(ra, dec, mu_ra, mu_dec, years):
+    """
+    Positions in degrees moved by proper motions in mas/yr (mu_ra includes cos(dec))
+    over a number of years, along the tangent plane, which is well behaved at the poles
+    """
+    ra_rad = np.radians(ra)
+    dec_rad = np.radians(dec)
+    # Unit vectors towards the east and the north at each position
+    east = np.stack([-np.sin(ra_rad), np.cos(ra_rad), np.zeros_like(ra_rad)], axis=-1)
+    north = np.stack(
+        [
+            -np.sin(dec_rad) * np.cos(ra_rad),
+            -np.sin(dec_rad) * np.sin(ra_rad),
+            np.cos(dec_rad),
+        ],
+        axis=-1,
+    )
+    scale = np.radians(years / 3.6e6)  # mas to radians
+    vectors = (
+        _unit_vectors(ra, dec)
+        + (mu_ra * scale)[:, None] * east
+        + (mu_dec * scale)[:, None] * north
+    )
+    vectors /= np.linalg.norm(vectors, axis=1)[:, None]
+    new_ra = np.degrees(np.arctan2(vectors[:, 1], vectors[:, 0])) % 360
+    new_dec = np.degrees(np.arcsin(np.clip(vectors[:, 2], -1, 1)))
+    return new_ra, new_dec
+
+
+def propagate_positions(db, epoch, default_epoch=DEFAULT_EPOCH):
+    """
+    Positions of all the Sources at another epoch, moved by their proper motions.
+    The adopted ProperMotions row of each source is used, or its only row if it has
+    a single one. Parallax and radial velocity are ignored.
+
+    Parameters
+    ----------
+    db: astrodbkit2.astrodb.Database
+        Database object created by astrodbkit2
+    epoch: float
+        Target epoch in decimal years, eg 2016.0 for Gaia DR3
+    default_epoch: float
+        Epoch of the coordinates of Sources without one. Default: 2000.0
+
+    Returns
+    -------
+    positions: astropy.table.Table
+        Columns source, ra and dec (degrees, at the target epoch), epoch (of the
+        Sources coordinates), mu_ra and mu_dec (mas/yr, nan without a proper motion).
+        Sources without a proper motion keep their coordinates.
+
+    Examples
+    ----------
+    > positions = propagate_positions(db, 2016.0)
+    """
+    sources = db.query(
+        db.Sources.c.source, db.Sources.c.ra, db.Sources.c.dec, db.Sources.c.epoch
+    ).all()
+    pm = db.ProperMotions
+    motions = {}
+    measurements = defaultdict(list)
+    for source, mu_ra, mu_dec, adopted in db.query(
+        pm.c.source, pm.c.mu_ra, pm.c.mu_dec, pm.c.adopted
+    ).all():
+        measurements[source].append((mu_ra, mu_dec))
+        if adopted:
+            motions.setdefault(source, (mu_ra, mu_dec))
+    for source, rows in measurements.items():
+        if source not in motions and len(rows) == 1:
+            motions[source] = rows[0]
+
+    names = [row[0] for row in sources]
+    ra = np.array([row[1] for row in sources], dtype=float)
+    dec = np.array([row[2] for row in sources], dtype=float)
+    epochs = np.array(
+        [default_epoch if row[3] is None else row[3] for row in sources], dtype=float
+    )
+    mu = np.array([motions.get(name, (np.nan, np.nan)) for name in names], dtype=float)
+    mu = mu.reshape(-1, 2)
+
+    new_ra, new_dec = ra.copy(), dec.copy()
+    moving = np.isfinite(mu).all(axis=1) & np.isfinite(ra) & np.isfinite(dec)
+    if moving.any():
+        new_ra[moving], new_dec[moving] = _propagate(
+            ra[moving],
+            dec[moving],
+            mu[moving, 0],
+            mu[moving, 1],
+            epoch - epochs[moving],
+        )
+
+    return Table(
+        [
+            Column(np.array(names, dtype=str), name="source"),
+            Column(new_ra, name="ra", unit=u.deg),
+            Column(new_dec, name="dec", unit=u.deg),
+            Column(epochs, name="epoch"),
+            Column(mu[:, 0], name="mu_ra", unit=u.mas / u.yr),
+            Column(mu[:, 1], name="mu_dec", unit=u.mas / u.yr),
+        ]
+    )
+
+
+def _radians(radius):
+    """Radius as a Quantity or in degrees, in radians"""
+    return u.Quantity(radius, u.deg).to_value(u.radian)
+
+
+class SourceIndex:
+    """
+    Spatial index of the Sources positions: a k-d tree of their unit vectors,
+    which handles RA wrapping at 0/360 degrees and the poles without special cases.
+
+    The index listens to the database engine: Sources inserted by committed
+    transactions are searched directly until MAX_PENDING of them are added,
+    then the tree is rebuilt. Committed updates or deletes of Sources rebuild
+    the tree on the next search. Sources without coordinates are not indexed.
+    The index only keeps a weak reference to the database.
+
+    With an epoch, the positions are moved to that epoch with propagate_positions,
+    and changes to ProperMotions also rebuild the tree.
+
+    Parameters
+    ----------
+    db: astrodbkit2.astrodb.Database
+        Database object created by astrodbkit2
+    epoch: float, optional
+        Epoch of the indexed positions in decimal years.
+        Default: the Sources coordinates as they are
+
+    Examples
+    ----------
+    > index = SourceIndex(db)
+    > sources, separations = index.query(10.0667, 18.3528, 10 * u.arcsec)
+    """
+
+    def __init__(self, db, epoch=None):
+        self._db = weakref.ref(db)
+        self.epoch = epoch
+        self._stale = True
+        self._build()
+        self._engine = db.engine
+        self._pending = _PendingChanges(db.engine, self._apply_changes)
+        event.listen(db.engine, "after_execute", self._after_execute)
+
+    @property
+    def db(self):
+        """The indexed database"""
+        db = self._db()
+        if db is None:
+            raise ReferenceError("The database of the index no longer exists")
+        return db
+
+    def stop(self):
+        """Stop listening to the database engine"""
+        if event.contains(self._engine, "after_execute", self._after_execute):
+            event.remove(self._engine, "after_execute", self._after_execute)
+            self._pending.stop()
+
+    def _build(self):
+        db = self.db
+        if self.epoch is None:
+            rows = db.query(db.Sources.c.source, db.Sources.c.ra, db.Sources.c.dec).all()
+            self._set_positions(
+                [row[0] for row in rows],
+                [row[1] for row in rows],
+                [row[2] for row in rows],
+            )
+        else:
+            positions = propagate_positions(db, self.epoch)
+            self._set_positions(positions["source"], positions["ra"], positions["dec"])
+        self._stale = False
+        logger.debug(f"Built spatial index: {len(self._names)} sources")
+
+    def _set_positions(self, names, ra, dec):
+        ra = np.array(ra, dtype=float)
+        dec = np.array(dec, dtype=float)
+        good = np.isfinite(ra) & np.isfinite(dec)
+        self._names = np.array(names, dtype=object)[good]
+        self._ra = ra[good]
+        self._dec = dec[good]
+        self._vectors = _unit_vectors(self._ra, self._dec)
+        self._tree = cKDTree(self._vectors)
+        self._n_tree = len(self._names)
+
+    def _add_source(self, name, ra, dec):
+        if ra is None or dec is None or not np.isfinite([ra, dec]).all():
+            return
+        self._names = np.append(self._names, np.array([name], dtype=object))
+        self._ra = np.append(self._ra, ra)
+        self._dec = np.append(self._dec, dec)
+        self._vectors = np.vstack([self._vectors, _unit_vectors(ra, dec)])
+        if len(self._names) - self._n_tree > MAX_PENDING:
+            self._set_positions(self._names, self._ra, self._dec)
+
+    def _after_execute(self, conn, clauseelement, multiparams, params, execution_options, result):
+        if isinstance(clauseelement, TextClause):
+            if not clauseelement.text.lstrip().upper().startswith(READ_ONLY_SQL):
+                self._pending.add(conn, None)
+            return
+        if not isinstance(clauseelement, (Insert, Update, Delete)):
+            return
+        if clauseelement.table.name == "ProperMotions" and self.epoch is not None:
+            self._pending.add(conn, None)
+            return
+        if clauseelement.table.name != "Sources":
+            return
+        if not isinstance(clauseelement, Insert):
+            self._pending.add(conn, None)
+            return
+
+        positions = []
+        for row in _statement_values(clauseelement, multiparams, params):
+            if "source" not in row:
+                self._pending.add(conn, None)
+                return
+            positions.append((row["source"], row.get("ra"), row.get("dec")))
+        self._pending.add(conn, positions)
+
+    def _apply_changes(self, changes):
+        """Positions of committed inserts, or None for changes that need a rebuild"""
+        if self._stale:
+            return
+        if None in changes:
+            self._stale = True
+            return
+        for positions in changes:
+            for name, ra, dec in positions:
+                self._add_source(name, ra, dec)
+
+    def __len__(self):
+        if self._stale:
+            self._build()
+        return len(self._names)
+
+    @property
+    def names(self):
+        """Sources.source values of the indexed sources"""
+        if self._stale:
+            self._build()
+        return self._names
+
+    @property
+    def ra(self):
+        """Right ascensions of the indexed sources, in degrees"""
+        if self._stale:
+            self._build()
+        return self._ra
+
+    @property
+    def dec(self):
+        """Declinations of the indexed sources, in degrees"""
+        if self._stale:
+            self._build()
+        return self._dec
+
+    def query_many(self, ra, dec, radius):
+        """
+        Indexed sources within a radius of each position.
+
+        Parameters
+        ----------
+        ra, dec: array-like
+            Positions in degrees
+        radius: astropy.units.Quantity or float or array-like
+            Search radius, in degrees if a number. One value or one per position.
+
+        Returns
+        -------
+        matches: list[tuple[numpy.ndarray, numpy.ndarray]]
+            For each position, the indices of the matching sources
+            (into SourceIndex.names) and their separations in degrees, nearest first
+        """
+        if self._stale:
+            self._build()
+
+        vectors = _unit_vectors(ra, dec)
+        chords = np.broadcast_to(_chord(_radians(radius)), len(vectors))
+        valid = np.isfinite(vectors).all(axis=1)
+        neighbours = np.empty(len(vectors), dtype=object)
+        neighbours[:] = [[] for _ in range(len(vectors))]
+        if valid.any():
+            neighbours[valid] = self._tree.query_ball_point(
+                vectors[valid], chords[valid]
+            )
+        pending = self._vectors[self._n_tree :]
+
+        matches = []
+        for i in range(len(vectors)):
+            indices = np.asarray(neighbours[i], dtype=int)
+            if valid[i] and len(pending):
+                near = np.linalg.norm(pending - vectors[i], axis=1) <= chords[i]
+                indices = np.concatenate([indices, self._n_tree + np.flatnonzero(near)])
+            separations = np.degrees(
+                _angle(np.linalg.norm(self._vectors[indices] - vectors[i], axis=1))
+            )
+            order = np.argsort(separations, kind="stable")
+            matches.append((indices[order], separations[order]))
+        return matches
+
+    def query(self, ra, dec, radius):
+        """
+        Indexed sources within a radius of a position, nearest first.
+
+        Parameters
+        ----------
+        ra, dec: float
+            Position in degrees
+        radius: astropy.units.Quantity or float
+            Search radius, in degrees if a number
+
+        Returns
+        -------
+        sources: list[str]
+            Sources.source values
+        separations: numpy.ndarray
+            Separations in degrees
+        """
+        indices, separations = self.query_many([ra], [dec], radius)[0]
+        return self._names[indices].tolist(), separations
+
+
+def _results_table(index, indices, separations, rows=None):
+    """Table of the matched sources, with separations converted to arcsec"""
+    columns = [
+        Column(index.names[indices].astype(str), name="source"),
+        Column(index.ra[indices], name="ra", unit=u.deg),
+        Column(index.dec[indices], name="dec", unit=u.deg),
+        Column(separations * 3600, name="separation", unit=u.arcsec),
+    ]
+    if rows is not None:
+        columns.insert(0, Column(rows, name="index"))
+    return Table(columns, copy=False)
+
+
+def source_index(db, epoch=None):
+    """
+    The SourceIndex of a database, built on the first call and shared afterwards.
+    There is one index for each epoch, for the MAX_EPOCHS most recently used epochs;
+    the others stop listening to the database and are dropped.
+
+    Parameters
+    ----------
+    db: astrodbkit2.astrodb.Database
+    epoch: float, optional
+        Epoch of the positions, see SourceIndex
+
+    Returns
+    -------
+    index: SourceIndex
+    """
+    indexes = _indexes.setdefault(db, OrderedDict())
+    if epoch in indexes:
+        indexes.move_to_end(epoch)
+        return indexes[epoch]
+    indexes[epoch] = SourceIndex(db, epoch=epoch)
+    while len(indexes) > MAX_EPOCHS:
+        _, index = indexes.popitem(last=False)
+        index.stop()
+    return indexes[epoch]
+
+
+def cone_search(db, ra, dec, radius, index=None, epoch=None):
+    """
+    Sources within a radius of a position, nearest first.
+
+    Parameters
+    ----------
+    db: astrodbkit2.astrodb.Database
+        Database object created by astrodbkit2
+    ra, dec: float
+        Position in degrees
+    radius: astropy.units.Quantity or float
+        Search radius, in degrees if a number
+    index: SourceIndex, optional
+        Default: the shared index of the database, see source_index
+    epoch: float, optional
+        Epoch of the position(s), to search the Sources moved to that epoch
+        by their proper motions. Not used if an index is given.
+
+    Returns
+    -------
+    results: astropy.table.Table
+        Columns source, ra, dec and separation (arcsec)
+
+    Examples
+    ----------
+    > cone_search(db, 10.0667, 18.3528, 10 * u.arcsec)
+    """
+    if index is None:
+        index = source_index(db, epoch)
+    indices, separations = index.query_many([ra], [dec], radius)[0]
+    return _results_table(index, indices, separations)
+
+
+def cone_search_many(db, ra, dec, radius, index=None, epoch=None):
+    """
+    Sources within a radius of each of many positions, in one pass over the index.
+
+    Parameters
+    ----------
+    db: astrodbkit2.astrodb.Database
+        Database object created by astrodbkit2
+    ra, dec: array-like
+        Positions in degrees
+    radius: astropy.units.Quantity or float or array-like
+        Search radius, in degrees if a number. One value or one per position.
+    index: SourceIndex, optional
+        Default: the shared index of the database, see source_index
+    epoch: float, optional
+        Epoch of the position(s), to search the Sources moved to that epoch
+        by their proper motions. Not used if an index is given.
+
+    Returns
+    -------
+    results: astropy.table.Table
+        One row per match, with the columns index (row number of the position),
+        source, ra, dec and separation (arcsec). Sorted by index, then separation.
+    """
+    if index is None:
+        index = source_index(db, epoch)
+    matches = index.query_many(ra, dec, radius)
+
+    rows = np.concatenate(
+        [np.full(len(indices), i, dtype=int) for i, (indices, _) in enumerate(matches)]
+        + [np.array([], dtype=int)]
+    )
+    indices = np.concatenate([m[0] for m in matches] + [np.array([], dtype=int)])
+    separations = np.concatenate([m[1] for m in matches] + [np.array([])])
+    return _results_table(index, indices, separations, rows=rows)
@@ -1,5 +1,6 @@
 import logging
 import requests
+from contextlib import nullcontext
 import numpy.ma as ma
 import pandas as pd  # used for to_datetime conversion
 import dateutil  # used to convert obs date to datetime object
@@ -16,10 +17,11 @@ from specutils import Spectrum1D
 from astrodbkit2.astrodb import Database
 from astrodb_scripts import (
     AstroDBError,
-    find_source_in_db,
     check_internet_connection,
     find_publication,
 )
+from simple.utils.resolver import find_source
+from simple.utils.spectrum_cache import cached_spectrum_path
 
 __all__ = [
     "ingest_spectrum",
@@ -48,6 +50,7 @@ def ingest_spectrum(
     other_references: Optional[str] = None,
     local_spectrum: Optional[str] = None,
     raise_error: bool = True,
+    resolver=None,
 ):
     """
     Parameters
@@ -72,6 +75,8 @@ def ingest_spectrum(
         Instrument-Mode pair needs to be in Instruments table.
     obs_date: str
         Observation date of spectrum.
+    resolver: SourceResolver, optional
+        Resolver used to match the source name, instead of find_source_in_db
 
     Returns
     -------
@@ -205,7 +210,7 @@ def ingest_spectrum(
                 return flags
 
     # Get source name as it appears in the database
-    db_name = find_source_in_db(db, source)
+    db_name = find_source(db, source, resolver=resolver)
 
     if len(db_name) != 1:
         msg = f"No unique source match for {source} in the database"
@@ -431,15 +436,32 @@ def ingest_spectrum_from_fits(db, source, spectrum_fits_file):
     )
 
 
-def spectrum_plottable(spectrum_path, raise_error=True, show_plot=False):
+def spectrum_plottable(
+    spectrum_path, raise_error=True, show_plot=False, cache=None, formats=None
+):
     """
     Check if spectrum is plottable
+
+    By default the file is read directly with Spectrum1D.read.
+    cache: SpectrumCache, optional
+        Read URLs through this spectrum cache (see simple.utils.spectrum_cache),
+        so each file is downloaded once. The file is read inside cache.pinned(),
+        so downloads in other threads do not remove it meanwhile.
+    formats: SpectrumFormats, optional
+        Read the file with its learned format (see simple.utils.spectrum_formats)
     """
     # load the spectrum and make sure it's a Spectrum1D object
 
     try:
         # spectrum: Spectrum1D = load_spectrum(spectrum_path) #astrodbkit2 method
-        spectrum = Spectrum1D.read(spectrum_path)
+        with nullcontext() if cache is None else cache.pinned():
+            path = spectrum_path
+            if cache is not None:
+                path = cached_spectrum_path(spectrum_path, cache=cache)
+            if formats is None:
+                spectrum = Spectrum1D.read(path)
+            else:
+                spectrum = formats.read(path, spectrum_path)
     except Exception as e:
         msg = (
             str(e) + f"\nSkipping {spectrum_path}: \n"
@@ -10,8 +10,37 @@ import astropy.units as u
 logger = logging.getLogger("SIMPLE")
 
 
-def convert_to_fits(spectrum_info_all, spectrum_table, header):
-    # TODO: add docstring with expected keywords
+# Columns of the spectrum tables written by convert_to_fits, with their units
+SPECTRUM_COLUMNS = {
+    "wavelength": u.um,
+    "flux": u.Jy,
+    "flux_uncertainty": u.Jy,
+}
+
+
+def convert_to_fits(spectrum_info_all, spectrum_table, header, memmap=False):
+    """
+    Write a spectrum to a FITS file readable with Spectrum1D.read(format="tabular-fits")
+
+    Parameters
+    ----------
+    spectrum_info_all: dict
+        fits_data_dir: directory of the output file
+    spectrum_table: dict or astropy.table.Table
+        wavelength (microns), flux and flux_uncertainty (Jy) columns
+    header: astropy.io.fits.Header
+        Primary header, see compile_header. OBJECT and DATE-OBS name the file.
+    memmap: bool
+        Write uncompressed, unscaled 64-bit float columns, without masks, and
+        a copy of each column as an image extension named after it (eg FLUX),
+        that load_spectrum_arrays reads as contiguous arrays of a memory map
+        without copying. The file is about twice as large.
+
+    Examples
+    ----------
+    > header = compile_header(wavelength, **spectrum_info)
+    > convert_to_fits(spectrum_info_all, spectrum_table, header, memmap=True)
+    """
     # TODO: add error handling for expected keywords
 
     object_name = header["OBJECT"]
@@ -24,22 +53,44 @@ def convert_to_fits(spectrum_info_all, spectrum_table, header):
 
     # header = compile_header(wavelength, **spectrum_info_all)
 
-    spectrum_data_out = Table(
-        {
-            "wavelength": wavelength * u.um,
-            "flux": flux * u.Jy,
-            "flux_uncertainty": flux_unc * u.Jy,
+    column_hdus = []
+    if memmap:
+        # Fixed-width big-endian doubles, as stored in FITS, so the columns
+        # are used in place: no scaling, null values or byte swapping on read
+        arrays = {
+            name: np.ascontiguousarray(np.ma.filled(values, np.nan), dtype=">f8")
+            for name, values in zip(SPECTRUM_COLUMNS, (wavelength, flux, flux_unc))
         }
-    )
+        columns = [
+            fits.Column(
+                name=name, format="D", unit=unit.to_string("fits"), array=arrays[name]
+            )
+            for name, unit in SPECTRUM_COLUMNS.items()
+        ]
+        hdu1 = fits.BinTableHDU.from_columns(columns)
+        # The rows of a table interleave the columns: images store each one contiguously
+        for name, unit in SPECTRUM_COLUMNS.items():
+            column_hdu = fits.ImageHDU(data=arrays[name], name=name.upper())
+            column_hdu.header["BUNIT"] = unit.to_string("fits")
+            column_hdus.append(column_hdu)
+    else:
+        spectrum_data_out = Table(
+            {
+                "wavelength": wavelength * u.um,
+                "flux": flux * u.Jy,
+                "flux_uncertainty": flux_unc * u.Jy,
+            }
+        )
+        hdu1 = fits.BinTableHDU(data=spectrum_data_out)
 
     # Make the HDUs
-    hdu1 = fits.BinTableHDU(data=spectrum_data_out)
     hdu1.header["EXTNAME"] = "SPECTRUM"
     hdu1.header.set("OBJECT", object_name, "Object Name")
     hdu0 = fits.PrimaryHDU(header=header)
 
     # Write the MEF with the header and the data
-    spectrum_mef = fits.HDUList([hdu0, hdu1])  # hdu0 is header and hdu1 is data
+    # hdu0 is header and hdu1 is data, followed by the column images of memmap=True
+    spectrum_mef = fits.HDUList([hdu0, hdu1, *column_hdus])
 
     fits_filename = (
         spectrum_info_all["fits_data_dir"]
@@ -58,6 +109,63 @@ def convert_to_fits(spectrum_info_all, spectrum_table, header):
     return
 
 
+def load_spectrum_arrays(filename, columns=None, extension="SPECTRUM"):
+    """
+    Columns of a spectrum FITS table as numpy views of a memory map, without copies.
+
+    Only the pages of the file that are used are read, so batch jobs that need
+    a slice or a statistic of many spectra avoid reading whole files and building
+    Spectrum1D objects. The views are read-only and keep the file mapped until
+    they are deleted. Files written by convert_to_fits with memmap=True have an
+    image extension per column, read as contiguous arrays. Other files give strided
+    views of the table rows; columns that are scaled or have null values are copied
+    by astropy.
+
+    Parameters
+    ----------
+    filename: str
+        FITS file of the spectrum
+    columns: list[str], optional
+        Default: the wavelength, flux and flux_uncertainty columns in the file
+    extension: str or int
+        Table extension. Default: SPECTRUM, as written by convert_to_fits
+
+    Returns
+    -------
+    arrays: dict
+        {column: numpy.ndarray}, in the byte order of the file
+    units: dict
+        {column: astropy.units.Unit or None}
+
+    Examples
+    ----------
+    > arrays, units = load_spectrum_arrays("2MASS J0523-1403_2008-12-01.fits")
+    > np.nanmedian(arrays["flux"][1000:2000]) * units["flux"]
+    """
+    with fits.open(filename, memmap=True, lazy_load_hdus=True) as hdus:
+        # Contiguous copies of the columns, see convert_to_fits. The table data
+        # is only loaded for the columns without one.
+        images = {hdu.name: hdu for hdu in hdus if isinstance(hdu, fits.ImageHDU)}
+        if columns is None:
+            columns = [name for name in SPECTRUM_COLUMNS if name.upper() in images]
+            if not columns:
+                names = hdus[extension].data.names
+                columns = [name for name in SPECTRUM_COLUMNS if name in names]
+        arrays = {}
+        units = {}
+        for name in columns:
+            if name.upper() in images:
+                arrays[name] = images[name.upper()].data
+                unit = images[name.upper()].header.get("BUNIT")
+            else:
+                data = hdus[extension].data
+                arrays[name] = data.field(name)
+                unit = data.columns[name].unit
+            arrays[name].flags.writeable = False
+            units[name] = u.Unit(unit, parse_strict="warn") if unit else None
+    return arrays, units
+
+
 def compile_header(wavelength_data, **spectra_data_info):
     """Creates a header from a dictionary of values."""
 
@@ -0,0 +1,296 @@
+import os
+import time
+import logging
+import warnings
+from datetime import datetime, timezone
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+import numpy as np
+import astropy.units as u
+from astropy.table import Table
+from astrodb_scripts import AstroDBError
+from simple.utils.spectrum_cache import cached_spectrum_path, spectrum_cache
+from simple.utils.spectrum_formats import READERS, _read, spectrum_formats
+
+__all__ = [
+    "check_spectrum",
+    "scan_spectra",
+]
+
+logger = logging.getLogger("SIMPLE")
+
+REPORT_COLUMNS = [
+    "spectrum",
+    "source",
+    "local_spectrum",
+    "sha256",
+    "status",
+    "reader",
+    "microns",
+    "nan_fraction",
+    "n_points",
+    "elapsed",
+    "error",
+    "checked",
+]
+MAX_ERROR_LENGTH = 500
+
+
+def _error_message(errors):
+    message = "; ".join(errors).replace("\n", " ")
+    return message[:MAX_ERROR_LENGTH]
+
+
+def check_spectrum(path, readers=READERS):
+    """
+    Read a spectrum file with the first reader that works and check its contents.
+
+    Parameters
+    ----------
+    path: str
+        Local file of the spectrum
+    readers: tuple[str]
+        Spectrum1D formats to try, in order, see simple.utils.spectrum_formats
+
+    Returns
+    -------
+    result: dict
+        status: "ok", "unreadable", "no microns" (the spectral axis cannot be
+        converted to microns) or "all nan",
+        reader: format that read the file, empty if none did,
+        microns: whether the spectral axis converts to microns,
+        nan_fraction: fraction of points with a nan wavelength or flux,
+        n_points: number of points,
+        elapsed: time spent reading and checking, in seconds,
+        error: errors of the readers that failed
+    """
+    start = time.perf_counter()
+    result = {
+        "status": "unreadable",
+        "reader": "",
+        "microns": False,
+        "nan_fraction": np.nan,
+        "n_points": 0,
+        "error": "",
+    }
+    errors = []
+    spectrum = None
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        for reader in readers:
+            try:
+                spectrum = _read(path, reader)
+                result["reader"] = reader
+                break
+            except Exception as e:
+                errors.append(f"{reader}: {e}")
+
+        if spectrum is not None:
+            flux = np.asarray(spectrum.flux.value, dtype=float).ravel()
+            wave = np.asarray(spectrum.spectral_axis.value, dtype=float).ravel()
+            try:
+                spectrum.spectral_axis.to(u.micron)
+                result["microns"] = True
+            except (u.UnitConversionError, AttributeError, ValueError) as e:
+                errors.append(f"microns: {e}")
+            result["n_points"] = len(flux)
+            if len(flux):
+                bad = np.isnan(flux)
+                if len(wave) == len(flux):
+                    bad |= np.isnan(wave)
+                result["nan_fraction"] = float(bad.mean())
+
+    if spectrum is None:
+        result["status"] = "unreadable"
+    elif not result["microns"]:
+        result["status"] = "no microns"
+    elif not result["nan_fraction"] < 1:
+        result["status"] = "all nan"
+    else:
+        result["status"] = "ok"
+        errors = []
+    result["error"] = _error_message(errors)
+    result["elapsed"] = time.perf_counter() - start
+    return result
+
+
+def _load_report(report):
+    if not os.path.exists(report):
+        return {}
+    previous = Table.read(report, format="ascii.ecsv")
+    rows = {}
+    for row in previous:
+        values = {name: row[name] for name in REPORT_COLUMNS if name in previous.colnames}
+        for name in ("local_spectrum", "sha256", "error", "reader"):
+            values[name] = "" if np.ma.is_masked(values.get(name)) else str(values.get(name, ""))
+        rows[str(row["spectrum"])] = values
+    return rows
+
+
+def _save_report(rows, report):
+    table = Table(rows=[[row[name] for name in REPORT_COLUMNS] for row in rows], names=REPORT_COLUMNS)
+    table["elapsed"].unit = u.s
+    table.write(report, format="ascii.ecsv", overwrite=True)
+    return table
+
+
+def scan_spectra(
+    db, workers=1, report=None, cache=None, rescan=False, formats=None, revalidate=False
+):
+    """
+    Check that every file of the Spectra table can be read, in parallel.
+
+    Files are downloaded to the spectrum cache by a pool of threads and read
+    by a pool of worker processes, with the readers of check_spectrum.
+    The results are kept in a report file: later scans only check the spectra
+    that are new, that were not ok, whose local_spectrum changed, or whose
+    cached file has a different content (SHA-256 hash) than when it was checked.
+    Cached files are not removed from the cache while the scan reads them.
+    Each file is read with its learned format first, and the formats that
+    worked are learned, see simple.utils.spectrum_formats.SpectrumFormats.
+
+    Parameters
+    ----------
+    db: astrodbkit2.astrodb.Database
+        Database object created by astrodbkit2
+    workers: int
+        Number of worker processes and download threads.
+        With 1, spectra are checked one by one in this process.
+    report: str, optional
+        ECSV file of the report. Default: scan_report.ecsv in the cache directory
+    cache: SpectrumCache, optional
+        Default: the shared cache, see simple.utils.spectrum_cache.spectrum_cache
+    rescan: bool
+        Check all the spectra again
+    formats: SpectrumFormats, optional
+        Default: the shared formats, see simple.utils.spectrum_formats.spectrum_formats
+    revalidate: bool
+        Ask the server whether the file of each spectrum changed (with its ETag),
+        and check again the spectra whose file changed
+
+    Returns
+    -------
+    report: astropy.table.Table
+        One row per Spectra.spectrum value with the columns spectrum, source,
+        local_spectrum, sha256 (hash of the cached file, empty for local files), the results of check_spectrum (status is "download failed"
+        if the file could not be downloaded) and checked (UTC time of the check)
+
+    Examples
+    ----------
+    > report = scan_spectra(db, workers=8)
+    > report[report["status"] != "ok"]
+    """
+    if cache is None:
+        cache = spectrum_cache()
+    if report is None:
+        report = os.path.join(cache.directory, "scan_report.ecsv")
+    if formats is None:
+        formats = spectrum_formats()
+
+    spectra = {}
+    for spectrum, source, local_spectrum in db.query(
+        db.Spectra.c.spectrum, db.Spectra.c.source, db.Spectra.c.local_spectrum
+    ).all():
+        spectra.setdefault(spectrum, (source, local_spectrum or ""))
+
+    previous = _load_report(report)
+
+    def file_hash(spectrum):
+        """Hash of the cached file of a spectrum, empty if it is read from local_spectrum"""
+        local_spectrum = spectra[spectrum][1]
+        if local_spectrum and os.path.exists(os.path.expandvars(local_spectrum)):
+            return ""
+        return cache.file_hash(spectrum) or ""
+
+    def changed(spectrum):
+        if rescan or spectrum not in previous:
+            return True
+        checked = previous[spectrum]
+        sha256 = file_hash(spectrum)
+        return (
+            checked["status"] != "ok"
+            or checked["local_spectrum"] != spectra[spectrum][1]
+            or (sha256 != "" and sha256 != checked["sha256"])
+        )
+
+    # Revalidated files are only known to have changed once downloaded
+    to_download = [spectrum for spectrum in spectra if revalidate or changed(spectrum)]
+    logger.info(
+        f"Checking up to {len(to_download)} of {len(spectra)} spectra with {workers} workers"
+    )
+
+    results = {}
+    paths = {}
+
+    def record(spectrum, result):
+        if result["reader"]:
+            formats.learn(paths[spectrum], result["reader"], spectrum)
+        source, local_spectrum = spectra[spectrum]
+        results[spectrum] = {
+            "spectrum": spectrum,
+            "source": source,
+            "local_spectrum": local_spectrum,
+            "sha256": file_hash(spectrum) if spectrum in paths else "",
+            **result,
+            "checked": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        }
+
+    def download_failed(error):
+        return {
+            "status": "download failed",
+            "reader": "",
+            "microns": False,
+            "nan_fraction": np.nan,
+            "n_points": 0,
+            "elapsed": 0.0,
+            "error": _error_message([str(error)]),
+        }
+
+    def download(spectrum):
+        paths[spectrum] = cached_spectrum_path(
+            spectrum, spectra[spectrum][1], cache=cache, revalidate=revalidate
+        )
+        return paths[spectrum]
+
+    # The downloaded files stay in the cache until they are all checked
+    with cache.pinned():
+        if workers == 1:
+            for spectrum in to_download:
+                try:
+                    path = download(spectrum)
+                except AstroDBError as e:
+                    record(spectrum, download_failed(e))
+                    continue
+                if changed(spectrum):
+                    record(spectrum, check_spectrum(path, formats.readers_of(path, spectrum)))
+        else:
+            with ThreadPoolExecutor(workers) as downloads, ProcessPoolExecutor(workers) as pool:
+                downloading = {
+                    downloads.submit(download, spectrum): spectrum for spectrum in to_download
+                }
+                checking = {}
+                # Files are read as soon as they are downloaded
+                for future in as_completed(downloading):
+                    spectrum = downloading[future]
+                    try:
+                        path = future.result()
+                    except AstroDBError as e:
+                        record(spectrum, download_failed(e))
+                        continue
+                    if changed(spectrum):
+                        readers = formats.readers_of(path, spectrum)
+                        checking[pool.submit(check_spectrum, path, readers)] = spectrum
+                for future in as_completed(checking):
+                    record(checking[future], future.result())
+
+    rows = []
+    for spectrum in spectra:
+        if spectrum in results:
+            rows.append(results[spectrum])
+        else:
+            rows.append(previous[spectrum])
+    table = _save_report(rows, report)
+    formats.save()
+
+    statuses = {status: int((table["status"] == status).sum()) for status in sorted(set(table["status"]))}
+    logger.info(f"Spectra scan: {statuses}, report saved to {report}")
+    return table
@@ -1,22 +1,31 @@
 import numpy as np
 import re
 import logging
-from sqlalchemy import and_
+from collections import defaultdict
+from functools import lru_cache
+from sqlalchemy import and_, bindparam
 import sqlalchemy.exc
-from astrodb_scripts import (
-    AstroDBError,
-    find_source_in_db,
-)
+from astropy.table import Table
+from astrodb_scripts import AstroDBError
+from simple.utils.resolver import SourceResolver, find_source
+from simple.utils.tables import table_values
 
 
 __all__ = [
     "ingest_spectral_types",
+    "ingest_spectral_types_table",
     "convert_spt_string_to_code",
     "convert_spt_code_to_string_to_code",
+    "convert_spt_strings_to_codes",
+    "convert_spt_codes_to_strings",
 ]
 
 logger = logging.getLogger("SIMPLE")
 
+_SPT_CLASS_CODES = {"M": 60, "L": 70, "T": 80, "Y": 90}
+# The first spectral class letter, then the first number after it
+_SPT_PATTERN = re.compile(r"([MLTY])(?:.*?(\d*\.?\d+))?", re.DOTALL)
+
 
 def ingest_spectral_types(
     db,
@@ -26,6 +35,7 @@ def ingest_spectral_types(
     regimes,
     spectral_type_error=None,
     comments=None,
+    resolver=None,
 ):
     """
     Script to ingest spectral types
@@ -45,6 +55,8 @@ def ingest_spectral_types(
         Comments
     references: str or list[strings]
         Reference of the Spectral Type
+    resolver: SourceResolver, optional
+        Resolver used to match the source names, instead of find_source_in_db
     Returns
     -------
 
@@ -84,7 +96,7 @@ def ingest_spectral_types(
     logger.info(f"Trying to add {n_sources} spectral types")
 
     for i, source in enumerate(sources):
-        db_name = find_source_in_db(db, source)
+        db_name = find_source(db, source, resolver=resolver)
         # Spectral Type data is in the database
 
         if len(db_name) != 1:
@@ -231,59 +243,346 @@ def ingest_spectral_types(
     logger.info(msg)
 
 
-def convert_spt_string_to_code(spectral_types):
+def ingest_spectral_types_table(
+    db,
+    table,
+    *,
+    regime: str = None,
+    reference: str = None,
+    raise_error: bool = True,
+    resolver=None,
+):
     """
-    normal tests: M0, M5.5, L0, L3.5, T0, T3, T4.5, Y0, Y5, Y9.
-    weird TESTS: sdM4, ≥Y4, T5pec, L2:, L0blue, Lpec, >L9, >M10, >L, T, Y
-    digits are needed in current implementation.
-    :param spectral_types:
-    :return:
+    Add many spectral types in one transaction.
+    Names are matched with a SourceResolver, all spectral types are converted to codes
+    up front, and the existing spectral types of all the sources are fetched in one query.
+    Duplicates and adopted flags are decided in memory, with the same rules as
+    ingest_spectral_types, except that a skipped duplicate never changes adopted flags.
+
+    Parameters
+    ----------
+    db: astrodbkit2.astrodb.Database
+        Database object created by astrodbkit2
+    table: astropy.table.Table or dict
+        Columns source, spectral_type and optionally spectral_type_error,
+        regime, comments and reference
+    regime: str, optional
+        Regime for rows without one (or if there is no regime column)
+    reference: str, optional
+        Reference for rows without one (or if there is no reference column)
+    raise_error: bool, optional
+        True (default): Raise an error, without adding anything, if any row fails
+        False: Log a warning, skip the rows which fail and add the rest
+    resolver: SourceResolver, optional
+        Resolver used to match the source names. Default: build one from the database
+
+    Returns
+    -------
+    results: astropy.table.Table
+        Copy of the input table with spectral_type_code and status columns.
+        The status is "added", "skipped" (already in the database) or the reason
+        the row failed. results.meta["counts"] has the number of added, skipped
+        and failed rows for each reference.
+
+    Examples
+    ----------
+    > results = ingest_spectral_types_table(db, t, regime="nir", reference="Burg06")
+    > results.meta["counts"]
+    {'Burg06': {'added': 52, 'skipped': 3, 'failed': 0}}
     """
-    if isinstance(spectral_types, str):
-        spectral_types = [spectral_types]
-
-    spectral_type_codes = []
-    for spt in spectral_types:
-        logger.debug(f"Trying to convert: `{spt}`")
-        spt_code = np.nan
-        if spt == "":
-            spectral_type_codes.append(spt_code)
-            logger.debug("Appended NAN")
+    table = Table(table, masked=True, copy=True)
+    for column in ["source", "spectral_type"]:
+        if column not in table.colnames:
+            msg = f"Spectral types table has no {column} column"
+            raise AstroDBError(msg)
+
+    n_rows = len(table)
+    sources = table_values(table, "source")
+    spectral_types = table_values(table, "spectral_type")
+    spectral_type_errors = table_values(table, "spectral_type_error")
+    regimes = [r or regime for r in table_values(table, "regime")]
+    comments = table_values(table, "comments")
+    references = [r or reference for r in table_values(table, "reference")]
+    codes = [
+        np.nan if spt is None else code
+        for spt, code in zip(
+            spectral_types,
+            convert_spt_string_to_code(["" if spt is None else spt for spt in spectral_types]),
+        )
+    ]
+
+    if resolver is None:
+        resolver = SourceResolver(db)
+        resolver.stop()
+    db_names = [resolver.resolve(source) if source is not None else [] for source in sources]
+    known_references = {row[0] for row in db.query(db.Publications.c.reference).all()}
+    known_regimes = {row[0] for row in db.query(db.Regimes.c.regime).all()}
+
+    status = []
+    for i in range(n_rows):
+        if len(db_names[i]) == 0:
+            status.append("source not found")
+        elif len(db_names[i]) > 1:
+            status.append("multiple sources")
+        elif not np.isfinite(codes[i]):
+            status.append("invalid spectral type")
+        elif references[i] not in known_references:
+            status.append("unknown reference")
+        elif regimes[i] is None:
+            status.append("no regime")
+        elif regimes[i] not in known_regimes:
+            status.append("unknown regime")
+        else:
+            status.append("ok")
+        db_names[i] = db_names[i][0] if len(db_names[i]) == 1 else None
+
+    # Existing spectral types of all the sources, fetched once in chunks
+    spt = db.SpectralTypes
+    to_check = sorted({db_names[i] for i in range(n_rows) if status[i] == "ok"})
+    existing = []
+    for start in range(0, len(to_check), 500):
+        existing += (
+            db.query(
+                spt.c.source,
+                spt.c.regime,
+                spt.c.reference,
+                spt.c.spectral_type_error,
+                spt.c.adopted,
+            )
+            .filter(spt.c.source.in_(to_check[start : start + 500]))
+            .all()
+        )
+
+    # Per-source state: measurement errors and the references of the adopted rows
+    errors = defaultdict(list)
+    adopted_references = defaultdict(list)
+    duplicate_keys = set()
+    for row in existing:
+        errors[row.source].append(row.spectral_type_error)
+        if row.adopted:
+            adopted_references[row.source].append(row.reference)
+        duplicate_keys.add((row.source, row.regime, row.reference))
+
+    new_rows = []
+    new_by_source = defaultdict(list)
+    unset = set()
+    for i in range(n_rows):
+        if status[i] != "ok":
             continue
-        if spt == "null":
-            spt_code = 0
-            spectral_type_codes.append(spt_code)
-            logger.debug("Appended Null")
+        db_name = db_names[i]
+        if (db_name, regimes[i], references[i]) in duplicate_keys:
+            status[i] = "skipped"
             continue
-        # identify main spectral class, loop over any prefix text to identify MLTY
-        for i, item in enumerate(spt):
-            if item == "M":
-                spt_code = 60
-                break
-            elif item == "L":
-                spt_code = 70
-                break
-            elif item == "T":
-                spt_code = 80
-                break
-            elif item == "Y":
-                spt_code = 90
-                break
-            else:  # only trigger if not MLTY
-                i = 0
-        # find integer or decimal subclass and add to spt_code
-        if re.search("\d*\.?\d+", spt[i + 1 :]) is None:
-            spt_code = spt_code
+
+        adopted = None
+        if adopted_references[db_name]:
+            known_errors = [e for e in errors[db_name] if e is not None]
+            if (
+                spectral_type_errors[i] is not None
+                and len(known_errors) == len(errors[db_name])
+                and spectral_type_errors[i] < min(known_errors)
+            ):
+                adopted = True
+                # As in ingest_spectral_types, the rows of the source from the
+                # reference of the first adopted row are unset
+                old_reference = adopted_references[db_name][0]
+                adopted_references[db_name] = [
+                    ref for ref in adopted_references[db_name] if ref != old_reference
+                ]
+                unset.add((db_name, old_reference))
+                for row in new_by_source[db_name]:
+                    if row["reference"] == old_reference:
+                        row["adopted"] = False
+
+        new_row = {
+            "source": db_name,
+            "spectral_type_string": spectral_types[i],
+            "spectral_type_code": codes[i],
+            "spectral_type_error": spectral_type_errors[i],
+            "regime": regimes[i],
+            "adopted": adopted,
+            "comments": comments[i],
+            "reference": references[i],
+        }
+        new_rows.append(new_row)
+        new_by_source[db_name].append(new_row)
+        if adopted:
+            adopted_references[db_name].append(references[i])
+        errors[db_name].append(spectral_type_errors[i])
+        duplicate_keys.add((db_name, regimes[i], references[i]))
+        status[i] = "added"
+
+    updates = [
+        {"b_source": db_name, "b_reference": old_reference}
+        for db_name, old_reference in sorted(unset)
+    ]
+
+    failed = [i for i in range(n_rows) if status[i] not in ("added", "skipped")]
+    for i in failed:
+        logger.warning(
+            f"Spectral type {spectral_types[i]} for {sources[i]} from {references[i]} "
+            f"not added: {status[i]}"
+        )
+    if failed and raise_error:
+        msg = (
+            f"{len(failed)} of {n_rows} spectral types cannot be ingested. "
+            "Use raise_error=False to add the others."
+        )
+        logger.error(msg)
+        raise AstroDBError(msg)
+
+    try:
+        with db.engine.begin() as conn:
+            if updates:
+                conn.execute(
+                    spt.update()
+                    .where(
+                        and_(
+                            spt.c.source == bindparam("b_source"),
+                            spt.c.reference == bindparam("b_reference"),
+                        )
+                    )
+                    .values(adopted=False),
+                    updates,
+                )
+            if new_rows:
+                conn.execute(spt.insert(), new_rows)
+    except sqlalchemy.exc.IntegrityError as e:
+        msg = f"Spectral types could not be added, no rows were ingested: {e}"
+        logger.error(msg)
+        raise AstroDBError(msg)
+
+    counts = {}
+    for ref, row_status in zip(references, status):
+        ref_counts = counts.setdefault(ref, {"added": 0, "skipped": 0, "failed": 0})
+        if row_status in ("added", "skipped"):
+            ref_counts[row_status] += 1
         else:
-            spt_code += float(re.findall("\d*\.?\d+", spt[i + 1 :])[0])
+            ref_counts["failed"] += 1
+    for ref, ref_counts in counts.items():
+        logger.info(
+            f"{ref}: {ref_counts['added']} spectral types added, "
+            f"{ref_counts['skipped']} skipped, {ref_counts['failed']} failed"
+        )
+
+    table["spectral_type_code"] = codes
+    table["status"] = status
+    table.meta["counts"] = counts
+    return table
+
+
+# Conversions are cached between calls:
+# the database has a few hundred distinct spectral type strings and codes
+@lru_cache(maxsize=4096)
+def _spt_string_to_code(spectral_type):
+    """Spectral type code of one string"""
+    if spectral_type == "":
+        return np.nan
+    if spectral_type == "null":
+        return 0.0
+    match = _SPT_PATTERN.search(spectral_type)
+    if match is None:
+        return np.nan
+    spt_code = _SPT_CLASS_CODES[match.group(1)]
+    if match.group(2):
+        spt_code += float(match.group(2))
+    return spt_code
+
+
+@lru_cache(maxsize=4096)
+def _spt_code_to_string(spectral_code, decimals):
+    """Spectral type string of one code"""
+    spt_type = ""
+    for spt_class, class_code in _SPT_CLASS_CODES.items():
+        if class_code <= spectral_code < class_code + 10:
+            spt_type = spt_class
+    return f"{spt_type}{spectral_code % 10:.{decimals}f}"
+
+
+def convert_spt_strings_to_codes(spectral_types):
+    """
+    Convert spectral type strings to numeric codes: M0 = 60, L0 = 70, T0 = 80, Y0 = 90.
+    Each distinct string is converted once and the conversions are cached between calls.
+
+    The class is the first M, L, T or Y in the string and the subclass is the first number
+    after it, so prefixes and suffixes do not change the code:
+    sdM4 and M4pec are 64, L2: is 72, >L9 and ≥L9 are 79, and L0blue is 70.
+    Without a subclass the code is the start of the class (Lpec and >L are 70).
+    An empty, masked or None value is nan, "null" is 0,
+    and a string without a spectral class is nan.
+
+    Parameters
+    ----------
+    spectral_types: str or array-like of str
+        Spectral type strings, eg a list, numpy array or astropy Column
+
+    Returns
+    -------
+    spectral_type_codes: numpy.ndarray
+        Codes as floats, with the shape of the input
+
+    Examples
+    ----------
+    > convert_spt_strings_to_codes(["M5.5", "sdL1", "T4.5pec"])
+    array([65.5, 71. , 84.5])
+    """
+    values = np.array(spectral_types, dtype=object, ndmin=1)
+    if np.ma.is_masked(spectral_types):
+        values[np.ma.getmaskarray(spectral_types).reshape(values.shape)] = ""
+    # Hashing the strings is faster than sorting them with np.unique
+    codes = {
+        spt: _spt_string_to_code("" if spt is None else str(spt))
+        for spt in set(values.flat)
+    }
+    return np.fromiter((codes[spt] for spt in values.flat), float, values.size).reshape(
+        values.shape
+    )
+
+
+def convert_spt_codes_to_strings(spectral_codes, decimals=1):
+    """
+    Convert numeric spectral type codes to strings, eg 65.5 to M5.5 and 70 to L0.0.
+    Each distinct code is converted once and the conversions are cached between calls.
+
+    Parameters
+    ----------
+    spectral_codes: float or array-like of float
+        Spectral type codes, eg a list, numpy array or astropy Column
+    decimals: int
+        Number of decimals of the subclass
+
+    Returns
+    -------
+    spectral_types: numpy.ndarray
+        Strings, with the shape of the input
+
+    Examples
+    ----------
+    > convert_spt_codes_to_strings([65.5, 70, 84.5], decimals=1)
+    array(['M5.5', 'L0.0', 'T4.5'], dtype='<U4')
+    """
+    codes = np.array(np.ma.getdata(spectral_codes), dtype=float, ndmin=1)
+    unique, inverse = np.unique(codes, return_inverse=True)
+    strings = np.array(
+        [_spt_code_to_string(code, decimals) for code in unique.tolist()], dtype=str
+    )
+    return strings[inverse].reshape(codes.shape)
 
-        spectral_type_codes.append(spt_code)
-    return spectral_type_codes
+
+def convert_spt_string_to_code(spectral_types):
+    """
+    Convert spectral type strings to codes. See convert_spt_strings_to_codes.
+    normal tests: M0, M5.5, L0, L3.5, T0, T3, T4.5, Y0, Y5, Y9.
+    weird TESTS: sdM4, ≥Y4, T5pec, L2:, L0blue, Lpec, >L9, >M10, >L, T, Y
+    :param spectral_types: str or list[str]
+    :return: list[float]
+    """
+    return convert_spt_strings_to_codes(spectral_types).ravel().tolist()
 
 
 def convert_spt_code_to_string_to_code(spectral_codes, decimals=1):
     """
-    Convert spectral type codes to string values
+    Convert spectral type codes to string values. See convert_spt_codes_to_strings.
 
     Parameters
     ----------
@@ -295,28 +594,4 @@ def convert_spt_code_to_string_to_code(spectral_codes, decimals=1):
     spectral_types : list[str]
         List of spectral types
     """
-    if isinstance(spectral_codes, float):
-        spectral_codes = [spectral_codes]
-
-    spectral_types = []
-    for spt in spectral_codes:
-        spt_type = ""
-
-        # Identify major type
-        if 60 <= spt < 70:
-            spt_type = "M"
-        elif 70 <= spt < 80:
-            spt_type = "L"
-        elif 80 <= spt < 90:
-            spt_type = "T"
-        elif 90 <= spt < 100:
-            spt_type = "Y"
-
-        # Numeric part of type
-        format = f".{decimals}f"
-        spt_type = f"{spt_type}{spt % 10:{format}}"
-        logger.debug(f"Converting: {spt} -> {spt_type}")
-
-        spectral_types.append(spt_type)
-
-    return spectral_types
+    return convert_spt_codes_to_strings(spectral_codes, decimals).ravel().tolist()
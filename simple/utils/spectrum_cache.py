@@ -0,0 +1,325 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import tempfile
+import threading
+from contextlib import contextmanager
+from urllib.parse import unquote, urlparse
+import requests
+from astrodb_scripts import AstroDBError
+
+__all__ = [
+    "SpectrumCache",
+    "spectrum_cache",
+    "cached_spectrum_path",
+]
+
+logger = logging.getLogger("SIMPLE")
+
+# Environment variables of the default cache
+CACHE_DIRECTORY_VARIABLE = "SIMPLE_SPECTRA_CACHE"
+OFFLINE_VARIABLE = "SIMPLE_SPECTRA_OFFLINE"
+DEFAULT_DIRECTORY = os.path.join("~", ".cache", "simple", "spectra")
+DEFAULT_MAX_SIZE = 2 * 1024**3  # bytes
+
+CHUNK_SIZE = 1024**2  # bytes per read when downloading
+# Cache hits save the last use times in the index at most every SAVE_INTERVAL seconds
+SAVE_INTERVAL = 10
+
+# Shared cache, see spectrum_cache
+_default_cache = None
+
+
+def _is_url(path):
+    return urlparse(str(path)).scheme in ("http", "https")
+
+
+def _extension(url):
+    """Extension of the file name of a URL, kept so readers can identify the format"""
+    name = os.path.basename(unquote(urlparse(url).path))
+    root, extension = os.path.splitext(name)
+    if extension.lower() in (".gz", ".bz2", ".zip"):
+        extension = os.path.splitext(root)[1] + extension
+    return extension
+
+
+class SpectrumCache:
+    """
+    Local cache of downloaded spectrum files, so each URL is downloaded once.
+
+    Files are stored by the SHA-256 hash of their content (a file served from
+    several URLs is stored once), with the extension of the URL so readers can
+    identify the format. An index maps each URL to its file and ETag.
+    When the cache is larger than max_size, the least recently used files are removed.
+
+    Cached files are used without contacting the server, unless revalidate is set,
+    in which case the ETag is sent and the file is only downloaded again if it changed.
+    Offline, only cached files are used.
+
+    The cache can be shared by threads, not by processes writing at the same time.
+    A path returned by path() can be removed by a download in another thread:
+    threads sharing a cache read the files inside pinned(), as do the processes
+    the files are handed to.
+
+    Parameters
+    ----------
+    directory: str, optional
+        Default: $SIMPLE_SPECTRA_CACHE, or ~/.cache/simple/spectra
+    max_size: int
+        Maximum size of the cached files in bytes. Default: 2 GB.
+        The last downloaded file is kept even if it is larger.
+    offline: bool, optional
+        Never download. Default: True if $SIMPLE_SPECTRA_OFFLINE is set to 1
+    timeout: float
+        Timeout of the downloads in seconds
+
+    Examples
+    ----------
+    > cache = SpectrumCache(max_size=500 * 1024**2)
+    > spectrum = Spectrum1D.read(cache.path(url))
+    """
+
+    def __init__(self, directory=None, max_size=DEFAULT_MAX_SIZE, offline=None, timeout=60):
+        if directory is None:
+            directory = os.environ.get(CACHE_DIRECTORY_VARIABLE, DEFAULT_DIRECTORY)
+        if offline is None:
+            offline = os.environ.get(OFFLINE_VARIABLE, "0").lower() in ("1", "true", "yes")
+        self.directory = os.path.expanduser(directory)
+        self.max_size = max_size
+        self.offline = offline
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._pins = 0
+        self._index_file = os.path.join(self.directory, "index.json")
+        os.makedirs(os.path.join(self.directory, "files"), exist_ok=True)
+        self._entries = self._load_index()
+        self._saved = time.time()
+
+    def _load_index(self):
+        try:
+            with open(self._index_file) as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        # Files removed outside of the cache
+        return {
+            url: entry
+            for url, entry in entries.items()
+            if os.path.exists(self._file_path(entry["file"]))
+        }
+
+    def _save_index(self):
+        self._saved = time.time()
+        handle, temporary = tempfile.mkstemp(dir=self.directory, suffix=".json")
+        with os.fdopen(handle, "w") as f:
+            json.dump(self._entries, f, indent=1)
+        os.replace(temporary, self._index_file)
+
+    def _file_path(self, name):
+        return os.path.join(self.directory, "files", name)
+
+    def __contains__(self, url):
+        return url in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def file_hash(self, url):
+        """SHA-256 hash of the content of the cached file of a URL, or None if it is not cached"""
+        entry = self._entries.get(url)
+        if entry is None:
+            return None
+        # Files are named by the hash, then the extension
+        return entry["file"].split(".", 1)[0]
+
+    @contextmanager
+    def pinned(self):
+        """
+        Context in which no file is removed, eg while a pool of processes reads
+        the files. Files downloaded meanwhile can exceed max_size: the least
+        recently used ones are removed when the last pinned context exits.
+
+        Examples
+        ----------
+        > with cache.pinned():
+        >     paths = [cache.path(url) for url in urls]
+        >     list(pool.map(check_spectrum, paths))
+        """
+        with self._lock:
+            self._pins += 1
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self._pins -= 1
+                if not self._pins and self.size > self.max_size:
+                    self._evict()
+                    self._save_index()
+
+    @property
+    def size(self):
+        """Size of the cached files in bytes"""
+        files = {entry["file"]: entry["size"] for entry in self._entries.values()}
+        return sum(files.values())
+
+    def _download(self, url, etag=None):
+        """Download a URL to a temporary file; None if the ETag still matches"""
+        headers = {"If-None-Match": etag} if etag else {}
+        temporary = None
+        try:
+            response = requests.get(url, headers=headers, stream=True, timeout=self.timeout)
+            if response.status_code == 304:
+                return None
+            response.raise_for_status()
+            digest = hashlib.sha256()
+            handle, temporary = tempfile.mkstemp(dir=self.directory, suffix=".part")
+            with os.fdopen(handle, "wb") as f:
+                for chunk in response.iter_content(CHUNK_SIZE):
+                    digest.update(chunk)
+                    f.write(chunk)
+        except requests.RequestException as e:
+            if temporary is not None:
+                os.remove(temporary)
+            msg = f"Unable to download {url}: {e}"
+            logger.error(msg)
+            raise AstroDBError(msg)
+        return temporary, digest.hexdigest(), response.headers.get("ETag")
+
+    def path(self, url, revalidate=False):
+        """
+        Local file of a spectrum, downloaded if it is not cached.
+
+        Parameters
+        ----------
+        url: str
+            URL of the spectrum. Local paths are returned as they are.
+        revalidate: bool
+            Check with the server that the cached file did not change
+
+        Returns
+        -------
+        path: str
+            Path of the cached file. Read it inside pinned() if other threads
+            use the cache, as their downloads can remove it.
+
+        Raises
+        ------
+        AstroDBError
+            If the download fails, or offline if the URL is not cached
+        """
+        if not _is_url(url):
+            return os.path.expandvars(str(url))
+
+        entry = self._entries.get(url)
+        if entry is not None and (self.offline or not revalidate):
+            with self._lock:
+                entry["last_used"] = time.time()
+                if time.time() - self._saved > SAVE_INTERVAL:
+                    self._save_index()
+            return self._file_path(entry["file"])
+        if self.offline:
+            msg = f"{url} is not in the spectrum cache and downloads are off"
+            logger.error(msg)
+            raise AstroDBError(msg)
+
+        downloaded = self._download(url, etag=entry["etag"] if entry else None)
+        with self._lock:
+            if downloaded is None:
+                logger.debug(f"Cached file of {url} is up to date")
+                entry["last_used"] = time.time()
+            else:
+                temporary, digest, etag = downloaded
+                name = digest + _extension(url)
+                os.replace(temporary, self._file_path(name))
+                if entry is not None and entry["file"] != name:
+                    self._remove(url)
+                self._entries[url] = {
+                    "file": name,
+                    "etag": etag,
+                    "size": os.path.getsize(self._file_path(name)),
+                    "last_used": time.time(),
+                }
+                logger.debug(f"Downloaded {url} to the spectrum cache")
+                if not self._pins:
+                    self._evict(keep=url)
+            self._save_index()
+            return self._file_path(self._entries[url]["file"])
+
+    def _evict(self, keep=None):
+        """Remove the least recently used files until the cache fits in max_size"""
+        order = sorted(self._entries, key=lambda url: self._entries[url]["last_used"])
+        for url in order:
+            if self.size <= self.max_size:
+                break
+            if url == keep:
+                continue
+            self._remove(url)
+
+    def _remove(self, url):
+        name = self._entries.pop(url)["file"]
+        if all(entry["file"] != name for entry in self._entries.values()):
+            os.remove(self._file_path(name))
+            logger.debug(f"Removed {url} from the spectrum cache")
+
+    def clear(self):
+        """Remove all the cached files"""
+        with self._lock:
+            for url in list(self._entries):
+                self._remove(url)
+            self._save_index()
+
+
+def spectrum_cache():
+    """
+    The default SpectrumCache, created on the first call and shared afterwards.
+    Its directory and offline mode are set with the $SIMPLE_SPECTRA_CACHE
+    and $SIMPLE_SPECTRA_OFFLINE environment variables.
+
+    Returns
+    -------
+    cache: SpectrumCache
+    """
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = SpectrumCache()
+    return _default_cache
+
+
+def cached_spectrum_path(spectrum, local_spectrum=None, cache=None, revalidate=False):
+    """
+    Local file to read a spectrum of the Spectra table from.
+
+    The local copy in Spectra.local_spectrum is used if it exists, after expanding
+    its environment variable (eg $ASTRODB_SPECTRA). Otherwise the spectrum URL
+    is downloaded to the cache, or taken from it.
+
+    Parameters
+    ----------
+    spectrum: str
+        Spectra.spectrum or Spectra.original_spectrum URL
+    local_spectrum: str, optional
+        Spectra.local_spectrum path
+    cache: SpectrumCache, optional
+        Default: the shared cache, see spectrum_cache
+    revalidate: bool
+        Check with the server that the cached file did not change, see SpectrumCache.path
+
+    Returns
+    -------
+    path: str
+
+    Examples
+    ----------
+    > for row in db.query(db.Spectra).table():
+    >     path = cached_spectrum_path(row["spectrum"], row["local_spectrum"])
+    """
+    if local_spectrum:
+        local_path = os.path.expandvars(str(local_spectrum))
+        if os.path.exists(local_path):
+            return local_path
+        logger.debug(f"Local spectrum {local_spectrum} not found, using {spectrum}")
+    if cache is None:
+        cache = spectrum_cache()
+    return cache.path(spectrum, revalidate=revalidate)
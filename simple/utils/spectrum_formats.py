@@ -0,0 +1,318 @@
+import os
+import json
+import atexit
+import time
+import logging
+import tempfile
+import threading
+import warnings
+from astropy.io import fits
+from specutils import Spectrum1D
+import astrodbkit2.spectra  # noqa: F401, registers the Spex Prism reader
+from astrodb_scripts import AstroDBError
+from simple.utils.spectrum_cache import spectrum_cache
+
+__all__ = [
+    "READERS",
+    "SpectrumFormats",
+    "fingerprint",
+    "read_spectrum",
+    "spectrum_formats",
+]
+
+logger = logging.getLogger("SIMPLE")
+
+# Spectrum1D formats tried in turn when the format of a file is not known.
+# "auto" lets specutils identify the format.
+AUTO = "auto"
+READERS = ("wcs1d-fits", "Spex Prism", "iraf", "tabular-fits", "ASCII", AUTO)
+
+FITS_EXTENSIONS = (".fits", ".fit", ".fts", ".fits.gz", ".fit.gz")
+# Header keywords of the first two HDUs whose values are part of the fingerprint
+FITS_KEYWORDS = ("XTENSION", "NAXIS", "INSTRUME", "EXTNAME", "CTYPE1", "TUNIT1", "TTYPE1")
+ASCII_LINES = 20  # first lines of text files used for the fingerprint
+# Learned formats are saved at most every SAVE_INTERVAL seconds, and by save()
+SAVE_INTERVAL = 10
+
+# Shared formats, see spectrum_formats
+_default_formats = None
+
+
+def _extension(path):
+    name = os.path.basename(str(path)).lower()
+    root, extension = os.path.splitext(name)
+    if extension in (".gz", ".bz2", ".zip"):
+        extension = os.path.splitext(root)[1] + extension
+    return extension
+
+
+def _fits_fingerprint(path):
+    parts = []
+    with fits.open(path, lazy_load_hdus=True) as hdus:
+        for i in (0, 1):
+            try:
+                header = hdus[i].header
+            except IndexError:
+                break
+            for keyword in FITS_KEYWORDS:
+                value = header.get(keyword)
+                if value is not None:
+                    parts.append(f"{i}:{keyword}={str(value).strip().lower()}")
+    return parts
+
+
+def _ascii_fingerprint(path):
+    """Number of header lines and of columns of the first data line"""
+    header_lines = 0
+    columns = 0
+    delimiter = "space"
+    with open(path, errors="replace") as f:
+        for _, line in zip(range(ASCII_LINES), f):
+            line = line.strip()
+            if not line:
+                continue
+            if "," in line:
+                delimiter = "comma"
+            values = line.replace(",", " ").split()
+            try:
+                [float(value) for value in values]
+            except ValueError:
+                header_lines += 1
+                continue
+            columns = len(values)
+            break
+    return [f"header={min(header_lines, 2)}", f"columns={columns}", f"delimiter={delimiter}"]
+
+
+def fingerprint(path):
+    """
+    Fingerprint of the layout of a spectrum file: files with the same
+    fingerprint are read with the same format.
+
+    It is made of the file extension and, for FITS files, the values of
+    some header keywords of the first two HDUs (INSTRUME, EXTNAME, TUNIT1, etc.)
+    or, for text files, the number of header lines and of columns.
+    Only the headers, or the first lines, are read.
+
+    Parameters
+    ----------
+    path: str
+        Local file of the spectrum
+
+    Returns
+    -------
+    fingerprint: str
+    """
+    extension = _extension(path)
+    parts = [extension]
+    try:
+        if extension in FITS_EXTENSIONS:
+            parts.extend(_fits_fingerprint(path))
+        else:
+            parts.extend(_ascii_fingerprint(path))
+    except (OSError, ValueError) as e:
+        logger.debug(f"Unable to fingerprint {path}: {e}")
+        parts.append("unreadable")
+    return "|".join(parts)
+
+
+def _read(path, reader):
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        if reader == AUTO:
+            return Spectrum1D.read(path)
+        return Spectrum1D.read(path, format=reader)
+
+
+class SpectrumFormats:
+    """
+    Registry of the Spectrum1D formats of the spectrum files, so each file is
+    read with one parse instead of trying every reader.
+
+    The registry learns the format that read each Spectra.spectrum file
+    and each file fingerprint (see fingerprint). A file is first read with the
+    format of its spectrum, then with the format of its fingerprint, and only
+    then with the other readers, in order. The learned formats are saved to
+    a JSON file, so later sessions read known spectra directly: call save()
+    when done learning. The shared formats of spectrum_formats are also saved
+    when Python exits.
+
+    Parameters
+    ----------
+    file: str, optional
+        JSON file of the learned formats. Default: formats.json in the spectrum cache directory
+    readers: tuple[str]
+        Spectrum1D formats to try, in order, for unknown files
+
+    Examples
+    ----------
+    > formats = SpectrumFormats()
+    > spectrum = formats.read(path, spectrum=row["spectrum"])
+    > formats.format(row["spectrum"])
+    'Spex Prism'
+    """
+
+    def __init__(self, file=None, readers=READERS):
+        if file is None:
+            file = os.path.join(spectrum_cache().directory, "formats.json")
+        self.file = str(file)
+        self.readers = tuple(readers)
+        self._lock = threading.Lock()
+        self._fingerprints, self._spectra = self._load()
+        self._dirty = False
+        self._saved = time.time()
+
+    def _load(self):
+        try:
+            with open(self.file) as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return {}, {}
+        return saved.get("fingerprints", {}), saved.get("spectra", {})
+
+    def save(self):
+        """Save the learned formats"""
+        with self._lock:
+            if not self._dirty:
+                return
+            self._saved = time.time()
+            self._dirty = False
+            directory = os.path.dirname(os.path.abspath(self.file))
+            os.makedirs(directory, exist_ok=True)
+            handle, temporary = tempfile.mkstemp(dir=directory, suffix=".json")
+            with os.fdopen(handle, "w") as f:
+                json.dump({"fingerprints": self._fingerprints, "spectra": self._spectra}, f, indent=1)
+            os.replace(temporary, self.file)
+
+    def __len__(self):
+        return len(self._spectra)
+
+    def format(self, spectrum):
+        """Learned format of a Spectra.spectrum file, or None"""
+        return self._spectra.get(spectrum)
+
+    def readers_of(self, path, spectrum=None):
+        """
+        Readers to try for a file, in order: the learned format of the spectrum,
+        the learned format of the file fingerprint, then the other readers.
+
+        Parameters
+        ----------
+        path: str
+            Local file of the spectrum
+        spectrum: str, optional
+            Spectra.spectrum value of the file
+
+        Returns
+        -------
+        readers: list[str]
+        """
+        known = [self._spectra.get(spectrum), self._fingerprints.get(fingerprint(path))]
+        readers = []
+        for reader in known + list(self.readers):
+            if reader is not None and reader not in readers:
+                readers.append(reader)
+        return readers
+
+    def learn(self, path, reader, spectrum=None):
+        """
+        Remember the format that read a file.
+
+        Parameters
+        ----------
+        path: str
+            Local file of the spectrum
+        reader: str
+            Spectrum1D format that read the file
+        spectrum: str, optional
+            Spectra.spectrum value of the file
+        """
+        key = fingerprint(path)
+        with self._lock:
+            if self._fingerprints.get(key) != reader:
+                self._fingerprints[key] = reader
+                self._dirty = True
+            if spectrum is not None and self._spectra.get(spectrum) != reader:
+                self._spectra[spectrum] = reader
+                self._dirty = True
+        if self._dirty and time.time() - self._saved > SAVE_INTERVAL:
+            self.save()
+
+    def read(self, path, spectrum=None):
+        """
+        Read a spectrum file with the first reader that works, learned formats first.
+
+        Parameters
+        ----------
+        path: str
+            Local file of the spectrum
+        spectrum: str, optional
+            Spectra.spectrum value of the file, to remember its format
+
+        Returns
+        -------
+        spectrum: specutils.Spectrum1D
+
+        Raises
+        ------
+        AstroDBError
+            If no reader can read the file
+        """
+        errors = []
+        for reader in self.readers_of(path, spectrum):
+            try:
+                result = _read(path, reader)
+            except Exception as e:
+                errors.append(f"{reader}: {e}")
+                continue
+            if errors:
+                logger.debug(f"Read {path} as {reader} after {len(errors)} failed readers")
+            self.learn(path, reader, spectrum)
+            return result
+        msg = f"Unable to read {path} as a spectrum: " + "; ".join(errors)
+        logger.warning(msg)
+        raise AstroDBError(msg)
+
+
+def spectrum_formats():
+    """
+    The default SpectrumFormats, created on the first call and shared afterwards.
+    The learned formats are kept in the spectrum cache directory,
+    and saved when Python exits.
+
+    Returns
+    -------
+    formats: SpectrumFormats
+    """
+    global _default_formats
+    if _default_formats is None:
+        _default_formats = SpectrumFormats()
+        atexit.register(_default_formats.save)
+    return _default_formats
+
+
+def read_spectrum(path, spectrum=None, formats=None):
+    """
+    Read a spectrum file with the learned format of the file, see SpectrumFormats.
+
+    Parameters
+    ----------
+    path: str
+        Local file of the spectrum, eg from cached_spectrum_path
+    spectrum: str, optional
+        Spectra.spectrum value of the file
+    formats: SpectrumFormats, optional
+        Default: the shared formats, see spectrum_formats
+
+    Returns
+    -------
+    spectrum: specutils.Spectrum1D
+
+    Examples
+    ----------
+    > path = cached_spectrum_path(row["spectrum"], row["local_spectrum"])
+    > spectrum = read_spectrum(path, row["spectrum"])
+    """
+    if formats is None:
+        formats = spectrum_formats()
+    return formats.read(path, spectrum)
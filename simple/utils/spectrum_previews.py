@@ -0,0 +1,319 @@
+import os
+import logging
+import tempfile
+import threading
+from datetime import datetime
+import numpy as np
+import astropy.units as u
+from astrodb_scripts import AstroDBError
+from simple.utils.spectrum_cache import cached_spectrum_path, spectrum_cache
+from simple.utils.spectrum_formats import read_spectrum
+
+__all__ = [
+    "RESOLUTIONS",
+    "SpectrumPreviews",
+    "build_previews",
+    "envelope",
+    "spectrum_key",
+]
+
+logger = logging.getLogger("SIMPLE")
+
+# Numbers of bins of the stored previews
+RESOLUTIONS = (64, 256, 1024)
+# Columns of the Spectra primary key, in the order of the keys
+KEY_COLUMNS = ("source", "regime", "observation_date", "reference")
+KEY_SEPARATOR = "|"
+
+
+def spectrum_key(row):
+    """
+    Key of a Spectra row in the previews: its primary key values joined by "|".
+
+    Parameters
+    ----------
+    row: dict or astropy.table.Row
+        Spectra row, with at least the source, regime, observation_date and reference
+
+    Returns
+    -------
+    key: str
+    """
+    values = []
+    for column in KEY_COLUMNS:
+        value = row[column]
+        if value is None or np.ma.is_masked(value):
+            value = ""
+        elif hasattr(value, "isoformat"):
+            value = value.isoformat()
+        elif column == "observation_date":
+            # Dates of tables read back from the database or from files
+            value = datetime.fromisoformat(str(value)).isoformat()
+        values.append(str(value))
+    return KEY_SEPARATOR.join(values)
+
+
+def envelope(wavelength, flux, n_bins):
+    """
+    Min-max envelope of a spectrum in bins of equal numbers of points.
+
+    Points with a NaN wavelength or flux are dropped. Spectra with fewer
+    points than bins are returned as they are.
+
+    Parameters
+    ----------
+    wavelength: numpy.ndarray
+    flux: numpy.ndarray
+    n_bins: int
+
+    Returns
+    -------
+    wavelength, flux_min, flux_max: numpy.ndarray
+        float32 mean wavelength, minimum and maximum flux of each bin
+    """
+    wavelength = np.asarray(wavelength, dtype=float).ravel()
+    flux = np.asarray(flux, dtype=float).ravel()
+    if len(wavelength) != len(flux):
+        raise ValueError(f"{len(wavelength)} wavelengths for {len(flux)} fluxes")
+    good = ~np.isnan(wavelength) & ~np.isnan(flux)
+    wavelength, flux = wavelength[good], flux[good]
+    order = np.argsort(wavelength, kind="stable")
+    wavelength, flux = wavelength[order], flux[order]
+    if len(wavelength) <= n_bins:
+        flux = flux.astype(np.float32)
+        return wavelength.astype(np.float32), flux, flux.copy()
+
+    starts = (np.arange(n_bins) * len(wavelength)) // n_bins
+    counts = np.diff(np.append(starts, len(wavelength)))
+    return (
+        (np.add.reduceat(wavelength, starts) / counts).astype(np.float32),
+        np.minimum.reduceat(flux, starts).astype(np.float32),
+        np.maximum.reduceat(flux, starts).astype(np.float32),
+    )
+
+
+class SpectrumPreviews:
+    """
+    Store of downsampled previews of the spectra, to draw spectra without
+    downloading and reading the full files.
+
+    For every Spectra row, the store keeps the min-max envelope of the flux
+    at each of RESOLUTIONS bins (see envelope), with wavelengths in microns.
+    Previews are float32 arrays of a few kilobytes, kept in one compressed npz
+    file and keyed by the Spectra primary key (see spectrum_key).
+    The store is filled by build_previews, which only reads the new rows.
+
+    Parameters
+    ----------
+    file: str, optional
+        npz file of the store. Default: previews.npz in the spectrum cache directory
+
+    Examples
+    ----------
+    > previews = build_previews(db)
+    > wavelength, flux_min, flux_max = previews.preview(row, resolution=256)
+    > plt.fill_between(wavelength, flux_min, flux_max)
+    """
+
+    def __init__(self, file=None):
+        if file is None:
+            file = os.path.join(spectrum_cache().directory, "previews.npz")
+        self.file = str(file)
+        self._lock = threading.Lock()
+        self._previews = self._load()
+
+    def _load(self):
+        """{key: {"spectrum": url, "flux_unit": str, n_bins: (wavelength, flux_min, flux_max)}}"""
+        if not os.path.exists(self.file):
+            return {}
+        previews = {}
+        with np.load(self.file, allow_pickle=False) as saved:
+            keys = saved["keys"]
+            for k, key in enumerate(keys):
+                previews[str(key)] = {
+                    "spectrum": str(saved["spectra"][k]),
+                    "flux_unit": str(saved["flux_units"][k]),
+                }
+            for n_bins in RESOLUTIONS:
+                if f"offsets_{n_bins}" not in saved:
+                    continue
+                offsets = saved[f"offsets_{n_bins}"]
+                arrays = [saved[f"{name}_{n_bins}"] for name in ("wavelength", "min", "max")]
+                for k, key in enumerate(keys):
+                    rows = slice(offsets[k], offsets[k + 1])
+                    previews[str(key)][n_bins] = tuple(array[rows] for array in arrays)
+        return previews
+
+    def save(self):
+        """Write the store, replacing the npz file at once"""
+        with self._lock:
+            keys = sorted(self._previews)
+            arrays = {
+                "keys": np.array(keys, dtype=str),
+                "spectra": np.array([self._previews[key]["spectrum"] for key in keys], dtype=str),
+                "flux_units": np.array([self._previews[key]["flux_unit"] for key in keys], dtype=str),
+            }
+            for n_bins in RESOLUTIONS:
+                previews = [self._previews[key][n_bins] for key in keys]
+                lengths = [len(preview[0]) for preview in previews]
+                arrays[f"offsets_{n_bins}"] = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+                for i, name in enumerate(("wavelength", "min", "max")):
+                    arrays[f"{name}_{n_bins}"] = np.concatenate(
+                        [preview[i] for preview in previews] or [np.zeros(0, np.float32)]
+                    )
+            directory = os.path.dirname(os.path.abspath(self.file))
+            os.makedirs(directory, exist_ok=True)
+            handle, temporary = tempfile.mkstemp(dir=directory, suffix=".npz")
+            with os.fdopen(handle, "wb") as f:
+                np.savez_compressed(f, **arrays)
+            os.replace(temporary, self.file)
+
+    def __contains__(self, key):
+        return key in self._previews
+
+    def __len__(self):
+        return len(self._previews)
+
+    def keys(self):
+        """Keys of the stored previews"""
+        return list(self._previews)
+
+    def spectrum(self, key):
+        """Spectra.spectrum value the preview of a key was made from, or None"""
+        preview = self._previews.get(key)
+        return None if preview is None else preview["spectrum"]
+
+    def add(self, key, spectrum, wavelength, flux):
+        """
+        Store the previews of a spectrum.
+
+        Parameters
+        ----------
+        key: str
+            See spectrum_key
+        spectrum: str
+            Spectra.spectrum value, to rebuild the preview when it changes
+        wavelength: astropy.units.Quantity
+            Spectral axis, convertible to microns
+        flux: astropy.units.Quantity or numpy.ndarray
+        """
+        wavelength = u.Quantity(wavelength).to(u.micron, equivalencies=u.spectral()).value
+        flux_unit = str(getattr(flux, "unit", ""))
+        flux = getattr(flux, "value", flux)
+        preview = {"spectrum": spectrum, "flux_unit": flux_unit}
+        for n_bins in RESOLUTIONS:
+            preview[n_bins] = envelope(wavelength, flux, n_bins)
+        with self._lock:
+            self._previews[key] = preview
+
+    def remove(self, key):
+        """Remove the previews of a key"""
+        with self._lock:
+            self._previews.pop(key, None)
+
+    def preview(self, key, resolution=256):
+        """
+        Preview of a spectrum.
+
+        Parameters
+        ----------
+        key: str or dict or astropy.table.Row
+            Key of the spectrum, or its Spectra row
+        resolution: int
+            Number of bins; the smallest stored resolution at least as large is used,
+            or the largest one
+
+        Returns
+        -------
+        wavelength, flux_min, flux_max: numpy.ndarray
+            float32 wavelengths in microns, and minimum and maximum flux of each bin,
+            in the unit of flux_unit(key)
+
+        Raises
+        ------
+        KeyError
+            If the spectrum has no preview
+        """
+        if not isinstance(key, str):
+            key = spectrum_key(key)
+        preview = self._previews[key]
+        larger = [n_bins for n_bins in RESOLUTIONS if n_bins >= resolution]
+        return preview[min(larger) if larger else max(RESOLUTIONS)]
+
+    def flux_unit(self, key):
+        """Unit of the flux of a preview, as a string"""
+        if not isinstance(key, str):
+            key = spectrum_key(key)
+        return self._previews[key]["flux_unit"]
+
+
+def build_previews(db, previews=None, cache=None, formats=None, rebuild=False):
+    """
+    Add the previews of the new Spectra rows to a store.
+
+    Rows already in the store with the same spectrum URL are kept; rows whose
+    spectrum changed are read again, and rows no longer in the Spectra table
+    are removed. Spectra that cannot be downloaded, read or converted to microns
+    are skipped with a warning, and tried again by the next build.
+
+    Parameters
+    ----------
+    db: astrodbkit2.astrodb.Database
+        Database object created by astrodbkit2
+    previews: SpectrumPreviews, optional
+        Default: the store in the spectrum cache directory
+    cache: SpectrumCache, optional
+        Default: the shared cache, see simple.utils.spectrum_cache.spectrum_cache
+    formats: SpectrumFormats, optional
+        Default: the shared formats, see simple.utils.spectrum_formats.spectrum_formats
+    rebuild: bool
+        Read all the spectra again
+
+    Returns
+    -------
+    previews: SpectrumPreviews
+
+    Examples
+    ----------
+    > previews = build_previews(db)
+    > previews.preview(db.query(db.Spectra).table()[0])
+    """
+    if previews is None:
+        previews = SpectrumPreviews()
+    if cache is None:
+        cache = spectrum_cache()
+
+    rows = db.query(
+        *[db.Spectra.c[column] for column in KEY_COLUMNS],
+        db.Spectra.c.spectrum,
+        db.Spectra.c.local_spectrum,
+    ).all()
+    keys = set()
+    added = failed = 0
+    for row in rows:
+        row = row._mapping
+        key = spectrum_key(row)
+        keys.add(key)
+        if not rebuild and previews.spectrum(key) == row["spectrum"]:
+            continue
+        try:
+            # Not removed by downloads of other threads while it is read
+            with cache.pinned():
+                path = cached_spectrum_path(row["spectrum"], row["local_spectrum"], cache=cache)
+                spectrum = read_spectrum(path, row["spectrum"], formats=formats)
+            previews.add(key, row["spectrum"], spectrum.spectral_axis, spectrum.flux)
+            added += 1
+        except (AstroDBError, u.UnitConversionError, ValueError) as e:
+            logger.warning(f"No preview of {row['spectrum']}: {e}")
+            failed += 1
+
+    removed = [key for key in previews.keys() if key not in keys]
+    for key in removed:
+        previews.remove(key)
+    if added or removed:
+        previews.save()
+    logger.info(
+        f"Spectrum previews: {added} added, {len(removed)} removed, {failed} failed, "
+        f"{len(previews)} in {previews.file}"
+    )
+    return previews
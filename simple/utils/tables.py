@@ -0,0 +1,28 @@
+import numpy as np
+
+__all__ = [
+    "table_values",
+]
+
+
+def table_values(table, name, default=None):
+    """
+    Column of an astropy Table as a list, with masked values as None.
+
+    Parameters
+    ----------
+    table: astropy.table.Table
+    name: str
+        Column name
+    default: optional
+        Value of every row if the table has no such column
+
+    Returns
+    -------
+    values: list
+    """
+    if name not in table.colnames:
+        return [default] * len(table)
+    column = table[name]
+    mask = np.ma.getmaskarray(column)
+    return [None if masked else value for value, masked in zip(column.tolist(), mask)]
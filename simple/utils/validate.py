@@ -0,0 +1,352 @@
+import os
+import json
+import logging
+from datetime import datetime
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from sqlalchemy import Boolean, DateTime, Enum, Float, String
+from astrodbkit2.astrodb import Base
+from astrodb_scripts import AstroDBError
+from simple.schema import REFERENCE_TABLES
+from simple.utils.bulk_load import list_source_files
+
+__all__ = ["compile_schema_rules", "check_rows", "validate_data"]
+
+logger = logging.getLogger("SIMPLE")
+
+# Characters not allowed in names and other key values, eg a tab in a source name
+CONTROL_CHARACTERS = ("\t", "\n", "\r", "\x00")
+
+
+def compile_schema_rules(
+    metadata=Base.metadata,
+    reference_tables=REFERENCE_TABLES,
+    primary_table="Sources",
+    foreign_key="source",
+    strict=True,
+):
+    """
+    Translate the table definitions in simple/schema.py into plain validation rules.
+
+    Parameters
+    ----------
+    metadata: sqlalchemy.MetaData
+        Metadata with the table definitions. Default: the SIMPLE schema
+    reference_tables: list[str]
+    primary_table: str
+    foreign_key: str
+        Column linking object tables to the primary table, filled in when loading
+    strict: bool
+        True: also enforce the String length limits and reject leading or trailing spaces
+        in key values. SQLite does not enforce either, so they do not break a load.
+
+    Returns
+    -------
+    rules: dict
+        For each table, "columns": {column: rule}, "required": columns which must be present
+        and "primary_key": the primary key columns.
+        A rule is a dictionary with the keys kind ("float", "bool", "str", "enum" or "datetime"),
+        nullable, length (maximum string length), choices (enum values),
+        identifier (True for key columns), references ([table, column] of a reference table)
+        and strict.
+    """
+    rules = {}
+    for table in metadata.sorted_tables:
+        columns = {}
+        required = []
+        is_object_table = (
+            table.name not in reference_tables + [primary_table]
+            and foreign_key in table.columns
+        )
+        for column in table.columns:
+            if is_object_table and column.name == foreign_key:
+                continue
+
+            rule = {
+                "kind": "str",
+                "nullable": column.nullable,
+                "length": None,
+                "choices": None,
+                "identifier": bool(column.primary_key or column.foreign_keys),
+                "references": None,
+                "strict": strict,
+            }
+            if isinstance(column.type, Float):
+                rule["kind"] = "float"
+            elif isinstance(column.type, Boolean):
+                rule["kind"] = "bool"
+            elif isinstance(column.type, Enum):
+                rule["kind"] = "enum"
+                rule["choices"] = list(column.type.enums)
+            elif isinstance(column.type, DateTime):
+                rule["kind"] = "datetime"
+            elif isinstance(column.type, String):
+                rule["length"] = column.type.length
+
+            for fk in column.foreign_keys:
+                if fk.column.table.name in reference_tables:
+                    rule["references"] = [fk.column.table.name, fk.column.name]
+
+            columns[column.name] = rule
+            if not column.nullable and column.default is None:
+                required.append(column.name)
+
+        rules[table.name] = {
+            "columns": columns,
+            "required": required,
+            "primary_key": [
+                c.name for c in table.primary_key.columns if c.name in columns
+            ],
+        }
+    return rules
+
+
+def _check_value(value, rule):
+    """Description of what is wrong with a value, or None if it is valid"""
+    if value is None:
+        return None if rule["nullable"] else "is null"
+
+    kind = rule["kind"]
+    if kind == "float":
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            return f"{value!r} is not a number"
+    elif kind == "bool":
+        if not isinstance(value, bool):
+            return f"{value!r} is not a boolean"
+    elif kind == "datetime":
+        try:
+            datetime.fromisoformat(value)
+        except (TypeError, ValueError):
+            return f"{value!r} is not an ISO date"
+    elif not isinstance(value, str):
+        return f"{value!r} is not a string"
+    elif kind == "enum":
+        if value not in rule["choices"]:
+            return f"{value!r} is not one of {rule['choices']}"
+    else:
+        if rule["identifier"] and any(c in value for c in CONTROL_CHARACTERS):
+            return f"{value!r} contains a tab, newline or NUL character"
+        if rule["strict"]:
+            if rule["length"] is not None and len(value) > rule["length"]:
+                return f"is {len(value)} characters long, the limit is {rule['length']}"
+            if rule["identifier"] and value != value.strip():
+                return f"{value!r} has leading or trailing spaces"
+    return None
+
+
+def check_rows(table, rows, rules, reference_keys=None, label=""):
+    """
+    Check rows of one table against the compiled schema rules.
+
+    Parameters
+    ----------
+    table: str
+        Name of the table
+    rows: list[dict]
+    rules: dict
+        Output of compile_schema_rules
+    reference_keys: dict, optional
+        {(table, column): set of values} of the reference tables, to check foreign keys
+    label: str
+        Prefix for the messages, eg the file name
+
+    Returns
+    -------
+    violations: list[str]
+    """
+    if table not in rules:
+        return [f"{label}: unknown table {table}"]
+    if not isinstance(rows, list):
+        return [f"{label}: {table} is not a list of rows"]
+
+    table_rules = rules[table]
+    columns = table_rules["columns"]
+    violations = []
+    keys = Counter()
+    for i, row in enumerate(rows):
+        where = f"{label}: {table}[{i}]"
+        if not isinstance(row, dict):
+            violations.append(f"{where} is not an object")
+            continue
+
+        for column in table_rules["required"]:
+            if column not in row:
+                violations.append(f"{where}.{column} is missing")
+
+        for column, value in row.items():
+            rule = columns.get(column)
+            if rule is None:
+                violations.append(f"{where}.{column} is not a column of {table}")
+                continue
+            problem = _check_value(value, rule)
+            if problem is not None:
+                violations.append(f"{where}.{column} {problem}")
+            elif (
+                reference_keys is not None
+                and rule["references"] is not None
+                and value is not None
+                and value not in reference_keys.get(tuple(rule["references"]), ())
+            ):
+                ref_table, ref_column = rule["references"]
+                violations.append(
+                    f"{where}.{column} {value!r} is not in {ref_table}.{ref_column}"
+                )
+
+        key = tuple(row.get(column) for column in table_rules["primary_key"])
+        if all(isinstance(value, (str, int, float, type(None))) for value in key):
+            keys[key] += 1
+
+    for key, count in keys.items():
+        if count > 1:
+            violations.append(
+                f"{label}: {table} has {count} rows with the same primary key "
+                f"{dict(zip(table_rules['primary_key'], key))}"
+            )
+    return violations
+
+
+def _check_source_files(paths, rules, reference_keys, primary_table, primary_key):
+    """
+    Check a chunk of source JSON files. Runs inside the worker processes of validate_data.
+    Returns the violations and the primary key found in each valid file.
+    """
+    violations = []
+    sources = {}
+    for path in paths:
+        label = os.path.basename(path)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (ValueError, UnicodeDecodeError) as e:
+            violations.append(f"{label}: not valid JSON: {e}")
+            continue
+
+        if not isinstance(data, dict) or len(data.get(primary_table) or []) != 1:
+            violations.append(f"{label}: must have exactly one {primary_table} row")
+            continue
+
+        for table, rows in data.items():
+            violations.extend(check_rows(table, rows, rules, reference_keys, label))
+
+        row = data[primary_table][0]
+        if isinstance(row, dict) and isinstance(row.get(primary_key), str):
+            sources[label] = row[primary_key]
+    return violations, sources
+
+
+def validate_data(
+    directory="data",
+    files=None,
+    *,
+    workers=None,
+    files_per_task=200,
+    reference_tables=REFERENCE_TABLES,
+    strict=True,
+    raise_error=False,
+):
+    """
+    Check the JSON files in a data directory against simple/schema.py before loading them:
+    column types, null values, required columns, string lengths, enumerations,
+    control characters in names, references to the reference tables
+    and duplicated primary keys. Every violation is reported, not just the first.
+
+    Parameters
+    ----------
+    directory: str
+        Directory containing the JSON files
+    files: list[str], optional
+        Source file names to check. Default: every source file.
+        The reference tables are always checked.
+    workers: int, optional
+        Number of worker processes. None uses os.cpu_count(); 1 checks in this process.
+    files_per_task: int, optional
+        Number of files handed to a worker at a time
+    reference_tables: list[str]
+    strict: bool
+        True (default): also check String lengths and spaces around key values,
+        which SQLite accepts but the schema does not
+    raise_error: bool
+        True: raise an AstroDBError listing the violations, if any
+
+    Returns
+    -------
+    violations: list[str]
+        One message per problem, prefixed with the file name
+
+    Examples
+    ----------
+    > violations = validate_data("data")
+    """
+    rules = compile_schema_rules(reference_tables=reference_tables, strict=strict)
+    violations = []
+
+    # Only the referenced columns are collected and sent to the workers
+    referenced = {
+        tuple(rule["references"])
+        for table_rules in rules.values()
+        for rule in table_rules["columns"].values()
+        if rule["references"] is not None
+    }
+
+    # Reference tables first, to collect the keys other tables may refer to
+    reference_rows = {}
+    for table in reference_tables:
+        path = os.path.join(directory, table + ".json")
+        if not os.path.exists(path):
+            continue
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                reference_rows[table] = json.load(f)
+        except (ValueError, UnicodeDecodeError) as e:
+            violations.append(f"{table}.json: not valid JSON: {e}")
+    reference_keys = {
+        (table, column): {
+            row.get(column)
+            for row in reference_rows.get(table, [])
+            if isinstance(row, dict) and isinstance(row.get(column), str)
+        }
+        for table, column in referenced
+    }
+    for table, rows in reference_rows.items():
+        violations.extend(
+            check_rows(table, rows, rules, reference_keys, label=f"{table}.json")
+        )
+
+    if files is None:
+        files = list_source_files(directory, reference_tables)
+    paths = [os.path.join(directory, file) for file in sorted(files)]
+    chunks = [
+        paths[i : i + files_per_task] for i in range(0, len(paths), files_per_task)
+    ]
+    args = (rules, reference_keys, "Sources", "source")
+
+    sources = {}
+    if workers == 1 or len(chunks) <= 1:
+        results = [_check_source_files(chunk, *args) for chunk in chunks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(_check_source_files, chunk, *args) for chunk in chunks
+            ]
+            results = [future.result() for future in futures]
+    for chunk_violations, chunk_sources in results:
+        violations.extend(chunk_violations)
+        sources.update(chunk_sources)
+
+    # Source names must be unique across files
+    counts = Counter(sources.values())
+    for file, source in sorted(sources.items()):
+        if counts[source] > 1:
+            violations.append(f"{file}: source {source!r} is also in another file")
+
+    for violation in violations:
+        logger.warning(violation)
+    logger.info(f"Checked {len(paths)} source files: {len(violations)} violations")
+
+    if violations and raise_error:
+        msg = f"{len(violations)} violations found in {directory}:\n" + "\n".join(
+            violations
+        )
+        raise AstroDBError(msg)
+
+    return violations
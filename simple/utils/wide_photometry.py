@@ -0,0 +1,323 @@
+import logging
+import weakref
+import numpy as np
+import astropy.units as u
+from astropy.table import Column, Table
+from sqlalchemy import event, select
+from sqlalchemy.sql.dml import Insert, Update, Delete
+from sqlalchemy.sql.elements import TextClause
+from simple.utils.changes import (
+    _affected_sources,
+    _PendingChanges,
+    _statement_values,
+    READ_ONLY_SQL,
+)
+
+__all__ = [
+    "WidePhotometry",
+    "wide_photometry",
+]
+
+logger = logging.getLogger("SIMPLE")
+
+# Number of sources per query when refreshing changed sources
+CHUNK_SIZE = 500
+
+# WidePhotometry of each database, see wide_photometry
+_tables = weakref.WeakKeyDictionary()
+
+
+class WidePhotometry:
+    """
+    Photometry pivoted to one row per source, with the magnitude and error
+    of every band in PhotometryFilters, kept in memory.
+
+    Unlike PhotometryView, which has a fixed list of bands and groups
+    the whole Photometry table on every query, it covers every band
+    and is only recomputed where the photometry changed.
+    Magnitudes of a band measured several times are averaged, as in the view,
+    and their errors are combined as the error of the mean.
+
+    The table listens to the database engine: when Photometry rows
+    of a source are inserted, updated or deleted, only that source
+    is recomputed on the next access. New filters add a band.
+    Other changes (text SQL, updates of Sources or PhotometryFilters)
+    rebuild the whole table on the next access.
+    Changes are applied when their transaction commits, and dropped if it rolls back.
+    The table holds the database through a weak reference.
+
+    Parameters
+    ----------
+    db: astrodbkit2.astrodb.Database
+        Database object created by astrodbkit2
+
+    Examples
+    ----------
+    > photometry = WidePhotometry(db)
+    > photometry.table(["2MASS.J", "2MASS.Ks"])
+    > photometry.color("2MASS.J", "2MASS.Ks")
+    """
+
+    def __init__(self, db):
+        self._db = weakref.ref(db)
+        self._stale = True
+        self._changed = set()
+        self._build()
+        self._engine = db.engine
+        self._pending = _PendingChanges(db.engine, self._apply_changes)
+        event.listen(db.engine, "before_execute", self._before_execute)
+
+    @property
+    def db(self):
+        """The database of the photometry"""
+        db = self._db()
+        if db is None:
+            raise ReferenceError("The database of the photometry no longer exists")
+        return db
+
+    def stop(self):
+        """Stop listening to the database engine"""
+        if event.contains(self._engine, "before_execute", self._before_execute):
+            event.remove(self._engine, "before_execute", self._before_execute)
+            self._pending.stop()
+
+    def _photometry(self, sources=None):
+        photometry = self.db.Photometry
+        query = select(
+            photometry.c.source,
+            photometry.c.band,
+            photometry.c.magnitude,
+            photometry.c.magnitude_error,
+        )
+        with self.db.engine.connect() as conn:
+            if sources is None:
+                return conn.execute(query).all()
+            rows = []
+            for start in range(0, len(sources), CHUNK_SIZE):
+                chunk = sources[start : start + CHUNK_SIZE]
+                rows.extend(conn.execute(query.where(photometry.c.source.in_(chunk))).all())
+            return rows
+
+    def _aggregate(self, rows):
+        """Source names, magnitudes and errors per band of Photometry rows"""
+        names = sorted({row[0] for row in rows})
+        row_of = {name: i for i, name in enumerate(names)}
+        shape = (len(names), len(self._bands))
+        if not rows:
+            return names, np.full(shape, np.nan), np.full(shape, np.nan)
+
+        i = np.array([row_of[row[0]] for row in rows], dtype=int)
+        j = np.array([self._columns[row[1]] for row in rows], dtype=int)
+        magnitudes = np.array([row[2] for row in rows], dtype=float)
+        errors = np.array([row[3] for row in rows], dtype=float)
+        has_error = np.isfinite(errors)
+
+        total = np.zeros(shape)
+        count = np.zeros(shape)
+        np.add.at(total, (i, j), magnitudes)
+        np.add.at(count, (i, j), 1)
+        squares = np.zeros(shape)
+        n_errors = np.zeros(shape)
+        np.add.at(squares, (i[has_error], j[has_error]), errors[has_error] ** 2)
+        np.add.at(n_errors, (i[has_error], j[has_error]), 1)
+
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = np.where(count > 0, total / count, np.nan)
+            error = np.where(n_errors > 0, np.sqrt(squares) / n_errors, np.nan)
+        return names, mean, error
+
+    def _build(self):
+        db = self.db
+        filters = db.PhotometryFilters
+        with db.engine.connect() as conn:
+            self._bands = [
+                row[0]
+                for row in conn.execute(
+                    select(filters.c.band).order_by(
+                        filters.c.effective_wavelength, filters.c.band
+                    )
+                )
+            ]
+        self._columns = {band: j for j, band in enumerate(self._bands)}
+        names, self._magnitudes, self._errors = self._aggregate(self._photometry())
+        self._names = np.array(names, dtype=object)
+        self._rows = {name: i for i, name in enumerate(names)}
+        self._stale = False
+        self._changed = set()
+        logger.debug(
+            f"Built wide photometry: {len(self._names)} sources, {len(self._bands)} bands"
+        )
+
+    def _add_band(self, band):
+        if band is None or band in self._columns:
+            return
+        self._columns[band] = len(self._bands)
+        self._bands.append(band)
+        empty = np.full((len(self._names), 1), np.nan)
+        self._magnitudes = np.hstack([self._magnitudes, empty])
+        self._errors = np.hstack([self._errors, empty])
+
+    def _update_changed(self):
+        """Recompute the rows of the sources whose photometry changed"""
+        changed = sorted(self._changed)
+        self._changed = set()
+        names, magnitudes, errors = self._aggregate(self._photometry(changed))
+
+        new = []
+        for name, row_magnitudes, row_errors in zip(names, magnitudes, errors):
+            if name in self._rows:
+                i = self._rows[name]
+                self._magnitudes[i] = row_magnitudes
+                self._errors[i] = row_errors
+            else:
+                new.append((name, row_magnitudes, row_errors))
+        if new:
+            self._names = np.append(self._names, np.array([n[0] for n in new], dtype=object))
+            self._magnitudes = np.vstack([self._magnitudes, [n[1] for n in new]])
+            self._errors = np.vstack([self._errors, [n[2] for n in new]])
+
+        removed = [self._rows[name] for name in set(changed) - set(names) if name in self._rows]
+        if removed:
+            self._names = np.delete(self._names, removed)
+            self._magnitudes = np.delete(self._magnitudes, removed, axis=0)
+            self._errors = np.delete(self._errors, removed, axis=0)
+        if new or removed:
+            self._rows = {name: i for i, name in enumerate(self._names)}
+        logger.debug(f"Refreshed wide photometry of {len(changed)} sources")
+
+    def refresh(self):
+        """Apply the pending changes of the database now, instead of on the next access"""
+        if self._stale:
+            self._build()
+        elif self._changed:
+            self._update_changed()
+
+    def _before_execute(self, conn, clauseelement, multiparams, params, execution_options):
+        if isinstance(clauseelement, TextClause):
+            if not clauseelement.text.lstrip().upper().startswith(READ_ONLY_SQL):
+                self._pending.add(conn, None)
+            return
+        if not isinstance(clauseelement, (Insert, Update, Delete)):
+            return
+
+        name = clauseelement.table.name
+        if name == "PhotometryFilters" and isinstance(clauseelement, Insert):
+            for row in _statement_values(clauseelement, multiparams, params):
+                self._pending.add(conn, ("band", row["band"]) if "band" in row else None)
+        elif name in ("Sources", "PhotometryFilters") and not isinstance(clauseelement, Insert):
+            # Cascading deletes and renames of sources, or renamed bands
+            self._pending.add(conn, None)
+        elif name == "Photometry":
+            if isinstance(clauseelement, Insert):
+                rows = _statement_values(clauseelement, multiparams, params)
+                sources = {row.get("source") for row in rows}
+                if None in sources:
+                    sources = None
+            else:
+                sources = _affected_sources(conn, clauseelement, multiparams, params)
+            self._pending.add(conn, None if sources is None else ("sources", sources))
+
+    def _apply_changes(self, changes):
+        """New bands and changed sources of a committed transaction, or None to rebuild"""
+        if self._stale:
+            return
+        if None in changes:
+            self._stale = True
+            return
+        for kind, value in changes:
+            if kind == "band":
+                self._add_band(value)
+            else:
+                self._changed.update(value)
+
+    def __len__(self):
+        self.refresh()
+        return len(self._names)
+
+    @property
+    def bands(self):
+        """Bands of PhotometryFilters, by effective wavelength"""
+        self.refresh()
+        return list(self._bands)
+
+    @property
+    def sources(self):
+        """Sources.source values of the sources with photometry"""
+        self.refresh()
+        return self._names
+
+    def table(self, bands=None):
+        """
+        Magnitudes and errors of the sources, one row per source.
+
+        Parameters
+        ----------
+        bands: list[str], optional
+            Bands to include. Default: all bands of PhotometryFilters.
+            Only sources measured in at least one of them are included.
+
+        Returns
+        -------
+        table: astropy.table.Table
+            Columns source, then <band> and <band>_error for each band,
+            nan where a source was not measured
+        """
+        self.refresh()
+        if bands is None:
+            bands = self._bands
+        columns = [self._columns[band] for band in bands]
+        rows = np.isfinite(self._magnitudes[:, columns]).any(axis=1)
+
+        table_columns = [Column(self._names[rows].astype(str), name="source")]
+        for band, j in zip(bands, columns):
+            table_columns.append(Column(self._magnitudes[rows, j], name=band, unit=u.mag))
+            table_columns.append(Column(self._errors[rows, j], name=f"{band}_error", unit=u.mag))
+        return Table(table_columns, copy=False)
+
+    def color(self, band_1, band_2):
+        """
+        Color of the sources measured in both bands, e.g. for color-magnitude diagrams.
+
+        Parameters
+        ----------
+        band_1, band_2: str
+            Bands of the color band_1 - band_2
+
+        Returns
+        -------
+        table: astropy.table.Table
+            Columns source, band_1, band_2, color and color_error
+        """
+        self.refresh()
+        i, j = self._columns[band_1], self._columns[band_2]
+        rows = np.isfinite(self._magnitudes[:, i]) & np.isfinite(self._magnitudes[:, j])
+        magnitudes_1 = self._magnitudes[rows, i]
+        magnitudes_2 = self._magnitudes[rows, j]
+        color_error = np.hypot(self._errors[rows, i], self._errors[rows, j])
+        return Table(
+            [
+                Column(self._names[rows].astype(str), name="source"),
+                Column(magnitudes_1, name=band_1, unit=u.mag),
+                Column(magnitudes_2, name=band_2, unit=u.mag),
+                Column(magnitudes_1 - magnitudes_2, name="color", unit=u.mag),
+                Column(color_error, name="color_error", unit=u.mag),
+            ],
+            copy=False,
+        )
+
+
+def wide_photometry(db):
+    """
+    The WidePhotometry of a database, built on the first call and shared afterwards.
+
+    Parameters
+    ----------
+    db: astrodbkit2.astrodb.Database
+
+    Returns
+    -------
+    photometry: WidePhotometry
+    """
+    if db not in _tables:
+        _tables[db] = WidePhotometry(db)
+    return _tables[db]
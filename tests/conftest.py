@@ -3,40 +3,28 @@ import os
 import sys
 import logging
 from astrodbkit2.astrodb import create_database, Database
-sys.path.append("./simple")
-# from schema import REFERENCE_TABLES
-from schema import *
+sys.path.append("./")
+from simple.schema import *
+from simple.utils.bulk_load import load_cached_database
 
 
 logger = logging.getLogger("AstroDB")
 
 
-# Create a fresh SIMPLE database for the data and integrity tests
+# SIMPLE database for the data and integrity tests.
+# The database file is reused between sessions until the JSON files or the schema change.
 @pytest.fixture(scope="session", autouse=True)
 def db():
     DB_NAME = "tests/simple_tests.sqlite"
     DB_PATH = "data"
 
-    if os.path.exists(DB_NAME):
-        os.remove(DB_NAME)
-    connection_string = "sqlite:///" + DB_NAME
-    create_database(connection_string)
+    db = load_cached_database(
+        DB_NAME,
+        DB_PATH,
+        extra_files=["simple/schema.py"],
+        reference_tables=REFERENCE_TABLES,
+    )
     assert os.path.exists(DB_NAME)
-
-    # Connect to the new database
-    db = Database(connection_string, reference_tables=REFERENCE_TABLES)
-
-    # Load data into an in-memory sqlite database first, for performance
-    db = Database(
-        "sqlite://", reference_tables=REFERENCE_TABLES
-    )  # creates and connects to a temporary in-memory database
-    db.load_database(
-        DB_PATH, verbose=False
-    )  # loads the data from the data files into the database
-    db.dump_sqlite(DB_NAME)  # dump in-memory database to file
-    db = Database(
-        "sqlite:///" + DB_NAME, reference_tables=REFERENCE_TABLES
-    )  # replace database object with new file version
     logger.info("Loaded SIMPLE database using db function in conftest")
 
     return db
@@ -0,0 +1,298 @@
+# Tests for the database build utilities
+import os
+import json
+import shutil
+import pytest
+import sys
+import sqlalchemy as sa
+from astrodbkit2.astrodb import Database
+from astrodb_scripts import AstroDBError
+sys.path.append("./")
+from simple.schema import REFERENCE_TABLES
+from simple.utils.bulk_load import (
+    bulk_load_database,
+    list_source_files,
+    read_source_files,
+    update_database,
+    load_cached_database,
+)
+from simple.utils.snapshot import build_snapshot, load_snapshot, check_snapshot
+from simple.utils.changes import track_changes, save_changes, verify_save
+from simple.utils.source_store import SourceStore
+from simple.utils.validate import validate_data
+
+DB_PATH = "data"
+TEST_SOURCES = [
+    "2mass_j00001354+2554180.json",
+    "2mass_j00002867-1245153.json",
+    "2mass_j00011217+1535355.json",
+]
+
+
+# Small copy of the data directory with a few sources and all reference tables
+@pytest.fixture(scope="module")
+def small_data(tmp_path_factory):
+    directory = tmp_path_factory.mktemp("data")
+    for table in REFERENCE_TABLES:
+        filename = os.path.join(DB_PATH, table + ".json")
+        if os.path.exists(filename):
+            shutil.copy(filename, directory)
+    for file in TEST_SOURCES:
+        shutil.copy(os.path.join(DB_PATH, file), directory)
+    return str(directory)
+
+
+def table_rows(db, table):
+    rows = db.query(db.metadata.tables[table]).all()
+    return sorted(rows, key=repr)
+
+
+def test_list_source_files(small_data):
+    files = list_source_files(small_data)
+    assert sorted(files) == TEST_SOURCES
+
+
+def test_read_source_files(small_data):
+    rows = read_source_files(small_data, workers=1)
+    assert len(rows["Sources"]) == 3
+    assert all(row["source"] for row in rows["Names"])
+    names = [row["other_name"] for row in rows["Names"]]
+    assert "SDSS J000013.54+255418.6" in names
+
+
+def test_bulk_load_database(small_data):
+    db_orig = Database("sqlite://", reference_tables=REFERENCE_TABLES)
+    db_orig.load_database(small_data, verbose=False)
+
+    db_bulk = Database("sqlite://", reference_tables=REFERENCE_TABLES)
+    counts = bulk_load_database(db_bulk, small_data, workers=2)
+    assert counts["Sources"] == 3
+
+    for table in db_orig.metadata.tables:
+        assert table_rows(db_bulk, table) == table_rows(db_orig, table), table
+
+
+def test_update_database(small_data, tmp_path):
+    directory = tmp_path / "data"
+    shutil.copytree(small_data, directory)
+    directory = str(directory)
+    manifest_file = str(tmp_path / "manifest.json")
+
+    db = Database("sqlite://", reference_tables=REFERENCE_TABLES)
+    bulk_load_database(db, directory, workers=1, manifest_file=manifest_file)
+
+    # Nothing changed
+    changes = update_database(db, directory, manifest_file)
+    assert changes == {
+        "reference_tables": [],
+        "added": [],
+        "changed": [],
+        "removed": [],
+    }
+
+    # Edit one source, remove another and add a publication
+    filename = os.path.join(directory, TEST_SOURCES[0])
+    with open(filename, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    data["Names"].append({"other_name": "Fake Name"})
+    with open(filename, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.remove(os.path.join(directory, TEST_SOURCES[1]))
+    filename = os.path.join(directory, "Publications.json")
+    with open(filename, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    data.append({"reference": "Fake99", "bibcode": None, "doi": None})
+    with open(filename, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+
+    changes = update_database(db, directory, manifest_file)
+    assert changes["changed"] == [TEST_SOURCES[0]]
+    assert changes["removed"] == [TEST_SOURCES[1]]
+    assert changes["reference_tables"] == ["Publications"]
+
+    db_full = Database("sqlite://", reference_tables=REFERENCE_TABLES)
+    bulk_load_database(db_full, directory, workers=1)
+    for table in db.metadata.tables:
+        assert table_rows(db, table) == table_rows(db_full, table), table
+
+
+def test_snapshot(small_data, tmp_path):
+    db = Database("sqlite://", reference_tables=REFERENCE_TABLES)
+    bulk_load_database(db, small_data, workers=1)
+
+    snapshot_dir = str(tmp_path / "snapshot")
+    info = build_snapshot(snapshot_dir, small_data, db=db)
+    assert info["tables"]["Sources"]["rows"] == 3
+    assert info["version"]["version"] is not None
+    assert check_snapshot(snapshot_dir, small_data)
+
+    db_snapshot = load_snapshot(snapshot_dir)
+    for table in db.metadata.tables:
+        assert table_rows(db_snapshot, table) == table_rows(db, table), table
+
+    tables = load_snapshot(snapshot_dir, fmt="astropy")
+    assert len(tables["Names"]) == len(table_rows(db, "Names"))
+
+
+def test_save_changes(small_data, tmp_path):
+    db = Database("sqlite://", reference_tables=REFERENCE_TABLES)
+    bulk_load_database(db, small_data, workers=1)
+    directory = str(tmp_path / "data")
+    os.makedirs(directory)
+
+    # Start from a full save
+    tracker = track_changes(db)
+    tracker.full_save = True
+    save_changes(tracker, directory)
+    verify_save(db, directory)
+    assert not tracker.changed
+    db.query(db.Sources).all()
+    assert not tracker.changed
+
+    source = [row[0] for row in db.query(db.Sources.c.source).all()]
+    with db.engine.begin() as conn:
+        conn.execute(
+            db.Names.insert().values(source=source[0], other_name="Fake Name")
+        )
+        conn.execute(
+            db.Publications.update()
+            .where(db.Publications.c.reference == "Cutr03")
+            .values(description="Changed description")
+        )
+        for table in db.metadata.sorted_tables[::-1]:
+            if "source" in table.columns:
+                conn.execute(table.delete().where(table.c.source == source[1]))
+    assert tracker.sources == {source[0], source[1]}
+    assert tracker.reference_tables == {"Publications"}
+    assert not tracker.full_save
+
+    mtimes = {f: os.stat(os.path.join(directory, f)).st_mtime_ns for f in os.listdir(directory)}
+    results = save_changes(tracker, directory, verify=True)
+    assert len(results["written"]) == 2
+    assert len(results["removed"]) == 1
+    assert not tracker.changed
+    # The untouched source was not rewritten
+    unchanged = results["written"] + results["removed"]
+    for f in set(mtimes) - set(unchanged):
+        assert os.stat(os.path.join(directory, f)).st_mtime_ns == mtimes[f]
+
+    # Bulk updates (executemany) only mark the sources they match
+    with db.engine.begin() as conn:
+        conn.execute(
+            db.Sources.update()
+            .where(db.Sources.c.source == sa.bindparam("name"))
+            .values(comments=sa.bindparam("new_comments")),
+            [
+                {"name": source[0], "new_comments": "Bulk update"},
+                {"name": source[2], "new_comments": "Bulk update"},
+            ],
+        )
+    assert tracker.sources == {source[0], source[2]}
+    assert not tracker.full_save
+    results = save_changes(tracker, directory, verify=True)
+    assert len(results["written"]) == 2
+
+    # Raw SQL can't be attributed to sources
+    with db.engine.begin() as conn:
+        conn.exec_driver_sql("UPDATE Names SET other_name = other_name")
+    assert tracker.full_save
+    save_changes(tracker, directory, verify=True)
+    tracker.stop()
+
+
+def test_load_cached_database(small_data, tmp_path):
+    directory = tmp_path / "data"
+    shutil.copytree(small_data, directory)
+    directory = str(directory)
+    db_file = str(tmp_path / "cached.sqlite")
+
+    db = load_cached_database(db_file, directory, workers=1)
+    assert db.query(db.Sources).count() == 3
+    db.session.close()
+    db.engine.dispose()
+    mtime = os.stat(db_file).st_mtime_ns
+
+    # Unchanged JSON files: the database file is reused
+    db = load_cached_database(db_file, directory, workers=1)
+    db.session.close()
+    db.engine.dispose()
+    assert os.stat(db_file).st_mtime_ns == mtime
+
+    # Removing a source rebuilds the database
+    os.remove(os.path.join(directory, TEST_SOURCES[0]))
+    db = load_cached_database(db_file, directory, workers=1)
+    assert db.query(db.Sources).count() == 2
+
+
+def test_source_store(small_data, tmp_path):
+    directory = tmp_path / "data"
+    shutil.copytree(small_data, directory)
+    directory = str(directory)
+    index_file = str(tmp_path / "index.json")
+
+    db = Database("sqlite://", reference_tables=REFERENCE_TABLES)
+    bulk_load_database(db, directory, workers=1)
+
+    store = SourceStore(directory, index_file=index_file)
+    assert os.path.exists(index_file)
+    assert len(store) == 3
+    for source in store.sources:
+        assert store.inventory(source) == db.inventory(source)
+    assert store.find("sdss j000013.54+255418.6") == "2MASS J00001354+2554180"
+    assert store.inventory("Not a source") == {}
+    assert len(store.reference_table("Publications")) > 0
+
+    # Edits are seen without refreshing; new names after a refresh
+    filename = os.path.join(directory, TEST_SOURCES[0])
+    with open(filename, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    data["Names"].append({"other_name": "Fake Name"})
+    with open(filename, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    assert {"other_name": "Fake Name"} in store.inventory("2MASS J00001354+2554180")["Names"]
+    store.refresh()
+    assert store.find("Fake Name") == "2MASS J00001354+2554180"
+
+    # Reopening reads the files edited in place, without a refresh
+    data["Names"].append({"other_name": "Other Fake Name"})
+    with open(filename, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    store = SourceStore(directory, index_file=index_file)
+    assert store.find("Other Fake Name") == "2MASS J00001354+2554180"
+
+    # Reopening uses the index file
+    os.remove(os.path.join(directory, TEST_SOURCES[1]))
+    store = SourceStore(directory, index_file=index_file)
+    assert len(store) == 2
+    assert store.find("Fake Name") == "2MASS J00001354+2554180"
+
+
+def test_validate_data(small_data, tmp_path):
+    directory = tmp_path / "data"
+    shutil.copytree(small_data, directory)
+    directory = str(directory)
+    assert validate_data(directory, workers=1, strict=False) == []
+
+    filename = os.path.join(directory, TEST_SOURCES[0])
+    with open(filename, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    data["Names"].append({"other_name": "2MASS J12475047\t-0152142"})
+    data["Sources"][0]["ra"] = "12.3"
+    del data["Sources"][0]["reference"]
+    data["Gravities"] = [{"gravity": "very low", "regime": "nir", "reference": "Fake99"}]
+    data["Photometry"] = [{"band": "2MASS.J", "magnitude": 15.0, "reference": "Cutr03"}] * 2
+    with open(filename, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+
+    violations = validate_data(directory, workers=1)
+    messages = "\n".join(violations)
+    assert len(violations) == 6, messages
+    assert "Names[2].other_name '2MASS J12475047\\t-0152142' contains a tab" in messages
+    assert "Sources[0].ra '12.3' is not a number" in messages
+    assert "Sources[0].reference is missing" in messages
+    assert "Gravities[0].gravity 'very low' is not one of" in messages
+    assert "Gravities[0].reference 'Fake99' is not in Publications.reference" in messages
+    assert "Photometry has 2 rows with the same primary key" in messages
+
+    with pytest.raises(AstroDBError):
+        validate_data(directory, workers=1, raise_error=True)
@@ -7,6 +7,7 @@ from astropy import units as u
 from astroquery.simbad import Simbad
 from astrodbkit2.utils import _name_formatter
 from astrodbkit2.astrodb import or_
+from simple.utils.validate import validate_data
 # from simple.schema import ParallaxView  # , PhotometryView
 
 
@@ -835,3 +836,15 @@ def test_names_uniqueness(db):
         print(duplicate_names)
 
     assert len(duplicate_names) == 0
+
+
+def test_json_files_validate():
+    # Verify that the JSON files match the schema
+    # String lengths and spaces around names are reported, but SQLite accepts them
+    violations = validate_data("data", strict=True)
+    if len(violations) > 0:
+        print(f"\n{len(violations)} values outside the String limits or with extra spaces")
+        print("\n".join(violations))
+
+    violations = validate_data("data", strict=False)
+    assert violations == [], "\n".join(violations)
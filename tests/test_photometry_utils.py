@@ -2,16 +2,23 @@
 This function is in the process of being moved to astrodb_scripts
 """
 
+import gc
 import pytest
 import sys
+import weakref
 from astrodb_scripts import (
     AstroDBError,
 )
 sys.path.append("./")
+import numpy as np
+from astropy.table import Table
+from astrodbkit2.astrodb import Database
 from simple.utils.photometry import (
     fetch_svo,
     assign_ucd,
+    ingest_photometry_table,
 )
+from simple.utils.wide_photometry import WidePhotometry, wide_photometry
 
 
 @pytest.mark.parametrize(
@@ -52,3 +59,154 @@ def test_fetch_svo_fail():
 )
 def test_assign_ucd(wave, ucd):
     assert assign_ucd(wave) == ucd
+
+
+def test_ingest_photometry_table():
+    db = Database("sqlite://")
+    with db.engine.begin() as conn:
+        conn.execute(db.Publications.insert(), [{"reference": "Ref 1"}])
+        conn.execute(db.Telescopes.insert(), [{"telescope": "IRTF"}])
+        conn.execute(
+            db.Sources.insert(),
+            [
+                {"source": name, "ra": 9.0673755, "dec": 18.352889, "reference": "Ref 1"}
+                for name in ["Fake 1", "Fake 2", "Fake 3", "apple"]
+            ],
+        )
+        conn.execute(
+            db.PhotometryFilters.insert(),
+            [
+                {"band": "2MASS.J", "effective_wavelength": 12350.0},
+                {"band": "2MASS.H", "effective_wavelength": 16620.0},
+            ],
+        )
+
+    t = Table(
+        {
+            "source": ["Fake 1", "fake 2", "Fake 3", "Not a source", "apple", "Fake 1"],
+            "band": ["2MASS.J", "2MASS.J", "2MASS.K", "2MASS.J", "2MASS.H", "2MASS.J"],
+            "magnitude": [15.1, 15.2, 15.3, 15.4, 15.5, 15.6],
+            "magnitude_error": [0.1, 0.1, 0.1, 0.1, 0.1, 0.1],
+        },
+        masked=True,
+    )
+    t["magnitude_error"].mask[4] = True
+
+    with pytest.raises(AstroDBError) as error_message:
+        ingest_photometry_table(db, t, reference="Ref 1", telescope="IRTF")
+    assert "3 of 6 photometry measurements" in str(error_message.value)
+    assert db.query(db.Photometry).count() == 0
+
+    results = ingest_photometry_table(
+        db, t, reference="Ref 1", telescope="IRTF", raise_error=False
+    )
+    assert list(results["status"]) == [
+        "added",
+        "added",
+        "unknown band",
+        "source not found",
+        "added",
+        "duplicate",
+    ]
+    rows = db.query(db.Photometry).pandas()
+    assert len(rows) == 3
+    assert set(rows["source"]) == {"Fake 1", "Fake 2", "apple"}
+    assert rows.loc[rows["source"] == "apple", "magnitude_error"].isnull().all()
+
+    # Already in the database
+    results = ingest_photometry_table(
+        db, t[:1], reference="Ref 1", telescope="IRTF", raise_error=False
+    )
+    assert list(results["status"]) == ["duplicate"]
+
+
+def test_wide_photometry():
+    db = Database("sqlite://")
+    with db.engine.begin() as conn:
+        conn.execute(db.Publications.insert(), [{"reference": "Ref 1"}, {"reference": "Ref 2"}])
+        conn.execute(
+            db.Sources.insert(),
+            [{"source": name, "reference": "Ref 1"} for name in ["Fake 1", "Fake 2", "Fake 3"]],
+        )
+        conn.execute(
+            db.PhotometryFilters.insert(),
+            [
+                {"band": "2MASS.Ks", "effective_wavelength": 21590.0},
+                {"band": "2MASS.J", "effective_wavelength": 12350.0},
+            ],
+        )
+        conn.execute(
+            db.Photometry.insert(),
+            [
+                {"source": "Fake 1", "band": "2MASS.J", "magnitude": 15.0, "magnitude_error": 0.3, "reference": "Ref 1"},
+                {"source": "Fake 1", "band": "2MASS.J", "magnitude": 15.2, "magnitude_error": 0.4, "reference": "Ref 2"},
+                {"source": "Fake 1", "band": "2MASS.Ks", "magnitude": 14.0, "magnitude_error": None, "reference": "Ref 1"},
+                {"source": "Fake 2", "band": "2MASS.J", "magnitude": 16.0, "magnitude_error": 0.1, "reference": "Ref 1"},
+            ],
+        )
+
+    photometry = WidePhotometry(db)
+    # Bands by wavelength; repeated measurements averaged
+    assert photometry.bands == ["2MASS.J", "2MASS.Ks"]
+    table = photometry.table()
+    assert table.colnames == ["source", "2MASS.J", "2MASS.J_error", "2MASS.Ks", "2MASS.Ks_error"]
+    assert list(table["source"]) == ["Fake 1", "Fake 2"]
+    assert np.allclose(table["2MASS.J"], [15.1, 16.0])
+    assert np.allclose(table["2MASS.J_error"], [0.25, 0.1])
+    assert np.isnan(table["2MASS.Ks_error"]).all()
+    assert list(photometry.table(["2MASS.Ks"])["source"]) == ["Fake 1"]
+
+    colors = photometry.color("2MASS.J", "2MASS.Ks")
+    assert list(colors["source"]) == ["Fake 1"]
+    assert np.allclose(colors["color"], 1.1)
+
+    # Changes are applied on the next access: a new band, a new source,
+    # an updated and a deleted measurement
+    with db.engine.begin() as conn:
+        conn.execute(
+            db.PhotometryFilters.insert().values(band="WISE.W1", effective_wavelength=33526.0)
+        )
+        conn.execute(
+            db.Photometry.insert().values(
+                source="Fake 3", band="WISE.W1", magnitude=13.0, reference="Ref 1"
+            )
+        )
+        conn.execute(
+            db.Photometry.update()
+            .where(db.Photometry.c.source == "Fake 2")
+            .values(magnitude=16.5)
+        )
+        conn.execute(
+            db.Photometry.delete().where(
+                (db.Photometry.c.source == "Fake 1") & (db.Photometry.c.reference == "Ref 2")
+            )
+        )
+    assert photometry.bands == ["2MASS.J", "2MASS.Ks", "WISE.W1"]
+    table = photometry.table()
+    assert list(table["source"]) == ["Fake 1", "Fake 2", "Fake 3"]
+    assert np.allclose(table["2MASS.J"][:2], [15.0, 16.5])
+    assert table["WISE.W1"][2] == 13.0
+
+    # Sources without photometry left are removed
+    with db.engine.begin() as conn:
+        conn.execute(db.Photometry.delete().where(db.Photometry.c.source == "Fake 2"))
+    assert list(photometry.sources) == ["Fake 1", "Fake 3"]
+
+    # Rolled back changes are dropped
+    with pytest.raises(RuntimeError):
+        with db.engine.begin() as conn:
+            conn.execute(
+                db.Photometry.insert().values(
+                    source="Fake 2", band="2MASS.J", magnitude=17.0, reference="Ref 1"
+                )
+            )
+            raise RuntimeError("failed ingest")
+    assert list(photometry.sources) == ["Fake 1", "Fake 3"]
+    photometry.stop()
+
+    # The shared table does not keep the database alive
+    assert wide_photometry(db) is wide_photometry(db)
+    db_ref = weakref.ref(db)
+    del db, photometry
+    gc.collect()
+    assert db_ref() is None
@@ -1,6 +1,9 @@
 # temp_db and logger is defined in conftest.py
 import pytest
 import sys
+import hashlib
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from astrodb_scripts.utils import (
     AstroDBError,
 )
@@ -10,6 +13,11 @@ from simple.utils.spectra import (
     # ingest_spectrum_from_fits,
     spectrum_plottable,
 )
+from simple.utils.spectrum_cache import SpectrumCache, cached_spectrum_path
+from simple.utils.spectra_scan import scan_spectra
+from simple.utils.spectrum_formats import SpectrumFormats, fingerprint
+from simple.utils.spectrum_previews import SpectrumPreviews, build_previews, envelope
+from simple.utils.spectra_convert import convert_to_fits, load_spectrum_arrays
 
 
 @pytest.mark.filterwarnings("ignore")
@@ -221,3 +229,397 @@ def test_spectrum_plottable_false(file):
 def test_spectrum_plottable_true(file):
     result = spectrum_plottable(file)
     assert result is True
+
+
+@pytest.fixture
+def spectrum_server():
+    # Local HTTP server with ETags, counting the downloads of each path
+    files = {
+        "/a.fits": b"a" * 100,
+        "/b.fits": b"b" * 100,
+        "/c.txt": b"c" * 100,
+        "/copy_of_a.fits": b"a" * 100,
+    }
+    downloads = {}
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            content = files.get(self.path)
+            if content is None:
+                self.send_error(404)
+                return
+            etag = '"' + hashlib.md5(content).hexdigest() + '"'
+            if self.headers.get("If-None-Match") == etag:
+                self.send_response(304)
+                self.end_headers()
+                return
+            downloads[self.path] = downloads.get(self.path, 0) + 1
+            self.send_response(200)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}", files, downloads
+    server.shutdown()
+
+
+def test_spectrum_cache(tmp_path, monkeypatch, spectrum_server):
+    url, files, downloads = spectrum_server
+    cache = SpectrumCache(tmp_path / "cache", max_size=250)
+
+    # Downloaded once, with the extension of the URL
+    path = cache.path(url + "/a.fits")
+    assert path.endswith(".fits")
+    assert cache.path(url + "/a.fits") == path
+    assert downloads == {"/a.fits": 1}
+    with open(path, "rb") as f:
+        assert f.read() == files["/a.fits"]
+
+    # Same content from another URL: stored once
+    assert cache.path(url + "/copy_of_a.fits") == path
+    assert cache.size == 100
+
+    # Revalidation only downloads changed files
+    cache.path(url + "/a.fits", revalidate=True)
+    assert downloads["/a.fits"] == 1
+    files["/a.fits"] = b"A" * 100
+    assert cache.path(url + "/a.fits", revalidate=True) != path
+    assert downloads["/a.fits"] == 2
+
+    # Least recently used files are removed beyond max_size
+    cache.path(url + "/b.fits")
+    cache.path(url + "/a.fits")
+    cache.path(url + "/c.txt")
+    assert url + "/b.fits" not in cache
+    assert url + "/a.fits" in cache
+    assert cache.size <= 250
+
+    # The index is kept; offline, only cached files are used
+    offline = SpectrumCache(tmp_path / "cache", offline=True)
+    assert offline.path(url + "/c.txt").endswith(".txt")
+    with pytest.raises(AstroDBError, match="not in the spectrum cache"):
+        offline.path(url + "/b.fits")
+    with pytest.raises(AstroDBError, match="Unable to download"):
+        cache.path(url + "/missing.fits")
+
+    # Local copies are used when they exist
+    local = tmp_path / "local.fits"
+    local.write_bytes(b"local")
+    monkeypatch.setenv("SIMPLE_TEST_SPECTRA", str(tmp_path))
+    path = cached_spectrum_path(url + "/b.fits", "$SIMPLE_TEST_SPECTRA/local.fits", cache=offline)
+    assert path == str(local)
+    with pytest.raises(AstroDBError):
+        cached_spectrum_path(url + "/b.fits", "$SIMPLE_TEST_SPECTRA/missing.fits", cache=offline)
+
+    # Pinned files are kept until the pinned context exits
+    with cache.pinned():
+        cache.path(url + "/b.fits")
+        cache.path(url + "/copy_of_a.fits")
+        assert len(cache) == 4
+        assert cache.size == 400
+    assert cache.size <= 250
+    assert url + "/copy_of_a.fits" in cache
+    assert cache.file_hash(url + "/copy_of_a.fits") == hashlib.sha256(b"a" * 100).hexdigest()
+
+
+@pytest.mark.filterwarnings("ignore")
+def test_spectrum_plottable_cache(tmp_path, spectrum_server):
+    import numpy as np
+    import astropy.units as u
+    from specutils import Spectrum1D
+
+    url, files, downloads = spectrum_server
+    path = tmp_path / "spectrum.fits"
+    Spectrum1D(
+        spectral_axis=np.linspace(1, 2, 100) * u.micron, flux=np.ones(100) * u.Jy
+    ).write(path, format="tabular-fits")
+    files["/spectrum.fits"] = path.read_bytes()
+
+    cache = SpectrumCache(tmp_path / "cache")
+    formats = SpectrumFormats(tmp_path / "formats.json")
+    for _ in range(2):
+        assert spectrum_plottable(url + "/spectrum.fits", cache=cache, formats=formats)
+    assert downloads["/spectrum.fits"] == 1
+    assert url + "/spectrum.fits" in cache
+
+
+@pytest.fixture
+def spectra_db(tmp_path):
+    # Database whose Spectra are local files: a good spectrum, an all-NaN one,
+    # a file that is not a spectrum, and a URL that cannot be downloaded
+    import datetime
+    import numpy as np
+    import astropy.units as u
+    from astrodbkit2.astrodb import create_database, Database
+    from specutils import Spectrum1D
+
+    connection_string = "sqlite:///" + str(tmp_path / "spectra.sqlite")
+    create_database(connection_string)
+    db = Database(connection_string)
+
+    wavelength = np.linspace(1, 2, 2000) * u.micron
+    files = {}
+    for name, flux in [("good", np.sin(np.arange(2000))), ("all_nan", np.full(2000, np.nan))]:
+        files[name] = str(tmp_path / f"{name}.fits")
+        Spectrum1D(spectral_axis=wavelength, flux=flux * u.Jy).write(
+            files[name], format="tabular-fits"
+        )
+    files["bad"] = str(tmp_path / "bad.fits")
+    with open(files["bad"], "w") as f:
+        f.write("not a spectrum")
+    files["missing"] = "https://example.com/missing.fits"
+
+    with db.engine.begin() as conn:
+        conn.execute(db.Publications.insert().values(reference="Ref 1"))
+        conn.execute(db.Regimes.insert().values(regime="nir"))
+        conn.execute(
+            db.Sources.insert().values(
+                [{"source": name, "ra": 0, "dec": 0, "reference": "Ref 1"} for name in files]
+            )
+        )
+        conn.execute(
+            db.Spectra.insert().values(
+                [
+                    {
+                        "source": name,
+                        "spectrum": spectrum,
+                        "regime": "nir",
+                        "observation_date": datetime.datetime(2020, 1, 1),
+                        "reference": "Ref 1",
+                    }
+                    for name, spectrum in files.items()
+                ]
+            )
+        )
+    return db, files
+
+
+@pytest.mark.filterwarnings("ignore")
+def test_scan_spectra(tmp_path, spectra_db):
+    db, files = spectra_db
+    # The missing URL is not in the offline cache
+    cache = SpectrumCache(tmp_path / "cache", offline=True)
+    formats = SpectrumFormats(tmp_path / "formats.json")
+    report_file = str(tmp_path / "report.ecsv")
+    report = scan_spectra(db, workers=2, report=report_file, cache=cache, formats=formats)
+    results = {row["source"]: row for row in report}
+    assert results["good"]["status"] == "ok"
+    assert results["good"]["reader"] == "tabular-fits"
+    assert results["good"]["microns"]
+    assert results["good"]["nan_fraction"] == 0
+    assert results["good"]["n_points"] == 2000
+    assert results["all_nan"]["status"] == "all nan"
+    assert results["bad"]["status"] == "unreadable"
+    assert "tabular-fits" in results["bad"]["error"]
+    assert results["missing"]["status"] == "download failed"
+    assert formats.format(files["good"]) == "tabular-fits"
+
+    # Only the spectra that were not ok are checked again
+    checked = {row["source"]: row["checked"] for row in report}
+    with open(files["bad"], "wb") as f, open(files["good"], "rb") as good:
+        f.write(good.read())
+    report = scan_spectra(db, workers=1, report=report_file, cache=cache, formats=formats)
+    results = {row["source"]: row for row in report}
+    assert results["bad"]["status"] == "ok"
+    assert results["good"]["elapsed"] > 0
+    assert results["good"]["checked"] == checked["good"]
+    assert len(report) == 4
+
+    # Spectra removed from the database are removed from the report
+    with db.engine.begin() as conn:
+        conn.execute(db.Spectra.delete().where(db.Spectra.c.source == "missing"))
+    report = scan_spectra(db, report=report_file, cache=cache, formats=formats)
+    assert sorted(report["source"]) == ["all_nan", "bad", "good"]
+
+
+@pytest.mark.filterwarnings("ignore")
+def test_scan_spectra_changed_url(tmp_path, spectra_db, spectrum_server):
+    # A spectrum whose URL serves a new file is checked again
+    import datetime
+
+    db, files = spectra_db
+    url, served, downloads = spectrum_server
+    with open(files["good"], "rb") as f:
+        served["/spectrum.fits"] = f.read()
+    with db.engine.begin() as conn:
+        conn.execute(db.Spectra.delete())
+        conn.execute(
+            db.Spectra.insert().values(
+                source="good",
+                spectrum=url + "/spectrum.fits",
+                regime="nir",
+                observation_date=datetime.datetime(2020, 1, 1),
+                reference="Ref 1",
+            )
+        )
+    cache = SpectrumCache(tmp_path / "cache")
+    formats = SpectrumFormats(tmp_path / "formats.json")
+    report_file = str(tmp_path / "report.ecsv")
+    report = scan_spectra(db, report=report_file, cache=cache, formats=formats)
+    assert report["status"][0] == "ok"
+    assert report["sha256"][0] == hashlib.sha256(served["/spectrum.fits"]).hexdigest()
+
+    served["/spectrum.fits"] = b"not a spectrum any more"
+    report = scan_spectra(db, report=report_file, cache=cache, formats=formats)
+    assert report["status"][0] == "ok"
+    report = scan_spectra(db, report=report_file, cache=cache, formats=formats, revalidate=True)
+    assert report["status"][0] == "unreadable"
+    assert report["sha256"][0] == hashlib.sha256(served["/spectrum.fits"]).hexdigest()
+    assert downloads["/spectrum.fits"] == 2
+
+
+@pytest.mark.filterwarnings("ignore")
+def test_spectrum_formats(tmp_path, monkeypatch):
+    import numpy as np
+    import astropy.units as u
+    from specutils import Spectrum1D
+    import simple.utils.spectrum_formats as spectrum_formats
+
+    wavelength = np.linspace(1, 2, 50) * u.micron
+    paths = []
+    for i in range(2):
+        paths.append(str(tmp_path / f"spectrum_{i}.fits"))
+        Spectrum1D(spectral_axis=wavelength, flux=np.ones(50) * u.Jy).write(
+            paths[i], format="tabular-fits"
+        )
+    text = tmp_path / "spectrum.txt"
+    text.write_text("# wavelength flux\n1.0 2.0\n1.1 2.5\n")
+    assert fingerprint(paths[0]) == fingerprint(paths[1])
+    assert "1:TUNIT1=um" in fingerprint(paths[0])
+    assert fingerprint(text) == ".txt|header=1|columns=2|delimiter=space"
+
+    reads = []
+    read = spectrum_formats._read
+    monkeypatch.setattr(
+        spectrum_formats, "_read", lambda path, reader: reads.append(reader) or read(path, reader)
+    )
+
+    # Unknown files try the readers in order; the format that worked is learned
+    formats = SpectrumFormats(tmp_path / "formats.json")
+    spectrum = formats.read(paths[0], spectrum="https://example.com/spectrum_0.fits")
+    assert len(spectrum.flux) == 50
+    assert reads[-1] == "tabular-fits" and len(reads) > 1
+    assert formats.format("https://example.com/spectrum_0.fits") == "tabular-fits"
+
+    # Files with the same fingerprint are read with one parse
+    reads.clear()
+    formats.read(paths[1])
+    assert reads == ["tabular-fits"]
+
+    # The learned formats are saved
+    formats.save()
+    reloaded = SpectrumFormats(tmp_path / "formats.json")
+    assert reloaded.readers_of(paths[0], "https://example.com/spectrum_0.fits")[0] == "tabular-fits"
+    assert len(reloaded) == 1
+
+    with pytest.raises(AstroDBError, match="Unable to read"):
+        formats.read(str(tmp_path / "missing.fits"))
+
+    # Explicit instances are not kept alive to be saved at exit
+    import gc
+    import weakref
+
+    reference = weakref.ref(reloaded)
+    del reloaded
+    gc.collect()
+    assert reference() is None
+
+
+def test_envelope():
+    import numpy as np
+
+    wavelength = np.arange(10.0)
+    flux = np.array([1, 5, 2, 8, np.nan, 3, 0, 4, 9, 6])
+    wave_bins, flux_min, flux_max = envelope(wavelength[::-1], flux[::-1], 3)
+    assert np.allclose(wave_bins, [1, 14 / 3, 8])
+    assert np.allclose(flux_min, [1, 0, 4])
+    assert np.allclose(flux_max, [5, 8, 9])
+    # Short spectra are kept as they are
+    wave_bins, flux_min, flux_max = envelope(wavelength, flux, 20)
+    assert len(wave_bins) == 9
+    assert np.array_equal(flux_min, flux_max)
+
+
+@pytest.mark.filterwarnings("ignore")
+def test_spectrum_previews(tmp_path, spectra_db):
+    import numpy as np
+
+    db, files = spectra_db
+    cache = SpectrumCache(tmp_path / "cache", offline=True)
+    formats = SpectrumFormats(tmp_path / "formats.json")
+    previews = SpectrumPreviews(tmp_path / "previews.npz")
+    build_previews(db, previews, cache=cache, formats=formats)
+    # The bad file and the missing URL have no preview
+    assert len(previews) == 2
+
+    row = db.query(db.Spectra).filter(db.Spectra.c.source == "good").table()[0]
+    wavelength, flux_min, flux_max = previews.preview(row, resolution=200)
+    assert len(wavelength) == 256
+    assert wavelength.dtype == np.float32
+    assert 1 <= wavelength.min() and wavelength.max() <= 2
+    assert np.all(flux_min <= flux_max)
+    assert np.isclose(flux_max.max(), np.sin(np.arange(2000)).max())
+    assert previews.flux_unit(row) == "Jy"
+    assert len(previews.preview(row, resolution=5000)[0]) == 1024
+    assert len(previews.preview(row, resolution=1)[0]) == 64
+    all_nan = db.query(db.Spectra).filter(db.Spectra.c.source == "all_nan").table()[0]
+    assert len(previews.preview(all_nan)[0]) == 0
+
+    # Reloaded from the npz file; only new or changed rows are read again
+    reloaded = SpectrumPreviews(tmp_path / "previews.npz")
+    assert sorted(reloaded.keys()) == sorted(previews.keys())
+    assert np.array_equal(reloaded.preview(row)[1], flux_min)
+    with open(files["bad"], "wb") as f, open(files["good"], "rb") as good:
+        f.write(good.read())
+    with db.engine.begin() as conn:
+        conn.execute(db.Spectra.delete().where(db.Spectra.c.source == "all_nan"))
+    reloaded.remove(next(key for key in reloaded.keys() if key.startswith("good")))
+    build_previews(db, reloaded, cache=cache, formats=formats)
+    assert sorted(key.split("|")[0] for key in reloaded.keys()) == ["bad", "good"]
+    with pytest.raises(KeyError):
+        reloaded.preview(all_nan)
+
+
+@pytest.mark.filterwarnings("ignore")
+@pytest.mark.parametrize("memmap", [False, True])
+def test_load_spectrum_arrays(tmp_path, memmap):
+    import mmap
+    import numpy as np
+    import astropy.units as u
+    from astropy.io import fits
+    from specutils import Spectrum1D
+
+    header = fits.Header()
+    header["OBJECT"] = "Fake 1"
+    header["DATE-OBS"] = "2020-01-01"
+    spectrum_table = {
+        "wavelength": np.linspace(1, 2, 1000),
+        "flux": np.arange(1000.0),
+        "flux_uncertainty": np.full(1000, 0.1),
+    }
+    convert_to_fits({"fits_data_dir": f"{tmp_path}/"}, spectrum_table, header, memmap=memmap)
+    filename = str(tmp_path / "Fake 1_2020-01-01.fits")
+
+    arrays, units = load_spectrum_arrays(filename)
+    assert list(arrays) == ["wavelength", "flux", "flux_uncertainty"]
+    assert np.array_equal(arrays["flux"][100:200], spectrum_table["flux"][100:200])
+    assert units["wavelength"] == u.um and units["flux"] == u.Jy
+    assert not arrays["flux"].flags.writeable
+    if memmap:
+        # Contiguous views of the memory map of the file
+        assert arrays["flux"].flags.c_contiguous
+        base = arrays["flux"]
+        while base.base is not None and not isinstance(base.base, mmap.mmap):
+            base = base.base
+        assert isinstance(base.base, mmap.mmap)
+
+    # Still readable as a tabular-fits spectrum
+    spectrum = Spectrum1D.read(filename, format="tabular-fits")
+    assert np.allclose(spectrum.spectral_axis.to(u.um).value, spectrum_table["wavelength"])
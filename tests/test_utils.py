@@ -1,16 +1,43 @@
+import gc
 import pytest
 import sys
-from astropy.table import Table
+import weakref
+import numpy as np
+import sqlalchemy as sa
+import astropy.units as u
+from astropy.coordinates import SkyCoord
+from astropy.table import MaskedColumn, Table
+from astrodbkit2.astrodb import Database, create_database
 from astrodb_scripts.utils import (
     AstroDBError,
 )
 sys.path.append("./")
 from simple.utils.spectral_types import (
+    convert_spt_code_to_string_to_code,
+    convert_spt_codes_to_strings,
     convert_spt_string_to_code,
+    convert_spt_strings_to_codes,
     ingest_spectral_types,
+    ingest_spectral_types_table,
 )
 from simple.utils.companions import ingest_companion_relationships
 from simple.utils.astrometry import ingest_parallaxes, ingest_proper_motions
+from simple.utils.resolver import (
+    SourceResolver,
+    normalize_designation,
+    normalize_name,
+)
+from simple.utils.spatial import (
+    MAX_EPOCHS,
+    SourceIndex,
+    cone_search,
+    cone_search_many,
+    propagate_positions,
+    source_index,
+)
+from simple.utils.crossmatch import crossmatch
+from simple.utils.adopted_summary import AdoptedSummary, adopted_summary
+from simple.utils.adopted import recompute_adopted
 
 
 # Create fake astropy Table of data to load
@@ -67,6 +94,33 @@ def test_convert_spt_string_to_code():
     assert convert_spt_string_to_code(["Y2pec"]) == [92]
 
 
+def test_convert_spt_strings_to_codes():
+    spectral_types = [
+        "sdM4",
+        "M4pec",
+        "L2:",
+        ">L9",
+        "≥L9",
+        "L0blue",
+        "Lpec",
+        "null",
+        "",
+    ]
+    codes = convert_spt_strings_to_codes(np.array(spectral_types * 3).reshape(3, -1))
+    assert codes.shape == (3, len(spectral_types))
+    assert codes[2, :-1].tolist() == [64, 64, 72, 79, 79, 70, 70, 0]
+    assert np.isnan(codes[2, -1])
+
+    masked = convert_spt_strings_to_codes(
+        MaskedColumn(["L1", "T2"], mask=[True, False])
+    )
+    assert np.isnan(masked[0]) and masked[1] == 82
+
+    strings = convert_spt_codes_to_strings(np.array([65.5, 70, 84.5, 65.5]), decimals=1)
+    assert strings.tolist() == ["M5.5", "L0.0", "T4.5", "M5.5"]
+    assert convert_spt_code_to_string_to_code(91.0, decimals=0) == ["Y1"]
+
+
 def test_ingest_parallaxes(temp_db, t_plx):
     # Test ingest of parallax data
     ingest_parallaxes(
@@ -236,3 +290,787 @@ def test_companion_relationships(temp_db):
             temp_db, "Fake 1", "Bad Companion", "Sibling", projected_separation_error=-5
         )
     assert "cannot be negative" in str(error_message.value)
+
+
+@pytest.mark.parametrize(
+    "name, normalized",
+    [
+        ("2MASS J00361617+1821104", "2MASSJ00361617+1821104"),
+        ("2MASSW J0036159+182110", "2MASSJ0036159+182110"),
+        ("2massi_j0036159+182110", "2MASSJ0036159+182110"),
+        ("WISEA J154045.67-510139.3", "WISEJ154045.67-510139.3"),
+        ("SDSSp J053951.99−005902.0", "SDSSJ053951.99-005902.0"),
+        ("Gl 229 B", "GL229B"),
+    ],
+)
+def test_normalize_name(name, normalized):
+    assert normalize_name(name) == normalized
+
+
+@pytest.mark.parametrize(
+    "name, designation",
+    [
+        ("2MASS J00001354+2554180", "J00001354+2554180"),
+        ("WISEA J000013.54+255418.0", "J00001354+2554180"),
+        ("SDSSp J053951.99−005902.0", "J05395199-0059020"),
+        ("2MASS J0000+2554", "J0000+2554"),
+        ("Gl 229 B", None),
+    ],
+)
+def test_normalize_designation(name, designation):
+    assert normalize_designation(name) == designation
+
+
+def test_source_resolver_designations(astrometry_db):
+    db = astrometry_db
+    with db.engine.begin() as conn:
+        conn.execute(
+            db.Sources.insert().values(reference="Ref 1"),
+            [
+                {"source": "2MASS J00001354+2554180", "shortname": "0000+2554"},
+                {"source": "2MASS J00005859+2554010", "shortname": None},
+            ],
+        )
+        conn.execute(
+            db.Names.insert().values(source="2MASS J00001354+2554180"),
+            [{"other_name": "WISE J000013.54+255418.0"}, {"other_name": "Ross 1a"}],
+        )
+    resolver = SourceResolver(db)
+
+    # Designations match up to the precision of the shorter one
+    assert resolver.resolve("2MASS J0000135+255418") == ["2MASS J00001354+2554180"]
+    assert resolver.resolve("WISEA J0000135+2554") == ["2MASS J00001354+2554180"]
+    assert resolver.resolve("2MASS J0000+2554") == [
+        "2MASS J00001354+2554180",
+        "2MASS J00005859+2554010",
+    ]
+    assert resolver.resolve("2MASS J00001355+2554180") == []
+
+    # Substring search over names, shortnames and other names, ignoring case
+    assert resolver.search("ross 1") == ["2MASS J00001354+2554180"]
+    assert resolver.search("0000+2554") == ["2MASS J00001354+2554180"]
+    assert resolver.search("j0000") == [
+        "2MASS J00001354+2554180",
+        "2MASS J00005859+2554010",
+    ]
+    assert resolver.search("ke") == ["Fake 1", "Fake 2", "Fake 3"]
+
+    # Names added after the trigram index is built are found
+    with db.engine.begin() as conn:
+        conn.execute(db.Names.insert().values(source="Fake 1", other_name="Ross 12"))
+    assert resolver.search("ross 1") == ["2MASS J00001354+2554180", "Fake 1"]
+    resolver.stop()
+
+
+def test_source_resolver(temp_db):
+    resolver = SourceResolver(temp_db)
+    assert resolver.resolve("Fake 1") == ["Fake 1"]
+    assert resolver.resolve(" fake  1") == ["Fake 1"]
+    assert resolver.resolve("Not a source") == []
+    assert resolver.resolve_many(["apple", "ORANGE"]) == [["apple"], ["orange"]]
+
+    # Position fallback; apple and the Fake sources share coordinates
+    assert resolver.resolve("Not a source", ra=90.0673755, dec=19.352889) == ["orange"]
+    assert len(resolver.resolve("Not a source", ra=9.0673755, dec=18.352889)) == 4
+
+    # New sources and names are picked up as they are ingested
+    with temp_db.engine.begin() as conn:
+        conn.execute(
+            temp_db.Sources.insert().values(
+                source="2MASS J00361617+1821104",
+                ra=9.067,
+                dec=18.353,
+                reference="Ref 1",
+            )
+        )
+        conn.execute(
+            temp_db.Names.insert(),
+            [
+                {
+                    "source": "2MASS J00361617+1821104",
+                    "other_name": "2MASS J00361617+1821104",
+                },
+                {"source": "2MASS J00361617+1821104", "other_name": "LSPM J0036+1821"},
+            ],
+        )
+    assert resolver.resolve("2MASSW J00361617+1821104") == ["2MASS J00361617+1821104"]
+    assert resolver.resolve("lspm j0036+1821") == ["2MASS J00361617+1821104"]
+
+    # Rows of a failed ingest are not added
+    with pytest.raises(RuntimeError):
+        with temp_db.engine.begin() as conn:
+            conn.execute(
+                temp_db.Sources.insert().values(
+                    source="Rolled back", ra=0, dec=0, reference="Ref 1"
+                )
+            )
+            assert resolver.resolve("Rolled back") == []
+            raise RuntimeError("ingest failed")
+    assert resolver.resolve("Rolled back") == []
+
+    # Deletes rebuild the resolver
+    with temp_db.engine.begin() as conn:
+        conn.execute(
+            temp_db.Names.delete().where(
+                temp_db.Names.c.source == "2MASS J00361617+1821104"
+            )
+        )
+        conn.execute(
+            temp_db.Sources.delete().where(
+                temp_db.Sources.c.source == "2MASS J00361617+1821104"
+            )
+        )
+    assert resolver.resolve("LSPM J0036+1821") == []
+    resolver.stop()
+
+
+# In-memory database with a few sources and publications, one per test
+@pytest.fixture
+def astrometry_db():
+    db = Database("sqlite://")
+    with db.engine.begin() as conn:
+        conn.execute(
+            db.Publications.insert(),
+            [{"reference": "Ref 1"}, {"reference": "Ref 2"}, {"reference": "Burn08"}],
+        )
+        conn.execute(
+            db.Sources.insert(),
+            [
+                {"source": f"Fake {i}", "ra": i, "dec": i, "reference": "Ref 1"}
+                for i in [1, 2, 3]
+            ],
+        )
+        conn.execute(
+            db.Parallaxes.insert(),
+            [
+                {
+                    "source": "Fake 1",
+                    "parallax": 100.0,
+                    "parallax_error": 0.5,
+                    "reference": "Ref 1",
+                    "adopted": True,
+                },
+                {
+                    "source": "Fake 2",
+                    "parallax": 100.0,
+                    "parallax_error": 0.5,
+                    "reference": "Ref 1",
+                    "adopted": None,
+                },
+            ],
+        )
+    return db
+
+
+@pytest.mark.parametrize("bulk", [False, True])
+def test_ingest_parallaxes_bulk(astrometry_db, bulk):
+    t = Table(
+        {
+            "source": ["Fake 1", "Fake 1", "Fake 2", "Fake 3", "Fake 3", "Fake 3"],
+            "plx": [101.0, 102.0, 103.0, 104.0, 105.0, 106.0],
+            "plx_err": [0.3, 0.1, 0.1, 0.5, 0.2, 1.0],
+            "plx_ref": ["Ref 2", "Burn08", "Ref 2", "Ref 1", "Ref 1", "Ref 2"],
+        }
+    )
+
+    # Both paths give the same adopted flags
+    db = astrometry_db
+    resolver = SourceResolver(db)
+    ingest_parallaxes(
+        db,
+        t["source"],
+        t["plx"],
+        t["plx_err"],
+        t["plx_ref"],
+        resolver=resolver,
+        bulk=bulk,
+    )
+    resolver.stop()
+    rows = db.query(
+        db.Parallaxes.c.source, db.Parallaxes.c.reference, db.Parallaxes.c.adopted
+    ).all()
+    assert sorted(tuple(row) for row in rows) == [
+        ("Fake 1", "Burn08", True),
+        ("Fake 1", "Ref 1", False),
+        ("Fake 1", "Ref 2", False),
+        ("Fake 2", "Ref 1", None),
+        ("Fake 2", "Ref 2", None),
+        ("Fake 3", "Ref 1", True),
+        ("Fake 3", "Ref 2", False),
+    ]
+
+    with pytest.raises(AstroDBError):
+        ingest_parallaxes(db, ["Not a source"], [1.0], [0.1], "Ref 1", bulk=bulk)
+
+
+@pytest.mark.parametrize("bulk", [False, True])
+def test_ingest_parallaxes_two_adopted(astrometry_db, bulk):
+    # Both paths unset the first adopted row in primary key order
+    db = astrometry_db
+    with db.engine.begin() as conn:
+        conn.execute(
+            db.Parallaxes.insert(),
+            [
+                {
+                    "source": "Fake 1",
+                    "parallax": 100.0,
+                    "parallax_error": 0.4,
+                    "reference": "Burn08",
+                    "adopted": True,
+                }
+            ],
+        )
+    ingest_parallaxes(db, ["Fake 1"], [101.0], [0.1], "Ref 2", bulk=bulk)
+    rows = db.query(db.Parallaxes.c.reference, db.Parallaxes.c.adopted).filter(
+        db.Parallaxes.c.source == "Fake 1"
+    )
+    assert sorted(tuple(row) for row in rows.all()) == [
+        ("Burn08", False),
+        ("Ref 1", True),
+        ("Ref 2", True),
+    ]
+
+
+@pytest.fixture
+def spectral_types_db(astrometry_db):
+    db = astrometry_db
+    with db.engine.begin() as conn:
+        conn.execute(db.Regimes.insert(), [{"regime": "nir"}, {"regime": "optical"}])
+        conn.execute(
+            db.SpectralTypes.insert(),
+            [
+                {
+                    "source": "Fake 1",
+                    "spectral_type_string": "L1",
+                    "spectral_type_code": 71.0,
+                    "spectral_type_error": 1.0,
+                    "regime": "nir",
+                    "adopted": True,
+                    "reference": "Ref 1",
+                },
+                {
+                    "source": "Fake 2",
+                    "spectral_type_string": "T5",
+                    "spectral_type_code": 85.0,
+                    "spectral_type_error": 0.5,
+                    "regime": "nir",
+                    "adopted": True,
+                    "reference": "Ref 1",
+                },
+            ],
+        )
+    return db
+
+
+@pytest.mark.parametrize("bulk", [False, True])
+def test_ingest_spectral_types_table(spectral_types_db, bulk):
+    t = Table(
+        {
+            "source": ["Fake 1", "Fake 1", "Fake 2", "Fake 3", "Fake 2"],
+            "spectral_type": ["L2", "L1.5", "T6", "M9", "T5"],
+            "spectral_type_error": [0.5, 0.5, 1.0, 0.5, 0.5],
+            "regime": ["nir", "optical", "optical", "nir", "nir"],
+            "reference": ["Ref 2", "Ref 2", "Ref 2", "Ref 2", "Ref 1"],
+        }
+    )
+
+    # The table version gives the same rows as ingest_spectral_types
+    db = spectral_types_db
+    if bulk:
+        ingested = ingest_spectral_types_table(db, t)
+        assert list(ingested["status"]) == [
+            "added",
+            "added",
+            "added",
+            "added",
+            "skipped",
+        ]
+        assert ingested.meta["counts"] == {
+            "Ref 2": {"added": 4, "skipped": 0, "failed": 0},
+            "Ref 1": {"added": 0, "skipped": 1, "failed": 0},
+        }
+    else:
+        ingest_spectral_types(
+            db,
+            t["source"],
+            t["spectral_type"],
+            t["reference"],
+            t["regime"],
+            spectral_type_error=t["spectral_type_error"],
+        )
+    rows = db.query(
+        db.SpectralTypes.c.source,
+        db.SpectralTypes.c.spectral_type_code,
+        db.SpectralTypes.c.regime,
+        db.SpectralTypes.c.reference,
+        db.SpectralTypes.c.adopted,
+    ).all()
+    assert sorted(tuple(row) for row in rows) == [
+        ("Fake 1", 71.0, "nir", "Ref 1", False),
+        ("Fake 1", 71.5, "optical", "Ref 2", None),
+        ("Fake 1", 72.0, "nir", "Ref 2", True),
+        ("Fake 2", 85.0, "nir", "Ref 1", True),
+        ("Fake 2", 86.0, "optical", "Ref 2", None),
+        ("Fake 3", 69.0, "nir", "Ref 2", None),
+    ]
+
+
+def test_ingest_spectral_types_table_errors(spectral_types_db):
+    # Failing rows are reported, and nothing is added unless raise_error=False
+    t_bad = Table(
+        {
+            "source": ["Fake 3", "Not a source", "Fake 3", "Fake 3"],
+            "spectral_type": ["L0", "L0", "L0", "L0"],
+            "regime": ["optical", "nir", "mir", "nir"],
+            "reference": ["Ref 1", "Ref 1", "Ref 1", "Not a ref"],
+        }
+    )
+    db = spectral_types_db
+    with pytest.raises(AstroDBError):
+        ingest_spectral_types_table(db, t_bad)
+    assert db.query(db.SpectralTypes).count() == 2
+
+    ingested = ingest_spectral_types_table(db, t_bad, raise_error=False)
+    assert list(ingested["status"]) == [
+        "added",
+        "source not found",
+        "unknown regime",
+        "unknown reference",
+    ]
+    assert ingested.meta["counts"]["Ref 1"] == {"added": 1, "skipped": 0, "failed": 2}
+    assert db.query(db.SpectralTypes).count() == 3
+
+
+def test_cone_search():
+    db = Database("sqlite://")
+    positions = {
+        "Wrap low": (0.0005, 10.0),
+        "Wrap high": (359.9995, 10.0),
+        "Pole 1": (0.0, 89.9999),
+        "Pole 2": (180.0, 89.9999),
+        "Far": (120.0, -30.0),
+        "No position": (None, None),
+    }
+    with db.engine.begin() as conn:
+        conn.execute(db.Publications.insert().values(reference="Ref 1"))
+        conn.execute(
+            db.Sources.insert(),
+            [
+                {"source": name, "ra": ra, "dec": dec, "reference": "Ref 1"}
+                for name, (ra, dec) in positions.items()
+            ],
+        )
+
+    index = SourceIndex(db)
+    assert len(index) == 5
+
+    # RA wraps at 0/360 degrees: the two sources are 3.5 arcsec apart
+    results = cone_search(db, 0.0, 10.0, 5 * u.arcsec, index=index)
+    assert sorted(results["source"]) == ["Wrap high", "Wrap low"]
+    assert np.allclose(results["separation"], 1.77, atol=0.01)
+
+    # Both pole sources are within 1 arcsec of the pole, whatever their RA
+    results = cone_search(db, 270.0, 90.0, 1 * u.arcsec, index=index)
+    assert sorted(results["source"]) == ["Pole 1", "Pole 2"]
+
+    # Batched search; separations match astropy, nearest first
+    ra, dec = [359.9999, 120.001, 45.0], [10.0, -30.0, 0.0]
+    results = cone_search_many(db, ra, dec, 0.01, index=index)
+    assert list(results["index"]) == [0, 0, 1]
+    assert list(results["source"]) == ["Wrap high", "Wrap low", "Far"]
+    targets = SkyCoord(ra=ra, dec=dec, unit="deg")[results["index"]]
+    expected = SkyCoord(ra=results["ra"], dec=results["dec"], unit="deg").separation(
+        targets
+    )
+    assert np.allclose(results["separation"], expected.arcsec, atol=1e-6)
+
+    # Inserted sources are found, deleted ones are not
+    with db.engine.begin() as conn:
+        conn.execute(
+            db.Sources.insert().values(
+                source="New", ra=45.0, dec=0.0, reference="Ref 1"
+            )
+        )
+    assert list(cone_search(db, 45.0, 0.0, 1 * u.arcsec, index=index)["source"]) == [
+        "New"
+    ]
+    with db.engine.begin() as conn:
+        conn.execute(db.Sources.delete().where(db.Sources.c.source == "New"))
+    assert len(cone_search(db, 45.0, 0.0, 1 * u.arcsec, index=index)) == 0
+    index.stop()
+
+
+def test_source_index_cache():
+    db = Database("sqlite://")
+    with db.engine.begin() as conn:
+        conn.execute(db.Publications.insert().values(reference="Ref 1"))
+        conn.execute(
+            db.Sources.insert().values(source="A", ra=1.0, dec=1.0, reference="Ref 1")
+        )
+
+    epochs = [None, 2010.0, 2020.5, 2016.0, 2000.0]
+    indexes = [source_index(db, epoch) for epoch in epochs]
+    assert source_index(db, 2000.0) is indexes[-1]
+    # Only the most recently used epochs are kept; the others stop listening
+    assert MAX_EPOCHS < len(epochs)
+    assert source_index(db, None) is not indexes[0]
+    with db.engine.begin() as conn:
+        conn.execute(
+            db.Sources.insert().values(source="B", ra=2.0, dec=2.0, reference="Ref 1")
+        )
+    assert len(indexes[0]) == 1
+    assert len(source_index(db, None)) == 2
+
+    # The shared indexes do not keep the database alive
+    db_ref = weakref.ref(db)
+    del db, indexes
+    gc.collect()
+    assert db_ref() is None
+
+
+def test_crossmatch(astrometry_db):
+    db = astrometry_db
+    with db.engine.begin() as conn:
+        conn.execute(
+            db.Sources.insert().values(
+                source="Fake 2B", ra=2.001, dec=2.0, reference="Ref 1"
+            )
+        )
+        conn.execute(db.Names.insert().values(source="Fake 2B", other_name="Fake 2 B"))
+
+    t = Table(
+        {
+            "name": ["fake 1", "Other 1", "Fake 2 b", "Other 2", "Other 3", "Fake 3"],
+            "ra": [1.0, 1.0, 2.0, 2.0, 50.0, np.nan],
+            "dec": [1.0, 1.0, 2.0, 2.0, 50.0, np.nan],
+        }
+    )
+    results = crossmatch(db, t, "ra", "dec", 10 * u.arcsec, name_col="name")
+    assert list(results["name"]) == list(t["name"])
+    assert list(results["db_source"]) == [
+        "Fake 1",
+        "Fake 1",
+        "Fake 2B",
+        "Fake 2",
+        "",
+        "Fake 3",
+    ]
+    assert list(results["match"]) == [
+        "name",
+        "position",
+        "name",
+        "ambiguous",
+        "no match",
+        "name",
+    ]
+    assert list(results["n_candidates"]) == [1, 1, 2, 2, 0, 0]
+    assert np.isclose(results["separation"][2], 3.6, atol=0.01)
+    assert np.isnan(results["separation"][5])
+
+    # Without names, the nearest of several sources is an ambiguous match
+    results = crossmatch(db, t, "ra", "dec", 10 * u.arcsec)
+    assert list(results["match"]) == [
+        "position",
+        "position",
+        "ambiguous",
+        "ambiguous",
+        "no match",
+        "no match",
+    ]
+
+
+def test_propagate_positions(astrometry_db):
+    db = astrometry_db
+    with db.engine.begin() as conn:
+        conn.execute(
+            db.Sources.insert().values(reference="Ref 1"),
+            [
+                {"source": "Fast", "ra": 359.9999, "dec": 0.0, "epoch": 2010.0},
+                {"source": "Polar", "ra": 0.0, "dec": 89.9999, "epoch": None},
+            ],
+        )
+        conn.execute(
+            db.ProperMotions.insert(),
+            [
+                # Adopted rows are used, or the only row of a source
+                {
+                    "source": source,
+                    "mu_ra": mu_ra,
+                    "mu_dec": mu_dec,
+                    "adopted": adopted,
+                    "reference": reference,
+                }
+                for source, mu_ra, mu_dec, adopted, reference in [
+                    ("Fast", 5000.0, 0.0, True, "Ref 1"),
+                    ("Fast", 0.0, 0.0, False, "Ref 2"),
+                    ("Polar", 0.0, 1000.0, None, "Ref 1"),
+                ]
+            ],
+        )
+
+    positions = propagate_positions(db, 2020.0)
+    positions.add_index("source")
+    # 5 arcsec/yr for 10 years, across RA = 0
+    fast = positions.loc["Fast"]
+    assert np.isclose(fast["ra"], 50 / 3600 - 0.0001, atol=1e-9)
+    assert fast["epoch"] == 2010.0
+    # The default epoch is 2000; moving 20 arcsec north crosses the pole
+    polar = positions.loc["Polar"]
+    assert np.isclose(polar["ra"], 180.0) and np.isclose(
+        polar["dec"], 90 - 19.64 / 3600
+    )
+    # Sources without proper motions do not move
+    assert positions.loc["Fake 1"]["ra"] == 1.0
+    assert np.isnan(positions.loc["Fake 1"]["mu_ra"])
+
+    # Positional matches at another epoch use the moved positions
+    assert len(cone_search(db, 50 / 3600, 0.0, 1 * u.arcsec)) == 0
+    results = cone_search(db, 50 / 3600, 0.0, 1 * u.arcsec, epoch=2020.0)
+    assert list(results["source"]) == ["Fast"]
+    resolver = SourceResolver(db)
+    found = resolver.resolve(
+        "Not a source", ra=50 / 3600, dec=0.0, search_radius=1 * u.arcsec, epoch=2020.0
+    )
+    assert found == ["Fast"]
+    resolver.stop()
+
+    # Proper motion changes are picked up
+    with db.engine.begin() as conn:
+        conn.execute(
+            db.ProperMotions.update()
+            .where(db.ProperMotions.c.source == "Fast")
+            .values(mu_ra=0.0)
+        )
+    assert len(cone_search(db, 50 / 3600, 0.0, 1 * u.arcsec, epoch=2020.0)) == 0
+
+
+def test_adopted_summary(astrometry_db):
+    db = astrometry_db
+    with db.engine.begin() as conn:
+        conn.execute(
+            db.SpectralTypes.insert(),
+            [
+                {
+                    "source": "Fake 1",
+                    "spectral_type_string": spt,
+                    "spectral_type_code": code,
+                    "adopted": adopted,
+                    "reference": reference,
+                }
+                for spt, code, adopted, reference in [
+                    ("L1", 71.0, False, "Ref 1"),
+                    ("L2", 72.0, True, "Ref 2"),
+                ]
+            ],
+        )
+
+    summary = AdoptedSummary(db)
+    table = summary.table()
+    assert list(table["source"]) == ["Fake 1", "Fake 2", "Fake 3"]
+    # The adopted row, or the only row of a source
+    fake_1 = summary.row("Fake 1")
+    assert fake_1["parallax"] == 100.0
+    assert np.isclose(fake_1["distance"], 10.0) and np.isclose(
+        fake_1["distance_error"], 0.05
+    )
+    assert fake_1["spectral_type_string"] == "L2"
+    assert fake_1["spectral_type_reference"] == "Ref 2"
+    assert summary.row("Fake 2")["parallax"] == 100.0
+    assert summary.row("Fake 3")["parallax"] is None
+    assert table["mu_ra"].mask.all()
+    assert summary.row("Not a source") is None
+
+    # Ingests are followed: Fake 2 now has two parallaxes and none adopted
+    ingest_parallaxes(
+        db, ["Fake 2", "Fake 3"], [50.0, 20.0], [0.1, 0.1], ["Ref 2", "Ref 1"]
+    )
+    assert summary.row("Fake 2")["parallax"] is None
+    assert summary.row("Fake 3")["distance"] == 50.0
+    with db.engine.begin() as conn:
+        conn.execute(
+            db.Sources.insert().values(
+                source="Fake 4", ra=4.0, dec=4.0, reference="Ref 1"
+            )
+        )
+        conn.execute(db.Sources.delete().where(db.Sources.c.source == "Fake 1"))
+    assert list(summary.table(["Fake 3", "Fake 4"])["ra"]) == [3.0, 4.0]
+    assert summary.row("Fake 1") is None
+    assert len(summary) == 3
+
+    # Rolled back changes are dropped
+    with pytest.raises(RuntimeError):
+        with db.engine.begin() as conn:
+            conn.execute(db.Sources.delete().where(db.Sources.c.source == "Fake 4"))
+            raise RuntimeError("failed ingest")
+    assert summary.row("Fake 4")["ra"] == 4.0
+    summary.stop()
+
+    # The shared summary does not keep the database alive
+    db = Database("sqlite://")
+    assert adopted_summary(db) is adopted_summary(db)
+    db_ref = weakref.ref(db)
+    del db
+    gc.collect()
+    assert db_ref() is None
+
+
+def test_adopted_summary_not_saved(tmp_path):
+    # The summary writes nothing to the database file
+    connection_string = f"sqlite:///{tmp_path / 'summary.sqlite'}"
+    create_database(connection_string)
+    db = Database(connection_string)
+    with db.engine.begin() as conn:
+        conn.execute(db.Publications.insert().values(reference="Ref 1"))
+        conn.execute(
+            db.Sources.insert().values(
+                source="Fake 1", ra=1.0, dec=1.0, reference="Ref 1"
+            )
+        )
+    summary = AdoptedSummary(db)
+    assert len(summary.table()) == 1
+    summary.stop()
+
+    other = Database(connection_string)
+    assert "AdoptedSummary" not in sa.inspect(other.engine).get_table_names()
+    assert "AdoptedSummary" not in other.inventory("Fake 1")
+    assert list(other.inventory("Fake 1")) == ["Sources"]
+
+
+def test_recompute_adopted(astrometry_db):
+    db = astrometry_db
+    with db.engine.begin() as conn:
+        conn.execute(
+            db.Parallaxes.insert(),
+            [
+                # A better parallax for Fake 1, and a source with two adopted parallaxes
+                {
+                    "source": "Fake 1",
+                    "parallax": 101.0,
+                    "parallax_error": 0.2,
+                    "reference": "Ref 2",
+                    "adopted": False,
+                },
+                {
+                    "source": "Fake 3",
+                    "parallax": 102.0,
+                    "parallax_error": None,
+                    "reference": "Ref 1",
+                    "adopted": True,
+                },
+                {
+                    "source": "Fake 3",
+                    "parallax": 103.0,
+                    "parallax_error": 0.9,
+                    "reference": "Ref 2",
+                    "adopted": True,
+                },
+            ],
+        )
+        conn.execute(
+            db.ProperMotions.insert(),
+            [
+                {
+                    "source": "Fake 1",
+                    "mu_ra": 1.0,
+                    "mu_ra_error": 0.1,
+                    "mu_dec": 1.0,
+                    "mu_dec_error": 0.5,
+                    "reference": "Ref 1",
+                    "adopted": True,
+                },
+                {
+                    "source": "Fake 1",
+                    "mu_ra": 1.0,
+                    "mu_ra_error": 0.3,
+                    "mu_dec": 1.0,
+                    "mu_dec_error": 0.3,
+                    "reference": "Ref 2",
+                    "adopted": False,
+                },
+            ],
+        )
+
+    def flags():
+        rows = db.query(
+            db.Parallaxes.c.source, db.Parallaxes.c.reference, db.Parallaxes.c.adopted
+        ).all()
+        return sorted(tuple(row) for row in rows)
+
+    before = flags()
+    changes = recompute_adopted(db, dry_run=True)
+    assert flags() == before
+    # Smallest error first, null errors last; a null flag counts as not adopted
+    assert [tuple(row) for row in changes] == [
+        ("Parallaxes", "Fake 1", "Ref 1", "", True, False),
+        ("Parallaxes", "Fake 1", "Ref 2", "", False, True),
+        ("Parallaxes", "Fake 2", "Ref 1", "", None, True),
+        ("Parallaxes", "Fake 3", "Ref 1", "", True, False),
+        ("ProperMotions", "Fake 1", "Ref 1", "", True, False),
+        ("ProperMotions", "Fake 1", "Ref 2", "", False, True),
+    ]
+
+    # Only some sources and tables, with another rule
+    changes = recompute_adopted(
+        db,
+        tables=["Parallaxes"],
+        sources=["Fake 3"],
+        rules={"Parallaxes": ["parallax"]},
+    )
+    assert list(changes["reference"]) == ["Ref 2"]
+    assert flags() == [
+        ("Fake 1", "Ref 1", True),
+        ("Fake 1", "Ref 2", False),
+        ("Fake 2", "Ref 1", None),
+        ("Fake 3", "Ref 1", True),
+        ("Fake 3", "Ref 2", False),
+    ]
+
+    recompute_adopted(db)
+    assert flags() == [
+        ("Fake 1", "Ref 1", False),
+        ("Fake 1", "Ref 2", True),
+        ("Fake 2", "Ref 1", True),
+        ("Fake 3", "Ref 1", False),
+        ("Fake 3", "Ref 2", True),
+    ]
+    assert len(recompute_adopted(db, dry_run=True)) == 0
+
+
+def test_recompute_adopted_regimes(spectral_types_db):
+    # One spectral type is adopted in each regime of a source
+    db = spectral_types_db
+    with db.engine.begin() as conn:
+        conn.execute(
+            db.SpectralTypes.insert().values(source="Fake 1", regime="optical"),
+            [
+                {
+                    "spectral_type_string": "L0",
+                    "spectral_type_code": 70.0,
+                    "spectral_type_error": 0.5,
+                    "reference": "Ref 1",
+                    "adopted": False,
+                },
+                {
+                    "spectral_type_string": "L1",
+                    "spectral_type_code": 71.0,
+                    "spectral_type_error": None,
+                    "reference": "Ref 2",
+                    "adopted": None,
+                },
+            ],
+        )
+
+    changes = recompute_adopted(db, tables=["SpectralTypes"])
+    assert [tuple(row) for row in changes] == [
+        ("SpectralTypes", "Fake 1", "Ref 1", "L0, 70.0, optical", False, True)
+    ]
+    rows = db.query(
+        db.SpectralTypes.c.regime,
+        db.SpectralTypes.c.reference,
+        db.SpectralTypes.c.adopted,
+    ).filter(db.SpectralTypes.c.source == "Fake 1")
+    assert sorted(tuple(row) for row in rows.all()) == [
+        ("nir", "Ref 1", True),
+        ("optical", "Ref 1", True),
+        ("optical", "Ref 2", None),
+    ]